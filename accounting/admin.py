@@ -1,36 +1,98 @@
-from django.contrib import admin
-from .models import PayStub, SalaryPayment, EventOccurrencePayment, Reimbursement
+from django.contrib import admin, messages
+from .models import DirectDeposit, Holiday, PayPeriod, PayStub, SalaryPayment, EventOccurrencePayment, Reimbursement
+from .payroll import close_pay_period, deferred_payroll
+
+class DeferredPayrollMixin:
+    # Every admin page that can save or delete payments does so inside
+    # deferred_payroll(), so a change form with inlines, a bulk action or a
+    # list edit recalculates each pay stub once at commit instead of once
+    # per row.
+    def changeform_view(self, *args, **kwargs):
+        with deferred_payroll():
+            return super().changeform_view(*args, **kwargs)
+
+    def changelist_view(self, *args, **kwargs):
+        with deferred_payroll():
+            return super().changelist_view(*args, **kwargs)
+
+    def delete_view(self, *args, **kwargs):
+        with deferred_payroll():
+            return super().delete_view(*args, **kwargs)
 
 class ReadOnlyIfPaidMixin(admin.ModelAdmin):
      def get_readonly_fields(self, request, obj=None):
         if obj and obj.paid:
           return self.readonly_fields + tuple([field.name for field in obj._meta.fields])
         return self.readonly_fields
+
+     def has_delete_permission(self, request, obj=None):
+        if obj and obj.paid:
+            return False
+        return super().has_delete_permission(request, obj)
         
 class PayStubAdmin(ReadOnlyIfPaidMixin):
     model = PayStub
     list_display = ('pay_date', 'user', 'total_gross_amount', 'total_reimbursement_amount', 'paid')
     list_filter = (('user', admin.RelatedOnlyFieldListFilter), 'paid')
+    actions = ['close_pay_periods']
+
+    def close_pay_periods(self, request, queryset):
+        pay_dates = sorted(set(queryset
+                                  .exclude(pay_date__isnull=True)
+                                  .values_list('pay_date', flat=True)))
+        for pay_date in pay_dates:
+            closed = close_pay_period(pay_date, request.user)
+            if closed is None:
+                self.message_user(
+                    request, 'The {0} pay period was already closed.'.format(
+                        pay_date), messages.WARNING)
+            else:
+                self.message_user(
+                    request, 'Closed the {0} pay period: {1} pay stubs '
+                    'marked paid.'.format(pay_date, closed))
+    close_pay_periods.short_description = 'Close the pay periods of the selected pay stubs'
 
 admin.site.register(PayStub, PayStubAdmin)
 
-class SalaryPaymentAdmin(ReadOnlyIfPaidMixin):
+class PayPeriodAdmin(admin.ModelAdmin):
+    model = PayPeriod
+    list_display = ('pay_date', 'closed_at', 'closed_by')
+    readonly_fields = ('pay_date', 'closed_at', 'closed_by')
+
+    def has_add_permission(self, request):
+        return False
+
+admin.site.register(PayPeriod, PayPeriodAdmin)
+
+class SalaryPaymentAdmin(DeferredPayrollMixin, ReadOnlyIfPaidMixin):
     model = SalaryPayment
     list_display = ('week_start', 'week_end', 'user', 'gross_amount', 'pay_stub', 'paid')
     list_filter = [('user', admin.RelatedOnlyFieldListFilter)]
 
 admin.site.register(SalaryPayment, SalaryPaymentAdmin)
 
-class EventOccurrencePaymentAdmin(ReadOnlyIfPaidMixin):
+class EventOccurrencePaymentAdmin(DeferredPayrollMixin, ReadOnlyIfPaidMixin):
     model = EventOccurrencePayment
     list_display = ('type', 'submission_date', 'display_event_date', 'display_event', 'display_host', 'display_number_of_teams', 'gross_amount', 'pay_stub', 'paid')
     list_filter=('type', ('event_occurrence__host', admin.RelatedOnlyFieldListFilter), ('event_occurrence__event__venue', admin.RelatedOnlyFieldListFilter), 'paid')
 
 admin.site.register(EventOccurrencePayment, EventOccurrencePaymentAdmin)
 
-class ReimbursementAdmin(ReadOnlyIfPaidMixin):
+class ReimbursementAdmin(DeferredPayrollMixin, ReadOnlyIfPaidMixin):
     model = Reimbursement
     list_display = ('submission_date', 'purchase_date', 'category', 'description', 'amount', 'documentation', 'user', 'pay_stub', 'approved', 'approved_amount', 'paid')
     list_filter = (('user', admin.RelatedOnlyFieldListFilter), 'approved')
 
 admin.site.register(Reimbursement, ReimbursementAdmin)
+
+class HolidayAdmin(admin.ModelAdmin):
+    model = Holiday
+    list_display = ('date', 'name')
+
+admin.site.register(Holiday, HolidayAdmin)
+
+class DirectDepositAdmin(admin.ModelAdmin):
+    model = DirectDeposit
+    list_display = ('user', 'account_type', 'routing_number')
+
+admin.site.register(DirectDeposit, DirectDepositAdmin)
@@ -0,0 +1,235 @@
+import csv
+import datetime
+import math
+import unicodedata
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+CSV_HEADER = [
+    'Pay date', 'Username', 'Name', 'Type', 'Date', 'Description',
+    'Gross amount', 'Reimbursement amount']
+ACH_SERVICE_CLASS = '220'
+ACH_ENTRY_CLASS = 'PPD'
+ACH_ENTRY_DESCRIPTION = 'PAYROLL'
+ACH_TRANSACTION_CODES = {'C': '22', 'S': '32'}
+ACH_BLOCKING_FACTOR = 10
+ACH_RECORD_SIZE = 94
+ACH_REQUIRED_SETTINGS = (
+    'ACH_IMMEDIATE_DESTINATION', 'ACH_IMMEDIATE_DESTINATION_NAME',
+    'ACH_IMMEDIATE_ORIGIN', 'ACH_COMPANY_NAME', 'ACH_COMPANY_ID',
+    'ACH_ORIGINATING_DFI')
+ACH_ROUTING_SETTINGS = {
+    'ACH_IMMEDIATE_DESTINATION': 9,
+    'ACH_ORIGINATING_DFI': 8,
+}
+
+# Every export reads its rows through .iterator(), i.e. a server-side cursor
+# on PostgreSQL, and yields them as it goes, so memory stays flat however
+# many pay dates are covered. Stubs and their line items come in the same
+# (pay date, user, stub) order, which lets the CSV merge them as they
+# stream instead of grouping them in memory.
+def get_export_pay_stubs(start, end):
+    PayStub = apps.get_model('accounting', 'PayStub')
+    return (PayStub
+               .objects
+               .filter(pay_date__gte=start, pay_date__lte=end)
+               .order_by('pay_date', 'user_id', 'pk')
+               .values_list(
+                   'pk', 'pay_date', 'user__username', 'user__first_name',
+                   'user__last_name', 'total_gross_amount',
+                   'total_reimbursement_amount'))
+
+def get_export_line_items(model_name, start, end, *fields):
+    model = apps.get_model('accounting', model_name)
+    return (model
+               .objects
+               .filter(pay_stub__pay_date__gte=start,
+                       pay_stub__pay_date__lte=end)
+               .order_by('pay_stub__pay_date', 'pay_stub__user_id',
+                         'pay_stub_id', 'pk')
+               .values_list('pay_stub_id', *fields))
+
+def format_salary_payment(row):
+    pay_stub_id, week_start, week_end, gross_amount = row
+    return ['Salary', week_start,
+            'Week of {0} to {1}'.format(week_start, week_end),
+            gross_amount, '']
+
+def format_event_occurrence_payment(row):
+    pay_stub_id, type, date, venue, gross_amount = row
+    return ['Private event' if type == 'P' else 'Event', date,
+            venue or '', gross_amount, '']
+
+def format_reimbursement(row):
+    pay_stub_id, purchase_date, category, description, approved_amount = row
+    Reimbursement = apps.get_model('accounting', 'Reimbursement')
+    category = dict(Reimbursement.CATEGORY).get(category, category)
+    return ['Reimbursement', purchase_date,
+            ': '.join(part for part in (category, description) if part),
+            '', approved_amount]
+
+def take_line_items(line_items, pay_stub_id):
+    # Pulls the rows for one stub off the front of an ordered iterator and
+    # keeps the first row of the next stub for the following call.
+    rows = []
+    while line_items['next'] is not None:
+        if line_items['next'][0] != pay_stub_id:
+            break
+        rows.append(line_items['next'])
+        line_items['next'] = next(line_items['rows'], None)
+    return rows
+
+class Echo:
+    def write(self, value):
+        return value
+
+def generate_payroll_csv(start, end):
+    writer = csv.writer(Echo())
+    sources = []
+    for model_name, fields, format_row in (
+            ('SalaryPayment', ('week_start', 'week_end', 'gross_amount'),
+                format_salary_payment),
+            ('EventOccurrencePayment',
+                ('type', 'event_occurrence__date',
+                 'event_occurrence__event__venue__name', 'gross_amount'),
+                format_event_occurrence_payment),
+            ('Reimbursement',
+                ('purchase_date', 'category', 'description',
+                 'approved_amount'),
+                format_reimbursement)):
+        rows = get_export_line_items(model_name, start, end, *fields).iterator()
+        sources.append(({'rows': rows, 'next': next(rows, None)}, format_row))
+    yield writer.writerow(CSV_HEADER)
+    for (pk, pay_date, username, first_name, last_name, gross_amount,
+            reimbursement_amount) in get_export_pay_stubs(start, end).iterator():
+        prefix = [pay_date, username or '',
+                  '{0} {1}'.format(first_name or '', last_name or '').strip()]
+        yield writer.writerow(prefix + [
+            'Pay stub', pay_date, '',
+            0 if gross_amount is None else gross_amount,
+            0 if reimbursement_amount is None else reimbursement_amount])
+        for line_items, format_row in sources:
+            for row in take_line_items(line_items, pk):
+                yield writer.writerow(prefix + format_row(row))
+
+def get_ach_queryset(start, end):
+    PayStub = apps.get_model('accounting', 'PayStub')
+    return (PayStub
+               .objects
+               .filter(pay_date__gte=start, pay_date__lte=end,
+                       user__direct_deposit__isnull=False)
+               .order_by('pay_date', 'user_id', 'pk')
+               .values_list(
+                   'pay_date', 'user_id', 'user__username',
+                   'user__first_name', 'user__last_name',
+                   'user__direct_deposit__routing_number',
+                   'user__direct_deposit__account_number',
+                   'user__direct_deposit__account_type',
+                   'total_gross_amount', 'total_reimbursement_amount'))
+
+def check_ach_settings():
+    # A file with blank or zero-filled originator details still looks
+    # valid, and the bank rejects or, worse, misroutes it.
+    missing = [name for name in ACH_REQUIRED_SETTINGS
+               if not str(getattr(settings, name, '') or '').strip()]
+    if missing:
+        raise ImproperlyConfigured(
+            'Set {0} to export an ACH file.'.format(', '.join(missing)))
+    for name, length in ACH_ROUTING_SETTINGS.items():
+        value = str(getattr(settings, name))
+        if len(value) != length or not value.isdigit():
+            raise ImproperlyConfigured(
+                '{0} must be {1} digits.'.format(name, length))
+
+def ach_text(value, length):
+    # Fixed-width, upper-case ASCII, left justified.
+    value = unicodedata.normalize('NFKD', str(value or ''))
+    value = value.encode('ascii', 'ignore').decode().upper()
+    return value[:length].ljust(length)
+
+def ach_number(value, length):
+    return str(value).rjust(length, '0')[-length:]
+
+def ach_record(*fields):
+    return ''.join(fields) + '\n'
+
+def generate_nacha(start, end, now=None):
+    # One PPD credit batch per pay date, settling on the pay date, with an
+    # entry for every stub whose user has a direct deposit account and
+    # something to be paid. Batch and file control totals are kept as the
+    # entries stream, so nothing is held back.
+    check_ach_settings()
+    now = now or datetime.datetime.now()
+    origin_dfi = ach_number(settings.ACH_ORIGINATING_DFI, 8)
+    company_id = ach_text(settings.ACH_COMPANY_ID, 10)
+    records = 0
+    batches = 0
+    file_entries = 0
+    file_hash = 0
+    file_credit = 0
+
+    def batch_control(number, entries, entry_hash, credit):
+        return ach_record(
+            '8', ACH_SERVICE_CLASS, ach_number(entries, 6),
+            ach_number(entry_hash, 10), ach_number(0, 12),
+            ach_number(credit, 12), company_id, ' ' * 19, ' ' * 6,
+            origin_dfi, ach_number(number, 7))
+
+    records += 1
+    yield ach_record(
+        '1', '01', ' ' + ach_number(settings.ACH_IMMEDIATE_DESTINATION, 9),
+        str(settings.ACH_IMMEDIATE_ORIGIN)[:10].rjust(10),
+        now.strftime('%y%m%d'), now.strftime('%H%M'), 'A', '094', '10', '1',
+        ach_text(settings.ACH_IMMEDIATE_DESTINATION_NAME, 23),
+        ach_text(settings.ACH_COMPANY_NAME, 23), ' ' * 8)
+    batch_date = None
+    for (pay_date, user_id, username, first_name, last_name, routing_number,
+            account_number, account_type, gross_amount,
+            reimbursement_amount) in get_ach_queryset(start, end).iterator():
+        amount = int(round(
+            ((gross_amount or 0) + (reimbursement_amount or 0)) * 100))
+        if amount <= 0:
+            continue
+        if pay_date != batch_date:
+            if batch_date is not None:
+                records += 1
+                yield batch_control(
+                    batches, batch_entries, batch_hash, batch_credit)
+            batches += 1
+            batch_date = pay_date
+            batch_entries = batch_hash = batch_credit = 0
+            records += 1
+            yield ach_record(
+                '5', ACH_SERVICE_CLASS,
+                ach_text(settings.ACH_COMPANY_NAME, 16), ' ' * 20,
+                company_id, ACH_ENTRY_CLASS,
+                ach_text(ACH_ENTRY_DESCRIPTION, 10),
+                pay_date.strftime('%y%m%d'), pay_date.strftime('%y%m%d'),
+                ' ' * 3, '1', origin_dfi, ach_number(batches, 7))
+        batch_entries += 1
+        file_entries += 1
+        batch_hash += int(routing_number[:8])
+        file_hash += int(routing_number[:8])
+        batch_credit += amount
+        file_credit += amount
+        name = '{0} {1}'.format(first_name or '', last_name or '').strip()
+        records += 1
+        yield ach_record(
+            '6', ACH_TRANSACTION_CODES.get(account_type, '22'),
+            routing_number[:8], routing_number[8], ach_text(account_number, 17),
+            ach_number(amount, 10), ach_text(user_id, 15),
+            ach_text(name or username, 22), '  ', '0',
+            origin_dfi + ach_number(file_entries, 7))
+    if batch_date is not None:
+        records += 1
+        yield batch_control(batches, batch_entries, batch_hash, batch_credit)
+    records += 1
+    blocks = math.ceil(records / ACH_BLOCKING_FACTOR)
+    yield ach_record(
+        '9', ach_number(batches, 6), ach_number(blocks, 6),
+        ach_number(file_entries, 8), ach_number(file_hash, 10),
+        ach_number(0, 12), ach_number(file_credit, 12), ' ' * 39)
+    for filler in range(blocks * ACH_BLOCKING_FACTOR - records):
+        yield '9' * ACH_RECORD_SIZE + '\n'
@@ -0,0 +1,40 @@
+import datetime
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.exports import (
+    check_ach_settings, generate_nacha, generate_payroll_csv)
+
+class Command(BaseCommand):
+    help = ('Writes every pay stub between two pay dates as CSV line items '
+            'or as a NACHA (ACH) file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start', required=True,
+            help='First pay date to export as YYYY-MM-DD.')
+        parser.add_argument(
+            '--end',
+            help='Last pay date to export as YYYY-MM-DD (default start).')
+        parser.add_argument(
+            '--format', choices=['csv', 'ach'], default='csv',
+            help='Export format (default csv).')
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.datetime.strptime(
+                options['start'], '%Y-%m-%d').date()
+            end = datetime.datetime.strptime(
+                options['end'] or options['start'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError('Pay dates must be given as YYYY-MM-DD.')
+        generate = generate_payroll_csv
+        if options['format'] == 'ach':
+            try:
+                check_ach_settings()
+            except ImproperlyConfigured as error:
+                raise CommandError(error)
+            generate = generate_nacha
+        for chunk in generate(start, end):
+            self.stdout.write(chunk, ending='')
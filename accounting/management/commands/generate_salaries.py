@@ -0,0 +1,34 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.models import generate_salary_payments
+
+class Command(BaseCommand):
+    help = ('Creates a week of salary payments for every regional manager, '
+            'skipping company holidays and managers already paid for it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--week-start',
+            help='Monday of the week as YYYY-MM-DD (default last Monday).')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        if options['week_start']:
+            try:
+                week_start = datetime.datetime.strptime(
+                    options['week_start'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(
+                    'Week start must be given as YYYY-MM-DD.')
+        else:
+            today = datetime.date.today()
+            week_start = today - datetime.timedelta(
+                days=today.weekday() + 7)
+        salary_payments = generate_salary_payments(week_start)
+        self.stdout.write(self.style.SUCCESS(
+            'Created {0} salary payments for the week of {1} '
+            'in {2:.2f}s'.format(
+                len(salary_payments), week_start, time.time() - started)))
@@ -0,0 +1,41 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.models import get_pay_date, payday
+from accounting.payroll import run_payroll
+
+class Command(BaseCommand):
+    help = ('Recomputes the totals of every unpaid pay stub for a pay date '
+            'and reports the stubs whose stored totals had drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pay-date',
+            help='Pay date as YYYY-MM-DD (default the next payday).')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted stubs without correcting them.')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        if options['pay_date']:
+            try:
+                pay_date = datetime.datetime.strptime(
+                    options['pay_date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(
+                    'Pay date must be given as YYYY-MM-DD.')
+        else:
+            pay_date = get_pay_date(datetime.date.today(), payday)
+        checked, drifted = run_payroll(pay_date, dry_run=options['dry_run'])
+        for pay_stub, gross, reimbursement in drifted:
+            self.stdout.write(
+                '{0}: gross {1} -> {2}, reimbursement {3} -> {4}'.format(
+                    pay_stub.user, gross, pay_stub.total_gross_amount,
+                    reimbursement, pay_stub.total_reimbursement_amount))
+        self.stdout.write(self.style.SUCCESS(
+            '{0} {1} of {2} pay stubs for {3} in {4:.2f}s'.format(
+                'Found' if options['dry_run'] else 'Corrected',
+                len(drifted), checked, pay_date, time.time() - started)))
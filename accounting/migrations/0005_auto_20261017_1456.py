@@ -0,0 +1,33 @@
+# Generated by Django 2.2 on 2026-10-17 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0004_auto_20190807_1522'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventoccurrencepayment',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='paystub',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='reimbursement',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='salarypayment',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
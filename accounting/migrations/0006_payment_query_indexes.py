@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-17 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0005_auto_20261017_1456'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eventoccurrencepayment',
+            index=models.Index(fields=['pay_stub', 'paid'], name='eo_payment_pay_stub_idx'),
+        ),
+    ]
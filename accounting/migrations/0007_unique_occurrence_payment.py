@@ -0,0 +1,45 @@
+# Generated by Django 2.2 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+def detach_duplicate_payments(apps, schema_editor):
+    # Keeps one payment per occurrence, preferring one that was already
+    # paid. The others stay on their pay stubs for the record but no longer
+    # point at the occurrence.
+    EventOccurrencePayment = apps.get_model(
+        'accounting', 'EventOccurrencePayment')
+    duplicates = (EventOccurrencePayment
+                     .objects
+                     .filter(event_occurrence__isnull=False)
+                     .order_by()
+                     .values_list('event_occurrence')
+                     .annotate(count=models.Count('pk'))
+                     .filter(count__gt=1))
+    for event_occurrence_id, count in duplicates:
+        pks = list(EventOccurrencePayment
+                      .objects
+                      .filter(event_occurrence=event_occurrence_id)
+                      .order_by('-paid', 'pk')
+                      .values_list('pk', flat=True))
+        (EventOccurrencePayment
+            .objects
+            .filter(pk__in=pks[1:])
+            .update(event_occurrence=None))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0006_payment_query_indexes'),
+        ('schedule', '0010_unique_event_occurrence'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            detach_duplicate_payments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='eventoccurrencepayment',
+            constraint=models.UniqueConstraint(fields=('event_occurrence',), name='unique_occurrence_payment'),
+        ),
+    ]
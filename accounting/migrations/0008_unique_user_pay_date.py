@@ -0,0 +1,77 @@
+# Generated by Django 2.2 on 2026-10-17 19:22
+
+import datetime
+
+from django.db import migrations, models
+
+
+def merge_pay_stubs(apps, from_stub, into_stub):
+    for name in ('SalaryPayment', 'EventOccurrencePayment', 'Reimbursement'):
+        (apps.get_model('accounting', name)
+            .objects
+            .filter(pay_stub=from_stub)
+            .update(pay_stub=into_stub))
+    into_stub.total_gross_amount = (
+        (into_stub.total_gross_amount or 0)
+        + (from_stub.total_gross_amount or 0))
+    into_stub.total_reimbursement_amount = (
+        (into_stub.total_reimbursement_amount or 0)
+        + (from_stub.total_reimbursement_amount or 0))
+    into_stub.save()
+    from_stub.delete()
+
+
+def merge_duplicate_pay_stubs(apps, schema_editor):
+    # Duplicates that share the kept stub's paid state are folded into it.
+    # An unpaid duplicate of a paid stub moves to the next week that has no
+    # paid stub, as find_pay_stub would have done for its payments.
+    PayStub = apps.get_model('accounting', 'PayStub')
+    duplicates = (PayStub
+                     .objects
+                     .filter(user__isnull=False, pay_date__isnull=False)
+                     .order_by()
+                     .values_list('user', 'pay_date')
+                     .annotate(count=models.Count('pk'))
+                     .filter(count__gt=1))
+    for user_id, pay_date, count in duplicates:
+        pay_stubs = list(PayStub
+                            .objects
+                            .filter(user=user_id, pay_date=pay_date)
+                            .order_by('-paid', 'pk'))
+        kept = pay_stubs[0]
+        for pay_stub in pay_stubs[1:]:
+            if pay_stub.paid == kept.paid:
+                merge_pay_stubs(apps, pay_stub, kept)
+                continue
+            date = pay_date
+            while True:
+                date = date + datetime.timedelta(days=7)
+                existing = PayStub.objects.filter(
+                    user=user_id, pay_date=date).order_by('-paid').first()
+                if existing is None:
+                    pay_stub.pay_date = date
+                    pay_stub.save()
+                    break
+                if not existing.paid:
+                    merge_pay_stubs(apps, pay_stub, existing)
+                    break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0007_unique_occurrence_payment'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_pay_stubs, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='paystub',
+            index=models.Index(fields=['user', 'paid', 'pay_date'], name='pay_stub_user_unpaid_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='paystub',
+            constraint=models.UniqueConstraint(fields=('user', 'pay_date'), name='unique_user_pay_date'),
+        ),
+    ]
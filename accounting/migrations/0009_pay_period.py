@@ -0,0 +1,28 @@
+# Generated by Django 2.2 on 2026-10-17 19:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting', '0008_unique_user_pay_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pay_date', models.DateField(unique=True)),
+                ('closed_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='closed_pay_periods', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-pay_date'],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2 on 2026-10-17 19:39
+
+import accounting.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting', '0010_holiday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectDeposit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('routing_number', models.CharField(max_length=9, validators=[accounting.models.validate_routing_number])),
+                ('account_number', models.CharField(max_length=17)),
+                ('account_type', models.CharField(choices=[('C', 'Checking'), ('S', 'Savings')], default='C', max_length=1)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='direct_deposit', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-17 20:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0011_direct_deposit'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paystub',
+            name='pay_stub_user_unpaid_idx',
+        ),
+    ]
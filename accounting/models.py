@@ -1,15 +1,21 @@
 import datetime
 import numpy
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db.models import Sum
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 from accounts.models import HostProfile, RegionalManagerProfile
 from schedule.models import EventOccurrence
+from triviacompany.tracking import FieldTrackerMixin
+
+from .payroll import (
+    annotate_pay_stub_totals, correct_pay_stub_totals, get_payroll_batch,
+    move_pay_stub_amounts)
 
 private_event_pay = 150
 payday = 4 # Mon = 0, Tues = 1, Wed = 2, etc..
@@ -21,24 +27,146 @@ def get_pay_date(date, payday):
     return date + datetime.timedelta(days_left_until_payday)
 
 def find_pay_stub(user, date):
+    batch = get_payroll_batch()
+    key = (user and user.pk, date)
+    if batch is not None and key in batch.found_pay_stubs:
+        return batch.found_pay_stubs[key]
     pay_date = get_pay_date(date, payday)
-    pay_stub, created  = PayStub.objects.get_or_create(
-        pay_date=pay_date, user=user)
-    while pay_stub.paid:
-        pay_date = pay_date + datetime.timedelta(days=7)
-        pay_stub, created  = PayStub.objects.get_or_create(
-            pay_date=pay_date, user=user)
-    return pay_stub
+    while True:
+        # Reads the user's stubs from the pay date on once and walks them in
+        # memory: the first unpaid one wins, and a paid one pushes the
+        # payment to the following week. A closed period pushes it on too,
+        # but only matters for a week without a stub, so the closed periods
+        # are read once, the first time the walk reaches such a week.
+        pay_stubs = {
+            existing.pay_date: existing
+            for existing in PayStub.objects.filter(
+                user=user, pay_date__gte=pay_date)}
+        closed_pay_dates = None
+        while True:
+            pay_stub = pay_stubs.get(pay_date)
+            if pay_stub is not None:
+                if not pay_stub.paid:
+                    break
+            else:
+                if closed_pay_dates is None:
+                    closed_pay_dates = set(PayPeriod
+                                              .objects
+                                              .filter(pay_date__gte=pay_date)
+                                              .values_list(
+                                                  'pay_date', flat=True))
+                if pay_date not in closed_pay_dates:
+                    break
+            pay_date = pay_date + datetime.timedelta(days=7)
+        if pay_stub is None:
+            # If a concurrent payment inserted the same stub first, the
+            # unique constraint rejects this insert and both use that row.
+            # Should it have been paid in the meantime, walk again.
+            try:
+                with transaction.atomic():
+                    pay_stub = PayStub.objects.create(
+                        pay_date=pay_date, user=user)
+            except IntegrityError:
+                pay_stub = PayStub.objects.get(pay_date=pay_date, user=user)
+                if pay_stub.paid:
+                    continue
+        if batch is not None:
+            batch.found_pay_stubs[key] = pay_stub
+        return pay_stub
+
+def find_pay_stubs(users, date):
+    # find_pay_stub for many users at once: one read of their stubs from
+    # the pay date on, one of the closed periods, and one bulk insert for
+    # the stubs that are missing.
+    first_pay_date = get_pay_date(date, payday)
+    closed_pay_dates = set(PayPeriod
+                              .objects
+                              .filter(pay_date__gte=first_pay_date)
+                              .values_list('pay_date', flat=True))
+    existing = {
+        (pay_stub.user_id, pay_stub.pay_date): pay_stub
+        for pay_stub in PayStub.objects.filter(
+            user__in=users, pay_date__gte=first_pay_date)}
+    pay_stubs = {}
+    missing = []
+    for user in users:
+        pay_date = first_pay_date
+        while True:
+            pay_stub = existing.get((user.pk, pay_date))
+            if pay_stub is not None and not pay_stub.paid:
+                pay_stubs[user.pk] = pay_stub
+                break
+            if pay_stub is None and pay_date not in closed_pay_dates:
+                missing.append(PayStub(
+                    user=user, pay_date=pay_date, total_gross_amount=0,
+                    total_reimbursement_amount=0))
+                break
+            pay_date = pay_date + datetime.timedelta(days=7)
+    if missing:
+        # bulk_create only sets primary keys on PostgreSQL, and a stub a
+        # concurrent payment inserted first is skipped, so the new stubs are
+        # read back.
+        PayStub.objects.bulk_create(missing, ignore_conflicts=True)
+        wanted = set((pay_stub.user_id, pay_stub.pay_date)
+                     for pay_stub in missing)
+        for pay_stub in PayStub.objects.filter(
+                user__in=[pay_stub.user_id for pay_stub in missing],
+                pay_date__in=set(pay_date for user, pay_date in wanted)):
+            if (pay_stub.user_id, pay_stub.pay_date) in wanted:
+                pay_stubs[pay_stub.user_id] = pay_stub
+    return pay_stubs
+
+def get_holidays(start, end):
+    return list(Holiday
+                   .objects
+                   .filter(date__gte=start, date__lt=end)
+                   .values_list('date', flat=True))
+
+def generate_salary_payments(week_start, week_end=None):
+    # A week of salary for every regional manager in a fixed number of
+    # queries: days worked come from one busday_count over all of them, and
+    # the payments and their stubs are written in bulk, bypassing
+    # SalaryPayment.save(). Managers already paid for the week are skipped.
+    week_end = week_end or week_start + datetime.timedelta(days=5)
+    profiles = list(RegionalManagerProfile
+                       .objects
+                       .filter(user__is_regional_manager=True,
+                               weekly_pay__isnull=False)
+                       .exclude(user__salary_payments__week_start=week_start)
+                       .select_related('user')
+                       .order_by('user'))
+    if not profiles:
+        return []
+    days_worked = numpy.busday_count(
+        numpy.full(len(profiles), week_start, dtype='datetime64[D]'),
+        numpy.full(len(profiles), week_end, dtype='datetime64[D]'),
+        holidays=get_holidays(week_start, week_end))
+    with transaction.atomic():
+        pay_stubs = find_pay_stubs(
+            [profile.user for profile in profiles], week_end)
+        salary_payments = [
+            SalaryPayment(
+                week_start=week_start, week_end=week_end, user=profile.user,
+                gross_amount=int(days) * (profile.weekly_pay/5),
+                pay_stub=pay_stubs[profile.user_id])
+            for profile, days in zip(profiles, days_worked)]
+        SalaryPayment.objects.bulk_create(salary_payments, batch_size=500)
+        correct_pay_stub_totals(PayStub.objects.filter(
+            pk__in=[pay_stub.pk for pay_stub in pay_stubs.values()]))
+    return salary_payments
 
 def edited(object, monitored_fields):
-    cls = object.__class__
-    original = cls.objects.get(pk=object.pk)
-    fields = cls._meta.get_fields()
-    changed_fields = []
-    for field in fields:
-        if getattr(original, field.name) != getattr(object, field.name):
-            changed_fields.append(field.name)
-    monitored_fields = monitored_fields
+    changed_fields = None
+    if object.pk and hasattr(object, 'get_dirty_fields'):
+        changed_fields = object.get_dirty_fields()
+    if changed_fields is None:
+        cls = object.__class__
+        original = cls.objects.get(pk=object.pk)
+        changed_fields = []
+        for field in cls._meta.concrete_fields:
+            if (getattr(original, field.attname)
+                    != getattr(object, field.attname)):
+                changed_fields.append(field.name)
     if any(field in monitored_fields for field in changed_fields):
         return True
 
@@ -47,7 +175,58 @@ def documentation_path(instance, filename):
     sub_folder = str(instance.user.username)
     return '{0}/{1}/{2}_{3}'.format(folder, sub_folder, instance.purchase_date, filename)
     
-class PayStub(models.Model):
+class Holiday(models.Model):
+    date = models.DateField(unique=True)
+    name = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ["date"]
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.date, self.name)
+
+class PayPeriod(models.Model):
+    pay_date = models.DateField(unique=True)
+    closed_at = models.DateTimeField(auto_now_add=True)
+    closed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True,
+        blank=True, related_name='closed_pay_periods')
+
+    class Meta:
+        ordering = ["-pay_date"]
+
+    def __str__(self):
+        return '{0} (closed {1})'.format(self.pay_date, self.closed_at)
+
+def validate_routing_number(value):
+    # ABA routing numbers carry a weighted checksum over their nine digits.
+    if (len(value) != 9 or not value.isdigit()
+            or sum(int(digit) * weight for digit, weight
+                   in zip(value, (3, 7, 1) * 3)) % 10):
+        raise ValidationError(
+            _('Enter a valid nine-digit routing number.'), code='invalid')
+
+class DirectDeposit(models.Model):
+    ACCOUNT_TYPE = (
+        ('C', 'Checking'),
+        ('S', 'Savings'),
+    )
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+        related_name='direct_deposit')
+    routing_number = models.CharField(
+        max_length=9, validators=[validate_routing_number])
+    account_number = models.CharField(max_length=17)
+    account_type = models.CharField(
+        max_length=1, default='C', choices=ACCOUNT_TYPE)
+
+    def __str__(self):
+        return '{0}: {1} ****{2}'.format(
+            self.user, self.get_account_type_display(),
+            self.account_number[-4:])
+
+class PayStub(FieldTrackerMixin, models.Model):
     pay_date = models.DateField(null=True, blank=True)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True,
@@ -57,10 +236,17 @@ class PayStub(models.Model):
     total_reimbursement_amount = models.DecimalField(
         max_digits=5, decimal_places=2, null=True, blank=True)
     paid = models.BooleanField('paid', default=False)
+    modified = models.DateTimeField(auto_now=True)
 
     class Meta:
         #db_table = "pay_stub"
         ordering = ["pay_date"]
+        # The unique constraint's (user, pay_date) index also serves
+        # find_pay_stub's read of a user's stubs from a pay date on.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'pay_date'], name='unique_user_pay_date'),
+        ]
      
     def __str__(self):
         return '{0}: {1} - GROSS: {2}, REIM: {3}'.format(
@@ -71,6 +257,12 @@ class PayStub(models.Model):
         return reverse('pay-stub-detail', args=[self.pk])
 
     def save(self, *args, **kwargs):
+        # A stub that has been paid is the record of what went out: its
+        # totals are no longer recomputed (its payments are all paid, so
+        # they would add up to nothing) and it is never deleted.
+        if self.pk and self.was_paid():
+            super(PayStub, self).save(*args, **kwargs)
+            return
         self.calculate_pay()
         if self.paid:
             self.mark_all_paid()
@@ -83,29 +275,90 @@ class PayStub(models.Model):
         else:
             super(PayStub, self).save(*args, **kwargs)
 
+    def clean(self):
+        if (not self.paid and self.pay_date
+                and PayPeriod.objects.filter(pay_date=self.pay_date).exists()):
+            raise ValidationError({
+                'pay_date': ValidationError(
+                    _('This pay period has been closed.'), code='invalid')})
+
+    def was_paid(self):
+        loaded_values = getattr(self, 'loaded_values', None)
+        if loaded_values is None or 'paid' not in loaded_values:
+            return PayStub.objects.filter(pk=self.pk, paid=True).exists()
+        return loaded_values['paid']
+
     def mark_all_paid(self):
-        self.salary_payments.all().update(paid=True)
-        self.event_occurrence_payments.all().update(paid=True)
-        self.reimbursements.all().update(paid=True)
+        now = timezone.now()
+        self.salary_payments.all().update(paid=True, modified=now)
+        self.event_occurrence_payments.all().update(paid=True, modified=now)
+        self.reimbursements.all().update(paid=True, modified=now)
 
     def calculate_pay(self):
-        salary_payments = (SalaryPayment
-                              .objects
-                              .filter(paid=False, pay_stub=self)
-                              .aggregate(sum=Sum('gross_amount')))
-        event_occurrence_payments = (EventOccurrencePayment
-                                        .objects
-                                        .filter(paid=False, pay_stub=self)
-                                        .aggregate(sum=Sum('gross_amount')))
-        reimbursements = (Reimbursement
-                              .objects
-                              .filter(paid=False, approved=True, pay_stub=self)
-                              .aggregate(sum=Sum('approved_amount')))
-        self.total_gross_amount = ((salary_payments['sum'] or 0)
-                                  + (event_occurrence_payments['sum'] or 0))
-        self.total_reimbursement_amount = reimbursements['sum'] or 0
+        if not self.pk:
+            # Nothing can point at a stub that has not been saved yet.
+            self.total_gross_amount = 0
+            self.total_reimbursement_amount = 0
+            return
+        # Payments keep the totals current as they are saved; this
+        # recomputes them from scratch in one query.
+        totals = (annotate_pay_stub_totals(PayStub.objects.filter(pk=self.pk))
+                     .values('salary_sum', 'event_occurrence_sum',
+                             'reimbursement_sum')
+                     .first()) or {}
+        self.total_gross_amount = ((totals.get('salary_sum') or 0)
+                                  + (totals.get('event_occurrence_sum') or 0))
+        self.total_reimbursement_amount = totals.get('reimbursement_sum') or 0
+
+class PayStubShareMixin(FieldTrackerMixin):
+    # A payment adds only the difference it makes to its stub's totals,
+    # worked out from the values it was loaded with.
+
+    def get_pay_stub_share(self, values):
+        if values['paid']:
+            return values['pay_stub_id'], 0, 0
+        return values['pay_stub_id'], values['gross_amount'] or 0, 0
 
-class SalaryPayment(models.Model):
+    def is_locked(self):
+        # Paid, or on a stub whose pay period has been closed: either way
+        # the payment is part of a payroll that has gone out.
+        values = getattr(self, 'loaded_values', None) or {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields}
+        if values.get('paid', self.paid):
+            return True
+        pay_stub_id = values.get('pay_stub_id', self.pay_stub_id)
+        if not pay_stub_id:
+            return False
+        pay_stub = self._state.fields_cache.get('pay_stub')
+        if pay_stub is None or pay_stub.pk != pay_stub_id:
+            pay_stub = PayStub.objects.filter(pk=pay_stub_id).first()
+        if pay_stub is None or pay_stub.paid or not pay_stub.pay_date:
+            return bool(pay_stub and pay_stub.paid)
+        return PayPeriod.objects.filter(pay_date=pay_stub.pay_date).exists()
+
+    def save(self, *args, **kwargs):
+        before = (None, 0, 0)
+        left_pay_stub_pk = None
+        if self.pk:
+            try:
+                before = self.get_pay_stub_share(self.loaded_values)
+            except (AttributeError, KeyError):
+                # No snapshot to go by, so the stub the row is on now gets
+                # recomputed along with the new one.
+                before = None
+                left_pay_stub_pk = (type(self)
+                    .objects
+                    .filter(pk=self.pk)
+                    .values_list('pay_stub_id', flat=True)
+                    .first())
+        super().save(*args, **kwargs)
+        move_pay_stub_amounts(before, self.get_pay_stub_share(
+            {field.attname: self.get_tracked_value(field)
+             for field in self._meta.concrete_fields}),
+            self._state.fields_cache.get('pay_stub'), left_pay_stub_pk)
+
+class SalaryPayment(PayStubShareMixin, models.Model):
     week_start = models.DateField(
         null=True, blank=True,
         help_text='First date employee worked, i.e.,\
@@ -123,6 +376,7 @@ class SalaryPayment(models.Model):
         PayStub, on_delete=models.SET_NULL, null=True,
         blank=True, related_name='salary_payments')
     paid = models.BooleanField('paid', default=False)
+    modified = models.DateTimeField(auto_now=True)
     
     class Meta:
         #db_table = "salary_payment"
@@ -139,11 +393,12 @@ class SalaryPayment(models.Model):
             pay_stub = find_pay_stub(self.user, self.week_end)
             self.pay_stub = pay_stub
             super(SalaryPayment, self).save(*args, **kwargs)
-            pay_stub.save()
 
     def calculate_pay(self):
         profile = RegionalManagerProfile.objects.get(user=self.user)
-        days_worked = numpy.busday_count(self.week_start, self.week_end)
+        days_worked = numpy.busday_count(
+            self.week_start, self.week_end,
+            holidays=get_holidays(self.week_start, self.week_end))
         daily_pay = profile.weekly_pay/5
         pay = days_worked * daily_pay
         self.gross_amount = pay
@@ -183,7 +438,7 @@ class SalaryPayment(models.Model):
                     _(''), code='invalid'),
                 })
 
-class EventOccurrencePayment(models.Model):
+class EventOccurrencePayment(PayStubShareMixin, models.Model):
 
     TYPE = (
         ('R','Regular Event'),
@@ -202,10 +457,19 @@ class EventOccurrencePayment(models.Model):
     pay_stub = models.ForeignKey(
         PayStub, on_delete=models.SET_NULL, null=True,
         blank=True, related_name='event_occurrence_payments')
+    modified = models.DateTimeField(auto_now=True)
     
     class Meta:
         #db_table = 'event_occurrence_payment'
         ordering = ['submission_date', 'pay_stub']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['event_occurrence'], name='unique_occurrence_payment'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['pay_stub', 'paid'], name='eo_payment_pay_stub_idx'),
+        ]
     
     def __str__(self):
         return '{0} {1} {2} {3}'.format(
@@ -228,7 +492,6 @@ class EventOccurrencePayment(models.Model):
             pay_stub = find_pay_stub(self.event_occurrence.host, self.submission_date)
             self.pay_stub = pay_stub
             super(EventOccurrencePayment, self).save(*args, **kwargs)
-            pay_stub.save()
 
     def clean(self):
         # can set blank = False
@@ -277,7 +540,7 @@ class EventOccurrencePayment(models.Model):
 
     display_number_of_teams.short_description = 'Number of Teams'
 
-class Reimbursement(models.Model):
+class Reimbursement(PayStubShareMixin, models.Model):
     submission_date = models.DateField(null=True, blank=True)
     purchase_date = models.DateField(null=True, blank=True)
     
@@ -304,6 +567,7 @@ class Reimbursement(models.Model):
     approved_amount = models.DecimalField(
         max_digits=5, decimal_places=2, null=True, blank=True)
     paid = models.BooleanField('paid', default=False)
+    modified = models.DateTimeField(auto_now=True)
 
     class Meta:
         #db_table = "reimbursement"
@@ -328,16 +592,15 @@ class Reimbursement(models.Model):
                 pay_stub = find_pay_stub(self.user, self.submission_date)
                 self.pay_stub = pay_stub
                 super(Reimbursement, self).save(*args, **kwargs)
-                pay_stub.save()
             elif not self.approved:
                 self.approved_amount = None
-                if self.pay_stub:
-                    pay_stub = self.pay_stub
-                    self.pay_stub = None
-                    super(Reimbursement, self).save(*args, **kwargs)
-                    pay_stub.save()
-                else:
-                    super(Reimbursement, self).save(*args, **kwargs)
+                self.pay_stub = None
+                super(Reimbursement, self).save(*args, **kwargs)
+
+    def get_pay_stub_share(self, values):
+        if values['paid'] or not values['approved']:
+            return values['pay_stub_id'], 0, 0
+        return values['pay_stub_id'], 0, values['approved_amount'] or 0
 
     def clean(self):
         if self.approved and not self.approved_amount:
@@ -0,0 +1,186 @@
+import threading
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+_state = threading.local()
+
+# Inside deferred_payroll() a payment only marks its pay stub as dirty;
+# the totals are recalculated once per stub when the transaction commits,
+# so editing N occurrences of the same weeks costs a query per stub rather
+# than a handful per occurrence. Outside of it stubs are saved right away.
+class PayrollBatch:
+
+    def __init__(self):
+        self.pay_stub_pks = set()
+        self.found_pay_stubs = {}
+
+    def flush(self):
+        PayStub = apps.get_model('accounting', 'PayStub')
+        with transaction.atomic():
+            for pay_stub in PayStub.objects.filter(pk__in=self.pay_stub_pks):
+                pay_stub.save()
+
+def get_payroll_batch():
+    return getattr(_state, 'batch', None)
+
+@contextmanager
+def deferred_payroll():
+    if get_payroll_batch() is not None:
+        yield get_payroll_batch()
+        return
+    batch = _state.batch = PayrollBatch()
+    try:
+        yield batch
+    finally:
+        _state.batch = None
+    transaction.on_commit(batch.flush)
+
+def recalculate_pay_stub(pay_stub):
+    batch = get_payroll_batch()
+    if batch is None:
+        pay_stub.save()
+    elif pay_stub.pk:
+        batch.pay_stub_pks.add(pay_stub.pk)
+
+def adjust_pay_stub_totals(pay_stub_pk, gross=0, reimbursement=0):
+    # Adds a payment's difference to its stub in the database, so saves
+    # racing on the same stub cannot overwrite each other's totals.
+    if not pay_stub_pk or not (gross or reimbursement):
+        return
+    batch = get_payroll_batch()
+    if batch is not None:
+        batch.pay_stub_pks.add(pay_stub_pk)
+        return
+    PayStub = apps.get_model('accounting', 'PayStub')
+    PayStub.objects.filter(pk=pay_stub_pk).update(
+        total_gross_amount=Coalesce('total_gross_amount', 0) + gross,
+        total_reimbursement_amount=(
+            Coalesce('total_reimbursement_amount', 0) + reimbursement),
+        modified=timezone.now())
+    if gross < 0 or reimbursement < 0:
+        # A stub left with nothing on it goes away, as PayStub.save() does.
+        (PayStub
+            .objects
+            .filter(pk=pay_stub_pk, paid=False)
+            .filter(Q(total_gross_amount=0)
+                    | Q(total_gross_amount__isnull=True))
+            .filter(Q(total_reimbursement_amount=0)
+                    | Q(total_reimbursement_amount__isnull=True))
+            .delete())
+
+def move_pay_stub_amounts(before, after, pay_stub=None, left_pay_stub_pk=None):
+    # `before` and `after` are a payment's (pay stub pk, gross,
+    # reimbursement) share before and after a save; None means the share
+    # before the save is unknown and the stubs are recomputed instead, both
+    # the new one and `left_pay_stub_pk`, the one the row was on. The
+    # payment's own stub instance, if given, follows along in memory.
+    if (before is not None and pay_stub is not None
+            and pay_stub.pk == after[0] and get_payroll_batch() is None):
+        added = (after[1], after[2])
+        if before[0] == after[0]:
+            added = (after[1] - before[1], after[2] - before[2])
+        pay_stub.total_gross_amount = (
+            (pay_stub.total_gross_amount or 0) + added[0])
+        pay_stub.total_reimbursement_amount = (
+            (pay_stub.total_reimbursement_amount or 0) + added[1])
+    if before is None:
+        PayStub = apps.get_model('accounting', 'PayStub')
+        pay_stubs = (PayStub
+            .objects
+            .filter(pk__in={left_pay_stub_pk, after[0]} - {None}))
+        for pay_stub in pay_stubs:
+            recalculate_pay_stub(pay_stub)
+    elif before[0] == after[0]:
+        adjust_pay_stub_totals(
+            after[0], after[1] - before[1], after[2] - before[2])
+    else:
+        adjust_pay_stub_totals(before[0], -before[1], -before[2])
+        adjust_pay_stub_totals(after[0], after[1], after[2])
+
+def get_unpaid_sum(model, field, **filters):
+    sums = (model
+               .objects
+               .filter(pay_stub=OuterRef('pk'), paid=False, **filters)
+               .order_by()
+               .values('pay_stub')
+               .annotate(sum=Sum(field))
+               .values('sum'))
+    return Subquery(
+        sums, output_field=models.DecimalField(max_digits=8, decimal_places=2))
+
+def annotate_pay_stub_totals(queryset):
+    SalaryPayment = apps.get_model('accounting', 'SalaryPayment')
+    EventOccurrencePayment = apps.get_model(
+        'accounting', 'EventOccurrencePayment')
+    Reimbursement = apps.get_model('accounting', 'Reimbursement')
+    return queryset.annotate(
+        salary_sum=get_unpaid_sum(SalaryPayment, 'gross_amount'),
+        event_occurrence_sum=get_unpaid_sum(
+            EventOccurrencePayment, 'gross_amount'),
+        reimbursement_sum=get_unpaid_sum(
+            Reimbursement, 'approved_amount', approved=True))
+
+def correct_pay_stub_totals(pay_stubs, dry_run=False):
+    # Recomputes the given stubs in one query, the same sums
+    # PayStub.calculate_pay() adds up per stub, and writes back only the
+    # stubs whose stored totals have drifted.
+    PayStub = apps.get_model('accounting', 'PayStub')
+    now = timezone.now()
+    checked = 0
+    drifted = []
+    for pay_stub in annotate_pay_stub_totals(pay_stubs.order_by('pk')):
+        checked += 1
+        gross = ((pay_stub.salary_sum or 0)
+                 + (pay_stub.event_occurrence_sum or 0))
+        reimbursement = pay_stub.reimbursement_sum or 0
+        if (pay_stub.total_gross_amount != gross
+                or pay_stub.total_reimbursement_amount != reimbursement):
+            drifted.append((
+                pay_stub, pay_stub.total_gross_amount,
+                pay_stub.total_reimbursement_amount))
+            pay_stub.total_gross_amount = gross
+            pay_stub.total_reimbursement_amount = reimbursement
+            pay_stub.modified = now
+    if drifted and not dry_run:
+        PayStub.objects.bulk_update(
+            [pay_stub for pay_stub, gross, reimbursement in drifted],
+            ['total_gross_amount', 'total_reimbursement_amount', 'modified'],
+            batch_size=500)
+    return checked, drifted
+
+def run_payroll(pay_date, dry_run=False):
+    PayStub = apps.get_model('accounting', 'PayStub')
+    return correct_pay_stub_totals(
+        (PayStub
+            .objects
+            .filter(pay_date=pay_date, paid=False)
+            .select_related('user')),
+        dry_run=dry_run)
+
+def close_pay_period(pay_date, user=None):
+    # Marks every stub for the pay date and everything on them paid with a
+    # fixed number of statements, whatever the number of hosts, and records
+    # the period as closed so find_pay_stub sends later payments onward.
+    # Returns None if the period was already closed.
+    PayPeriod = apps.get_model('accounting', 'PayPeriod')
+    PayStub = apps.get_model('accounting', 'PayStub')
+    with transaction.atomic():
+        pay_period, created = PayPeriod.objects.get_or_create(
+            pay_date=pay_date, defaults={'closed_by': user})
+        if not created:
+            return None
+        run_payroll(pay_date)
+        now = timezone.now()
+        pay_stubs = PayStub.objects.filter(pay_date=pay_date, paid=False)
+        for name in ('SalaryPayment', 'EventOccurrencePayment',
+                     'Reimbursement'):
+            (apps.get_model('accounting', name)
+                .objects
+                .filter(pay_stub__in=pay_stubs, paid=False)
+                .update(paid=True, modified=now))
+        return pay_stubs.update(paid=True, modified=now)
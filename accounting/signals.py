@@ -0,0 +1,24 @@
+from django.core.exceptions import ValidationError
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils.translation import ugettext as _
+
+from .models import EventOccurrencePayment, PayStub, Reimbursement, SalaryPayment
+
+# Sent for queryset and admin bulk deletes as well as Model.delete(), and
+# raising here rolls the whole delete back.
+@receiver(pre_delete, sender=SalaryPayment)
+@receiver(pre_delete, sender=EventOccurrencePayment)
+@receiver(pre_delete, sender=Reimbursement)
+def refuse_deleting_locked_payments(sender, instance, **kwargs):
+    if instance.is_locked():
+        raise ValidationError(
+            _('This payment has been paid and cannot be deleted.'),
+            code='locked')
+
+@receiver(pre_delete, sender=PayStub)
+def refuse_deleting_paid_pay_stubs(sender, instance, **kwargs):
+    if instance.was_paid():
+        raise ValidationError(
+            _('This pay stub has been paid and cannot be deleted.'),
+            code='locked')
@@ -0,0 +1,229 @@
+import csv
+import datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounting.exports import generate_nacha, generate_payroll_csv
+from accounting.models import (
+    DirectDeposit, EventOccurrencePayment, PayStub, Reimbursement,
+    SalaryPayment, validate_routing_number)
+from accounts.models import CustomUser
+from locations.models import Venue
+from schedule.models import Event, EventOccurrence
+
+ACH_SETTINGS = {
+    'ACH_IMMEDIATE_DESTINATION': '021000021',
+    'ACH_IMMEDIATE_DESTINATION_NAME': 'Big Bank',
+    'ACH_IMMEDIATE_ORIGIN': '1234567890',
+    'ACH_COMPANY_NAME': 'Trivia City',
+    'ACH_COMPANY_ID': '1234567890',
+    'ACH_ORIGINATING_DFI': '02100002',
+}
+
+
+@override_settings(**ACH_SETTINGS)
+class PayrollExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = datetime.date(2019, 8, 9)
+        cls.second = datetime.date(2019, 8, 16)
+        cls.carol = CustomUser.objects.create_user(
+            username='carol', first_name='Carol', last_name='Peña')
+        cls.matt = CustomUser.objects.create_user(username='matt')
+        cls.dana = CustomUser.objects.create_user(username='dana')
+        DirectDeposit.objects.create(
+            user=cls.carol, routing_number='021000021',
+            account_number='12345678', account_type='S')
+        DirectDeposit.objects.create(
+            user=cls.matt, routing_number='011000015',
+            account_number='87654321')
+        PayStub.objects.bulk_create([
+            PayStub(user=user, pay_date=pay_date, total_gross_amount=gross,
+                    total_reimbursement_amount=reimbursement)
+            for user, pay_date, gross, reimbursement in [
+                (cls.carol, cls.first, 450, Decimal('2.50')),
+                (cls.matt, cls.first, 55, 0),
+                (cls.dana, cls.first, 50, 0),
+                (cls.carol, cls.second, 400, 0),
+                (cls.matt, cls.second, 0, 0),
+            ]])
+        stubs = {(pay_stub.user_id, pay_stub.pay_date): pay_stub
+                 for pay_stub in PayStub.objects.all()}
+        SalaryPayment.objects.bulk_create([
+            SalaryPayment(
+                user=cls.carol, week_start=datetime.date(2019, 7, 29),
+                week_end=datetime.date(2019, 8, 3), gross_amount=400,
+                pay_stub=stubs[cls.carol.pk, cls.first]),
+            SalaryPayment(
+                user=cls.carol, week_start=datetime.date(2019, 8, 5),
+                week_end=datetime.date(2019, 8, 10), gross_amount=400,
+                pay_stub=stubs[cls.carol.pk, cls.second]),
+        ])
+        event = Event.objects.create(
+            venue=Venue.objects.create(name='The Meatballery'))
+        EventOccurrencePayment.objects.bulk_create([
+            EventOccurrencePayment(
+                event_occurrence=EventOccurrence.objects.create(
+                    event=event, date=date),
+                gross_amount=amount, pay_stub=stubs[user.pk, cls.first])
+            for user, date, amount in [
+                (cls.carol, datetime.date(2019, 8, 1), 50),
+                (cls.matt, datetime.date(2019, 8, 2), 55),
+                (cls.dana, datetime.date(2019, 8, 3), 50),
+            ]])
+        Reimbursement.objects.bulk_create([
+            Reimbursement(
+                user=cls.carol, purchase_date=datetime.date(2019, 8, 1),
+                category='GS', description='Pencils', approved=True,
+                approved_amount=Decimal('2.50'),
+                pay_stub=stubs[cls.carol.pk, cls.first]),
+        ])
+
+    def read_csv(self, start, end):
+        return list(csv.reader(
+            ''.join(generate_payroll_csv(start, end)).splitlines()))
+
+    def test_csv_lists_each_stub_followed_by_its_line_items(self):
+        with self.assertNumQueries(4):
+            rows = self.read_csv(self.first, self.second)
+        self.assertEqual(rows[0][0], 'Pay date')
+        self.assertEqual(
+            [(row[1], row[3], row[6], row[7]) for row in rows[1:]],
+            [('carol', 'Pay stub', '450.00', '2.50'),
+             ('carol', 'Salary', '400.00', ''),
+             ('carol', 'Event', '50.00', ''),
+             ('carol', 'Reimbursement', '', '2.50'),
+             ('matt', 'Pay stub', '55.00', '0.00'),
+             ('matt', 'Event', '55.00', ''),
+             ('dana', 'Pay stub', '50.00', '0.00'),
+             ('dana', 'Event', '50.00', ''),
+             ('carol', 'Pay stub', '400.00', '0.00'),
+             ('carol', 'Salary', '400.00', ''),
+             ('matt', 'Pay stub', '0.00', '0.00')])
+        self.assertEqual(rows[1][2], 'Carol Peña')
+        self.assertEqual(rows[4][5], 'Game Supplies: Pencils')
+        self.assertEqual(rows[3][5], 'The Meatballery')
+
+    def test_csv_covers_only_the_requested_pay_dates(self):
+        rows = self.read_csv(self.second, self.second)
+        self.assertEqual(len(rows), 4)
+
+    def test_nacha_file_has_blocked_fixed_width_records(self):
+        with self.assertNumQueries(1):
+            lines = ''.join(generate_nacha(
+                self.first, self.second,
+                now=datetime.datetime(2019, 8, 8, 9, 30))).splitlines()
+        self.assertTrue(all(len(line) == 94 for line in lines))
+        self.assertEqual(len(lines) % 10, 0)
+        self.assertEqual(
+            [line[0] for line in lines if line[0] != '9' or line[1] != '9'],
+            ['1', '5', '6', '6', '8', '5', '6', '8', '9'])
+        self.assertEqual(lines[0][3:13], ' 021000021')
+        self.assertEqual(lines[0][23:33], '1908080930')
+
+    def test_nacha_entries_credit_net_pay_to_direct_deposit_accounts(self):
+        lines = ''.join(generate_nacha(self.first, self.second)).splitlines()
+        entries = [line for line in lines if line[0] == '6']
+        self.assertEqual(
+            [(line[1:3], line[3:12], line[12:29].strip(), int(line[29:39]),
+              line[54:76].strip()) for line in entries],
+            [('32', '021000021', '12345678', 45250, 'CAROL PENA'),
+             ('22', '011000015', '87654321', 5500, 'MATT'),
+             ('32', '021000021', '12345678', 40000, 'CAROL PENA')])
+        self.assertEqual(
+            [line[79:94] for line in entries],
+            ['021000020000001', '021000020000002', '021000020000003'])
+
+    def test_nacha_control_records_total_their_entries(self):
+        lines = ''.join(generate_nacha(self.first, self.second)).splitlines()
+        batch_controls = [line for line in lines if line[0] == '8']
+        self.assertEqual(
+            [(int(line[4:10]), int(line[10:20]), int(line[32:44]))
+             for line in batch_controls],
+            [(2, 2100002 + 1100001, 50750), (1, 2100002, 40000)])
+        file_control = [line for line in lines if line[:2] == '90'][0]
+        self.assertEqual(int(file_control[1:7]), 2)
+        self.assertEqual(int(file_control[7:13]), 1)
+        self.assertEqual(int(file_control[13:21]), 3)
+        self.assertEqual(int(file_control[21:31]), 2 * 2100002 + 1100001)
+        self.assertEqual(int(file_control[43:55]), 90750)
+
+    def test_payroll_export_view_streams_csv_for_staff(self):
+        CustomUser.objects.create_user(
+            username='boss', password='Ilovespaghetti', is_staff=True)
+        self.client.login(username='boss', password='Ilovespaghetti')
+        response = self.client.get(
+            reverse('payroll-export', args=['csv']),
+            {'start': '2019-08-09', 'end': '2019-08-16'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="payroll-2019-08-09-2019-08-16.csv"')
+        self.assertEqual(
+            len(b''.join(response.streaming_content).splitlines()), 12)
+
+    def test_payroll_export_view_rejects_bad_dates(self):
+        CustomUser.objects.create_user(
+            username='boss', password='Ilovespaghetti', is_staff=True)
+        self.client.login(username='boss', password='Ilovespaghetti')
+        response = self.client.get(
+            reverse('payroll-export', args=['ach']), {'start': '2019-13-09'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_payroll_export_view_redirects_users_who_are_not_staff(self):
+        CustomUser.objects.create_user(
+            username='host', password='Ilovespaghetti')
+        self.client.login(username='host', password='Ilovespaghetti')
+        response = self.client.get(
+            reverse('payroll-export', args=['csv']), {'start': '2019-08-09'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_payroll_command_writes_nacha_file(self):
+        out = StringIO()
+        call_command(
+            'export_payroll', start='2019-08-09', format='ach', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(
+            len([line for line in lines if line[0] == '6']), 2)
+
+    @override_settings(ACH_COMPANY_ID='', ACH_ORIGINATING_DFI='')
+    def test_nacha_refuses_missing_ach_settings(self):
+        with self.assertRaisesMessage(
+                ImproperlyConfigured, 'ACH_COMPANY_ID, ACH_ORIGINATING_DFI'):
+            ''.join(generate_nacha(self.first, self.second))
+        with self.assertRaises(CommandError):
+            call_command(
+                'export_payroll', start='2019-08-09', format='ach',
+                stdout=StringIO())
+
+    @override_settings(ACH_IMMEDIATE_DESTINATION='21000021')
+    def test_nacha_refuses_malformed_routing_settings(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ''.join(generate_nacha(self.first, self.second))
+
+    @override_settings(ACH_IMMEDIATE_ORIGIN='')
+    def test_payroll_export_view_rejects_ach_without_settings(self):
+        CustomUser.objects.create_user(
+            username='boss', password='Ilovespaghetti', is_staff=True)
+        self.client.login(username='boss', password='Ilovespaghetti')
+        response = self.client.get(
+            reverse('payroll-export', args=['ach']), {'start': '2019-08-09'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'ACH_IMMEDIATE_ORIGIN', response.content)
+        response = self.client.get(
+            reverse('payroll-export', args=['csv']), {'start': '2019-08-09'})
+        self.assertEqual(response.status_code, 200)
+
+class RoutingNumberValidationTest(TestCase):
+    def test_routing_number_checksum_is_validated(self):
+        validate_routing_number('021000021')
+        for value in ('021000022', '02100002', '02100002a'):
+            with self.assertRaises(ValidationError):
+                validate_routing_number(value)
@@ -1,12 +1,14 @@
 import datetime
 import shutil
+from unittest import mock
 
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError
 from django.test import TestCase, override_settings
 from django.urls import reverse
 
-from accounting.models import PayStub, SalaryPayment, EventOccurrencePayment, Reimbursement
+from accounting.models import PayPeriod, PayStub, SalaryPayment, EventOccurrencePayment, Reimbursement
 from accounting.models import get_pay_date, find_pay_stub, edited, documentation_path
 from accounts.models import CustomUser, RegionalManagerProfile, HostProfile
 from schedule.models import Day, Event, EventOccurrence
@@ -39,6 +41,52 @@ class ModelUtilsTests(TestCase):
         self.assertEqual(PayStub.objects.all().count(), 2)
         self.assertEqual(result.pay_date, datetime.date(2019, 8, 16))
 
+    def test_find_pay_stub_skips_paid_weeks_in_one_query(self):
+        user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        for pay_date, paid in [(datetime.date(2019, 8, 9), True),
+                               (datetime.date(2019, 8, 16), True),
+                               (datetime.date(2019, 8, 23), False)]:
+            PayStub.objects.create(user=user, pay_date=pay_date, paid=paid)
+        with self.assertNumQueries(1):
+            result = find_pay_stub(user, datetime.date(2019, 8, 5))
+        self.assertEqual(result.pay_date, datetime.date(2019, 8, 23))
+
+    def test_find_pay_stub_creates_first_free_week_with_one_insert(self):
+        user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        PayStub.objects.create(
+            user=user, pay_date=datetime.date(2019, 8, 9), paid=True)
+        PayStub.objects.create(
+            user=user, pay_date=datetime.date(2019, 8, 23))
+        # The walk, the closed periods, then a savepoint around the insert.
+        with self.assertNumQueries(5):
+            result = find_pay_stub(user, datetime.date(2019, 8, 5))
+        self.assertEqual(result.pay_date, datetime.date(2019, 8, 16))
+        self.assertEqual(PayStub.objects.count(), 3)
+
+    def test_find_pay_stub_reads_closed_periods_once(self):
+        user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        PayStub.objects.create(
+            user=user, pay_date=datetime.date(2019, 8, 9), paid=True)
+        for week in range(1, 4):
+            PayPeriod.objects.create(
+                pay_date=datetime.date(2019, 8, 9)
+                + datetime.timedelta(weeks=week))
+        # The walk, the closed periods, then a savepoint around the insert.
+        with self.assertNumQueries(5):
+            result = find_pay_stub(user, datetime.date(2019, 8, 5))
+        self.assertEqual(result.pay_date, datetime.date(2019, 9, 6))
+
+    def test_pay_stub_user_and_pay_date_are_unique(self):
+        user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        PayStub.objects.create(user=user, pay_date=datetime.date(2019, 8, 9))
+        with self.assertRaises(IntegrityError):
+            PayStub.objects.create(
+                user=user, pay_date=datetime.date(2019, 8, 9))
+
     def test_edited_true(self):
         reimbursement = Reimbursement.objects.create()
         monitored_field = ['purchase_date']
@@ -62,6 +110,35 @@ class ModelUtilsTests(TestCase):
         result = documentation_path(reimbursement , 'test_file.txt')
         self.assertEqual(result, 'reimbursements/carol/2019-08-05_test_file.txt')
         
+class FindPayStubConcurrencyTest(TestCase):
+    # The walk is made to miss a stub, as it would when a concurrent
+    # payment inserts the stub between the walk and the insert.
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+
+    def find_with_stale_walk(self):
+        filter = PayStub.objects.filter
+        stale_walks = [PayStub.objects.none()]
+        def walk(*args, **kwargs):
+            return stale_walks.pop() if stale_walks else filter(*args, **kwargs)
+        with mock.patch.object(PayStub.objects, 'filter', side_effect=walk):
+            return find_pay_stub(self.user, datetime.date(2019, 8, 5))
+
+    def test_find_pay_stub_uses_stub_inserted_by_concurrent_payment(self):
+        pay_stub = PayStub.objects.create(
+            user=self.user, pay_date=datetime.date(2019, 8, 9))
+        self.assertEqual(self.find_with_stale_walk(), pay_stub)
+        self.assertEqual(PayStub.objects.count(), 1)
+
+    def test_find_pay_stub_walks_again_if_concurrent_stub_was_paid(self):
+        PayStub.objects.create(
+            user=self.user, pay_date=datetime.date(2019, 8, 9), paid=True)
+        result = self.find_with_stale_walk()
+        self.assertEqual(result.pay_date, datetime.date(2019, 8, 16))
+        self.assertEqual(PayStub.objects.count(), 2)
+
 class PayStubModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -606,6 +683,20 @@ class EventOccurrencePaymentModelTest(TestCase):
             time_ended=datetime.time(22,30),
             number_of_teams=5)
 
+    def test_event_occurrence_has_only_one_payment(self):
+        occurrence_payment = EventOccurrencePayment.objects.get(pk=1)
+        with self.assertRaises(IntegrityError):
+            EventOccurrencePayment.objects.bulk_create([EventOccurrencePayment(
+                event_occurrence=occurrence_payment.event_occurrence)])
+
+    def test_resaving_complete_event_occurrence_keeps_one_payment(self):
+        event_occurrence = EventOccurrence.objects.get(pk=1)
+        event_occurrence.number_of_teams = 7
+        event_occurrence.save()
+        self.assertEqual(EventOccurrencePayment.objects.count(), 1)
+        self.assertEqual(
+            EventOccurrencePayment.objects.get().gross_amount, 52)
+
     def test_type_label(self):
         occurrence_payment = EventOccurrencePayment.objects.get(pk=1)
         field_label = occurrence_payment._meta.get_field('type').verbose_name
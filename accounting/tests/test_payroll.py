@@ -0,0 +1,538 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounting.models import (
+    EventOccurrencePayment, Holiday, PayPeriod, PayStub, Reimbursement,
+    SalaryPayment, find_pay_stub, generate_salary_payments)
+from accounting.payroll import (
+    close_pay_period, deferred_payroll, get_payroll_batch, run_payroll)
+from accounts.models import CustomUser, HostProfile, RegionalManagerProfile
+from locations.models import Venue
+from schedule.models import Day, Event, EventOccurrence
+
+
+class DeferredPayrollTest(TransactionTestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        HostProfile.objects.create(
+            user=self.host, base_teams=5, base_rate=50,
+            incremental_teams=1, incremental_rate=1)
+        day = Day.objects.create(day=0)
+        self.event = Event.objects.create(day=day, host=self.host)
+        monday = datetime.date(2019, 5, 13)
+        self.event_occurrences = [
+            EventOccurrence.objects.create(
+                event=self.event, host=self.host, day=day,
+                date=monday - datetime.timedelta(weeks=week))
+            for week in range(4)]
+
+    def complete(self, event_occurrence, number_of_teams=5):
+        event_occurrence.time_started = datetime.time(20,30)
+        event_occurrence.time_ended = datetime.time(22,30)
+        event_occurrence.number_of_teams = number_of_teams
+        event_occurrence.save()
+
+    def test_pay_stub_is_recalculated_once_at_commit(self):
+        with transaction.atomic():
+            with deferred_payroll():
+                for event_occurrence in self.event_occurrences:
+                    self.complete(event_occurrence)
+            pay_stub = PayStub.objects.get()
+            self.assertEqual(pay_stub.total_gross_amount, 0)
+        pay_stub.refresh_from_db()
+        self.assertEqual(pay_stub.total_gross_amount, 200)
+        self.assertEqual(
+            EventOccurrencePayment.objects.filter(pay_stub=pay_stub).count(), 4)
+
+    def test_deferred_payroll_saves_queries_per_occurrence(self):
+        def count_queries(defer):
+            EventOccurrencePayment.objects.all().delete()
+            PayStub.objects.all().delete()
+            with CaptureQueriesContext(connection) as context:
+                with transaction.atomic():
+                    if defer:
+                        with deferred_payroll():
+                            for event_occurrence in self.event_occurrences:
+                                self.complete(event_occurrence)
+                    else:
+                        for event_occurrence in self.event_occurrences:
+                            self.complete(event_occurrence)
+            return len(context.captured_queries)
+        immediate = count_queries(defer=False)
+        deferred = count_queries(defer=True)
+        # Each occurrence after the first skips find_pay_stub's lookup, and
+        # the per-payment stub updates become one recompute at commit.
+        self.assertLessEqual(deferred, immediate - 4)
+        self.assertEqual(PayStub.objects.get().total_gross_amount, 200)
+
+    def test_rolled_back_batch_does_not_recalculate(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                with deferred_payroll():
+                    self.complete(self.event_occurrences[0])
+                    raise ValueError
+        self.assertIsNone(get_payroll_batch())
+        self.assertFalse(PayStub.objects.exists())
+
+    def test_without_deferred_payroll_pay_stub_is_saved_right_away(self):
+        with transaction.atomic():
+            self.complete(self.event_occurrences[0])
+            self.assertEqual(PayStub.objects.get().total_gross_amount, 50)
+
+
+class DeferredPayrollAdminTest(TransactionTestCase):
+    def setUp(self):
+        CustomUser.objects.create_superuser(
+            username='admin', email='admin@example.com', password='Ilovepizza')
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        HostProfile.objects.create(
+            user=host, base_teams=5, base_rate=50,
+            incremental_teams=1, incremental_rate=1)
+        day = Day.objects.create(day=0)
+        venue = Venue.objects.create(name='The Meatballery')
+        self.event = Event.objects.create(
+            venue=venue, day=day, host=host,
+            start_date=datetime.date(2019, 4, 1))
+        monday = datetime.date(2019, 5, 13)
+        for week in range(4):
+            EventOccurrence.objects.create(
+                event=self.event, host=host, day=day,
+                date=monday - datetime.timedelta(weeks=week))
+        self.client.login(username='admin', password='Ilovepizza')
+
+    def get_change_form_data(self, url):
+        response = self.client.get(url)
+        forms = [response.context['adminform'].form]
+        data = {}
+        for inline_admin_formset in response.context['inline_admin_formsets']:
+            formset = inline_admin_formset.formset
+            forms += [formset.management_form] + formset.forms
+        for form in forms:
+            for name in form.fields:
+                value = form[name].value()
+                if value is True:
+                    data[form[name].html_name] = 'on'
+                elif value or value == 0:
+                    data[form[name].html_name] = value
+        return data
+
+    def complete_in_admin(self, number):
+        url = reverse('admin:schedule_event_change', args=[self.event.pk])
+        data = self.get_change_form_data(url)
+        for index in range(number):
+            prefix = 'event_occurrences-{0}-'.format(index)
+            data[prefix + 'time_started'] = '08:30PM'
+            data[prefix + 'time_ended'] = '10:30PM'
+            data[prefix + 'number_of_teams'] = 5
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "accounting_paystub"')]
+
+    def test_bulk_admin_edit_updates_pay_stub_once(self):
+        self.assertEqual(len(self.complete_in_admin(2)), 1)
+        self.assertEqual(PayStub.objects.get().total_gross_amount, 100)
+        self.assertEqual(len(self.complete_in_admin(4)), 1)
+        self.assertEqual(PayStub.objects.get().total_gross_amount, 200)
+
+
+class RunPayrollTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        day = Day.objects.create(day=0)
+        cls.pay_date = datetime.date(2019, 5, 17)
+        monday = datetime.date(2019, 5, 13)
+        for number in range(3):
+            host = CustomUser.objects.create_user(
+                username='host{0}'.format(number), password='Ilovespaghetti')
+            HostProfile.objects.create(
+                user=host, base_teams=5, base_rate=50,
+                incremental_teams=1, incremental_rate=1)
+            event = Event.objects.create(day=day, host=host)
+            event_occurrence = EventOccurrence.objects.create(
+                event=event, host=host, day=day, date=monday,
+                time_started=datetime.time(20,30),
+                time_ended=datetime.time(22,30),
+                number_of_teams=5 + number)
+            EventOccurrencePayment.objects.filter(
+                event_occurrence=event_occurrence).update(
+                    submission_date=monday,
+                    pay_stub=PayStub.objects.create(
+                        user=host, pay_date=cls.pay_date))
+        PayStub.objects.filter(pk=PayStub.objects.create(
+            user=host, pay_date=cls.pay_date + datetime.timedelta(weeks=1)
+        ).pk).update(total_gross_amount=1)
+
+    def test_run_payroll_corrects_only_drifted_stubs_in_two_queries(self):
+        PayStub.objects.filter(user__username='host0').update(
+            total_gross_amount=50, total_reimbursement_amount=0)
+        with self.assertNumQueries(2):
+            checked, drifted = run_payroll(self.pay_date)
+        self.assertEqual(checked, 3)
+        self.assertEqual(
+            sorted(pay_stub.user.username for pay_stub, gross, reim in drifted),
+            ['host1', 'host2'])
+        self.assertEqual(
+            list(PayStub.objects
+                    .filter(pay_date=self.pay_date)
+                    .order_by('user__username')
+                    .values_list('total_gross_amount', flat=True)),
+            [50, 51, 52])
+
+    def test_run_payroll_skips_paid_stubs_and_other_pay_dates(self):
+        PayStub.objects.filter(user__username='host2').update(paid=True)
+        checked, drifted = run_payroll(self.pay_date)
+        self.assertEqual(checked, 2)
+        self.assertEqual(
+            PayStub.objects.get(user__username='host2',
+                                pay_date=self.pay_date).total_gross_amount, 0)
+        self.assertEqual(
+            PayStub.objects.get(
+                pay_date=self.pay_date + datetime.timedelta(weeks=1)
+            ).total_gross_amount, 1)
+
+    def test_run_payroll_dry_run_reports_without_writing(self):
+        checked, drifted = run_payroll(self.pay_date, dry_run=True)
+        self.assertEqual(len(drifted), 3)
+        self.assertFalse(PayStub.objects.filter(
+            pay_date=self.pay_date, total_gross_amount__gt=0).exists())
+
+    def test_run_payroll_command_reports_corrected_stubs(self):
+        out = StringIO()
+        call_command('run_payroll', pay_date='2019-05-17', stdout=out)
+        self.assertIn('host1: gross 0.00 -> 51', out.getvalue())
+        self.assertIn('Corrected 3 of 3 pay stubs for 2019-05-17',
+                      out.getvalue())
+
+
+class PayStubRunningTotalsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+
+    def approve(self, amount):
+        return Reimbursement.objects.create(
+            user=self.user, amount=amount, approved=True,
+            approved_amount=amount)
+
+    def test_saving_a_payment_adjusts_its_stub_without_aggregates(self):
+        self.approve('2.50')
+        with CaptureQueriesContext(connection) as context:
+            reimbursement = self.approve('4.00')
+        self.assertFalse(any('SUM(' in query['sql']
+                             for query in context.captured_queries))
+        self.assertEqual(reimbursement.pay_stub.total_reimbursement_amount, 6.5)
+        self.assertEqual(
+            PayStub.objects.get().total_reimbursement_amount, 6.5)
+
+    def test_changing_an_amount_adds_only_the_difference(self):
+        self.approve('2.50')
+        reimbursement = Reimbursement.objects.get()
+        reimbursement.approved_amount = '4.00'
+        reimbursement.save()
+        self.assertEqual(
+            PayStub.objects.get().total_reimbursement_amount, 4)
+
+    def test_detaching_the_last_payment_deletes_the_empty_stub(self):
+        self.approve('2.50')
+        reimbursement = Reimbursement.objects.get()
+        reimbursement.approved = False
+        reimbursement.save()
+        self.assertFalse(PayStub.objects.exists())
+
+    def test_increments_do_not_overwrite_a_concurrent_save(self):
+        first = self.approve('2.50')
+        second = self.approve('1.00')
+        first = Reimbursement.objects.get(pk=first.pk)
+        second = Reimbursement.objects.get(pk=second.pk)
+        first.approved_amount = '3.00'
+        second.approved_amount = '2.00'
+        first.save()
+        second.save()
+        self.assertEqual(
+            PayStub.objects.get().total_reimbursement_amount, 5)
+
+    def test_payment_built_by_hand_recomputes_its_stub(self):
+        reimbursement = self.approve('2.50')
+        PayStub.objects.update(total_reimbursement_amount=99)
+        Reimbursement(
+            pk=reimbursement.pk, user=self.user, amount=Decimal('2.50'),
+            approved=True, approved_amount=Decimal('2.50'),
+            submission_date=reimbursement.submission_date).save()
+        self.assertEqual(
+            PayStub.objects.get().total_reimbursement_amount, 2.5)
+
+    def test_payment_built_by_hand_recomputes_the_stub_it_left(self):
+        reimbursement = self.approve('2.50')
+        self.approve('1.00')
+        Reimbursement(
+            pk=reimbursement.pk, user=self.user, amount=Decimal('2.50'),
+            approved=False,
+            submission_date=reimbursement.submission_date).save()
+        self.assertIsNone(Reimbursement.objects.get(
+            pk=reimbursement.pk).pay_stub)
+        self.assertEqual(
+            PayStub.objects.get().total_reimbursement_amount, 1)
+
+    def test_calculate_pay_recomputes_all_totals_in_one_query(self):
+        pay_stub = self.approve('2.50').pay_stub
+        PayStub.objects.update(total_reimbursement_amount=99)
+        pay_stub.refresh_from_db()
+        with self.assertNumQueries(1):
+            pay_stub.calculate_pay()
+        self.assertEqual(pay_stub.total_gross_amount, 0)
+        self.assertEqual(pay_stub.total_reimbursement_amount, 2.5)
+
+
+class ClosePayPeriodTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pay_date = datetime.date(2019, 8, 9)
+        cls.users = [
+            CustomUser.objects.create_user(
+                username='host{0}'.format(number), password='Ilovespaghetti')
+            for number in range(5)]
+        for user in cls.users:
+            reimbursement = Reimbursement.objects.create(
+                user=user, amount='2.50', approved=True,
+                approved_amount='2.50')
+            Reimbursement.objects.filter(pk=reimbursement.pk).update(
+                submission_date=datetime.date(2019, 8, 5))
+            PayStub.objects.filter(pk=reimbursement.pay_stub_id).update(
+                pay_date=cls.pay_date)
+        PayStub.objects.create(
+            user=cls.users[0], pay_date=cls.pay_date + datetime.timedelta(weeks=1))
+
+    def test_close_pay_period_marks_everything_paid_in_fixed_statements(self):
+        # The period lookup and insert, run_payroll's read and the four
+        # updates, plus savepoints.
+        with self.assertNumQueries(11):
+            closed = close_pay_period(self.pay_date, self.users[0])
+        self.assertEqual(closed, 5)
+        self.assertFalse(
+            PayStub.objects.filter(pay_date=self.pay_date, paid=False).exists())
+        self.assertFalse(Reimbursement.objects.filter(paid=False).exists())
+        self.assertFalse(PayStub.objects.get(
+            pay_date=self.pay_date + datetime.timedelta(weeks=1)).paid)
+        self.assertEqual(
+            PayPeriod.objects.get().closed_by, self.users[0])
+
+    def test_close_pay_period_keeps_stub_totals(self):
+        close_pay_period(self.pay_date)
+        self.assertEqual(
+            set(PayStub.objects
+                   .filter(pay_date=self.pay_date)
+                   .values_list('total_reimbursement_amount', flat=True)),
+            {Decimal('2.50')})
+
+    def test_closing_a_closed_period_does_nothing(self):
+        close_pay_period(self.pay_date)
+        self.assertIsNone(close_pay_period(self.pay_date))
+        self.assertEqual(PayPeriod.objects.count(), 1)
+
+    def test_find_pay_stub_skips_closed_period_without_stub(self):
+        user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        close_pay_period(self.pay_date)
+        pay_stub = find_pay_stub(user, datetime.date(2019, 8, 5))
+        self.assertEqual(
+            pay_stub.pay_date, self.pay_date + datetime.timedelta(weeks=1))
+
+    def test_unpaid_pay_stub_in_closed_period_is_invalid(self):
+        close_pay_period(self.pay_date)
+        pay_stub = PayStub(
+            user=CustomUser.objects.create_user(username='carol'),
+            pay_date=self.pay_date)
+        with self.assertRaises(ValidationError):
+            pay_stub.full_clean()
+
+
+
+class ClosedPayPeriodLockTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        HostProfile.objects.create(
+            user=host, base_teams=5, base_rate=50,
+            incremental_teams=1, incremental_rate=1)
+        day = Day.objects.create(day=0)
+        event = Event.objects.create(day=day, host=host)
+        EventOccurrence.objects.create(
+            event=event, host=host, day=day, date=datetime.date(2019, 5, 13),
+            time_started=datetime.time(20,30), time_ended=datetime.time(22,30),
+            number_of_teams=5)
+        cls.pay_date = PayStub.objects.get().pay_date
+        close_pay_period(cls.pay_date)
+
+    def assertPaymentKept(self):
+        payment = EventOccurrencePayment.objects.get()
+        self.assertTrue(payment.paid)
+        self.assertEqual(payment.gross_amount, 50)
+        self.assertEqual(payment.pay_stub.total_gross_amount, 50)
+        self.assertTrue(payment.pay_stub.paid)
+
+    def test_cancelling_a_paid_occurrence_ahead_is_refused(self):
+        event_occurrence = EventOccurrence.objects.get()
+        event_occurrence.cancelled_ahead = True
+        event_occurrence.cancellation_reason = 'Holiday'
+        with self.assertRaises(ValidationError):
+            event_occurrence.save()
+        self.assertFalse(EventOccurrence.objects.get().cancelled_ahead)
+        self.assertPaymentKept()
+
+    def test_changing_the_teams_of_a_paid_occurrence_is_invalid(self):
+        event_occurrence = EventOccurrence.objects.get()
+        event_occurrence.number_of_teams = 9
+        with self.assertRaises(ValidationError):
+            event_occurrence.full_clean()
+        with self.assertRaises(ValidationError):
+            event_occurrence.save()
+        self.assertPaymentKept()
+
+    def test_paid_occurrence_notes_can_still_be_edited(self):
+        event_occurrence = EventOccurrence.objects.get()
+        event_occurrence.notes = 'Great crowd.'
+        event_occurrence.full_clean()
+        event_occurrence.save()
+        self.assertEqual(EventOccurrence.objects.get().notes, 'Great crowd.')
+        self.assertPaymentKept()
+
+    def test_saving_a_paid_pay_stub_keeps_it_and_its_totals(self):
+        PayStub.objects.get().save()
+        self.assertPaymentKept()
+
+    def test_deleting_a_paid_payment_or_stub_is_refused(self):
+        for delete in (EventOccurrencePayment.objects.get().delete,
+                       EventOccurrencePayment.objects.all().delete,
+                       PayStub.objects.get().delete):
+            with self.assertRaises(ValidationError):
+                with transaction.atomic():
+                    delete()
+        self.assertPaymentKept()
+
+    def test_editing_an_occurrence_reads_its_payment_once(self):
+        event_occurrence = EventOccurrence.objects.get()
+        event_occurrence = EventOccurrence.objects.create(
+            event=event_occurrence.event, host=event_occurrence.host,
+            day=event_occurrence.day,
+            date=event_occurrence.date + datetime.timedelta(weeks=1),
+            time_started=datetime.time(20,30), time_ended=datetime.time(22,30),
+            number_of_teams=5)
+        event_occurrence = EventOccurrence.objects.get(pk=event_occurrence.pk)
+        event_occurrence.number_of_teams = 6
+        with CaptureQueriesContext(connection) as context:
+            event_occurrence.full_clean()
+            event_occurrence.save()
+        tables = [query['sql'].split(' FROM ')[1].split()[0]
+                  for query in context.captured_queries
+                  if query['sql'].startswith('SELECT')
+                  and ' FROM ' in query['sql']]
+        self.assertEqual(tables.count('"accounting_eventoccurrencepayment"'), 1)
+        self.assertEqual(tables.count('"accounting_payperiod"'), 1)
+        self.assertEqual(
+            EventOccurrencePayment.objects.get(
+                event_occurrence=event_occurrence).gross_amount, 51)
+
+    def test_payment_on_a_closed_pay_date_is_locked(self):
+        payment = EventOccurrencePayment.objects.get()
+        EventOccurrencePayment.objects.update(paid=False)
+        payment.refresh_from_db()
+        self.assertTrue(payment.is_locked())
+
+class GenerateSalaryPaymentsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.week_start = datetime.date(2019, 11, 25)
+        Holiday.objects.create(
+            date=datetime.date(2019, 11, 28), name='Thanksgiving')
+        for number in range(3):
+            cls.add_regional_manager('manager{0}'.format(number), 500)
+        CustomUser.objects.create_user(username='host')
+
+    @classmethod
+    def add_regional_manager(cls, username, weekly_pay):
+        user = CustomUser.objects.create_user(
+            username=username, is_regional_manager=True)
+        RegionalManagerProfile.objects.create(
+            user=user, weekly_pay=weekly_pay)
+        return user
+
+    def test_generate_salary_payments_skips_holidays_and_totals_stubs(self):
+        salary_payments = generate_salary_payments(self.week_start)
+        self.assertEqual(len(salary_payments), 3)
+        self.assertEqual(
+            set(SalaryPayment.objects.values_list('gross_amount', flat=True)),
+            {Decimal('400.00')})
+        self.assertEqual(
+            list(PayStub.objects.values_list(
+                'pay_date', 'total_gross_amount').distinct()),
+            [(datetime.date(2019, 12, 6), Decimal('400.00'))])
+        self.assertEqual(PayStub.objects.count(), 3)
+
+    def test_generate_salary_payments_query_count_does_not_grow(self):
+        with CaptureQueriesContext(connection) as context:
+            generate_salary_payments(self.week_start)
+        for number in range(3, 10):
+            self.add_regional_manager('manager{0}'.format(number), 500)
+        with self.assertNumQueries(len(context.captured_queries)):
+            salary_payments = generate_salary_payments(
+                self.week_start + datetime.timedelta(weeks=1))
+        self.assertEqual(len(salary_payments), 10)
+
+    def test_generate_salary_payments_does_not_save_row_by_row(self):
+        with mock.patch.object(
+                SalaryPayment, 'save', side_effect=AssertionError):
+            generate_salary_payments(self.week_start)
+        self.assertEqual(SalaryPayment.objects.count(), 3)
+
+    def test_generate_salary_payments_skips_managers_already_paid(self):
+        generate_salary_payments(self.week_start)
+        self.assertEqual(generate_salary_payments(self.week_start), [])
+        self.assertEqual(SalaryPayment.objects.count(), 3)
+
+    def test_generate_salary_payments_uses_existing_and_next_unpaid_stubs(self):
+        manager = CustomUser.objects.get(username='manager0')
+        PayStub.objects.create(
+            user=manager, pay_date=datetime.date(2019, 12, 6), paid=True)
+        other = CustomUser.objects.get(username='manager1')
+        reimbursement = Reimbursement.objects.create(
+            user=other, amount='2.50', approved=True, approved_amount='2.50')
+        PayStub.objects.filter(pk=reimbursement.pay_stub_id).update(
+            pay_date=datetime.date(2019, 12, 6))
+        generate_salary_payments(self.week_start)
+        self.assertEqual(
+            SalaryPayment.objects.get(user=manager).pay_stub.pay_date,
+            datetime.date(2019, 12, 13))
+        pay_stub = SalaryPayment.objects.get(user=other).pay_stub
+        self.assertEqual(pay_stub.pk, reimbursement.pay_stub_id)
+        self.assertEqual(pay_stub.total_gross_amount, 400)
+        self.assertEqual(pay_stub.total_reimbursement_amount, Decimal('2.50'))
+
+    def test_salary_payment_save_honors_holidays(self):
+        salary_payment = SalaryPayment.objects.create(
+            user=CustomUser.objects.get(username='manager0'),
+            week_start=self.week_start,
+            week_end=self.week_start + datetime.timedelta(days=5))
+        self.assertEqual(salary_payment.gross_amount, 400)
+
+    def test_generate_salaries_command_reports_created_payments(self):
+        out = StringIO()
+        call_command('generate_salaries', week_start='2019-11-25', stdout=out)
+        self.assertIn(
+            'Created 3 salary payments for the week of 2019-11-25',
+            out.getvalue())
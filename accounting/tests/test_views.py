@@ -7,7 +7,8 @@ from django.urls import reverse, resolve
 from django.views.generic import ListView
 
 from accounting.forms import ReimbursementForm
-from accounting.models import EventOccurrencePayment, PayStub, Reimbursement
+from accounting.models import (
+    EventOccurrencePayment, PayStub, Reimbursement, get_pay_date, payday)
 from accounting.views import (
     BelongsToUserInUrlMixin,
     PayStubListViewUser,
@@ -243,7 +244,7 @@ class PayStubListViewCurrentUserTests(TestCase):
         pay_stub_past = PayStub.objects.create(
             user=user,
             pay_date=week_before_today)
-        pay_stub_today = PayStub.objects.create(
+        pay_stub_today = PayStub.objects.get(
             user=user,
             pay_date=today)
         pay_stub_future = PayStub.objects.create(
@@ -347,7 +348,7 @@ class PayStubListViewPastUserTests(TestCase):
         pay_stub_past = PayStub.objects.create(
             user=user,
             pay_date=week_before_today)
-        pay_stub_today = PayStub.objects.create(
+        pay_stub_today = PayStub.objects.get(
             user=user,
             pay_date=today)
         pay_stub_future = PayStub.objects.create(
@@ -674,4 +675,45 @@ class ReimbursementUpdateViewTests(TestCase):
         }
         response = self.client.post(url, data)
         success_url = reverse('reimbursement-list-user', kwargs={'username': 'carol'})
-        self.assertRedirects(response, success_url)
\ No newline at end of file
+        self.assertRedirects(response, success_url)
+class PayStubConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        self.pay_stub = PayStub.objects.create(
+            user=self.user,
+            pay_date=get_pay_date(datetime.date.today(), payday))
+        self.url = reverse('pay-stub-detail', kwargs={'pk': self.pay_stub.pk})
+        self.client.login(username='carol', password='Ilovespaghetti')
+
+    def test_pay_stub_detail_not_modified_if_etag_matches(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_pay_stub_detail_etag_changes_when_reimbursement_approved(self):
+        etag = self.client.get(self.url)['ETag']
+        Reimbursement.objects.create(
+            user=self.user, description='Pencils', amount=10,
+            approved=True, approved_amount=10)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_pay_stub_detail_not_found_for_other_user_with_matching_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        CustomUser.objects.create_user(
+            username='matt', password='Ilovemeatballs')
+        self.client.login(username='matt', password='Ilovemeatballs')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+    def test_pay_stub_list_not_modified_until_pay_stub_saved(self):
+        url = reverse('pay-stub-list-user', kwargs={'username': 'carol'})
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.pay_stub.paid = True
+        self.pay_stub.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
@@ -11,6 +11,8 @@ urlpatterns = [
         name='pay-stub-list-current-user'),
     path('pay-stubs/<str:username>/past/', views.PayStubListViewPastUser.as_view(),
         name='pay-stub-list-past-user'),
+    path('payroll/export/<str:format>/', views.payroll_export,
+        name='payroll-export'),
     path('reimbursements/new/', views.ReimbursementCreateView.as_view(),
         name='reimbursement-create'),
     path('reimbursements/<str:username>/', views.ReimbursementListViewUser.as_view(),
@@ -1,16 +1,23 @@
 import datetime
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.dateparse import parse_date
 from django.views.generic import DetailView, ListView
 from django.views.generic.edit import CreateView, UpdateView
 
+from triviacompany.cache import ConditionalGetMixin, get_queryset_version
+
+from .exports import check_ach_settings, generate_nacha, generate_payroll_csv
 from .forms import ReimbursementForm
-from .models import PayStub, Reimbursement, EventOccurrencePayment
+from .models import (
+    PayStub, Reimbursement, EventOccurrencePayment, SalaryPayment)
 
-class PayStubDetailView(LoginRequiredMixin, DetailView):
+class PayStubDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     model = PayStub
     context_object_name = 'pay_stub'
     template_name = 'accounting/pay_stub_detail.html'
@@ -19,7 +26,24 @@ class PayStubDetailView(LoginRequiredMixin, DetailView):
         pay_stub = PayStub.objects.filter(user=self.request.user)
         return pay_stub
 
-class BelongsToUserInUrlMixin(ListView):
+    def get_etag_parts(self):
+        pay_stub = self.get_queryset().filter(pk=self.kwargs['pk'])
+        return [
+            get_queryset_version(pay_stub, 'modified'),
+            get_queryset_version(
+                SalaryPayment.objects.filter(pay_stub__in=pay_stub),
+                'modified'),
+            get_queryset_version(
+                EventOccurrencePayment.objects.filter(pay_stub__in=pay_stub),
+                'modified', 'event_occurrence__modified',
+                'event_occurrence__event__modified',
+                'event_occurrence__event__venue__modified'),
+            get_queryset_version(
+                Reimbursement.objects.filter(pay_stub__in=pay_stub),
+                'modified'),
+        ]
+
+class BelongsToUserInUrlMixin(ConditionalGetMixin, ListView):
     def get_queryset(self):
         if self.kwargs['username'] == self.request.user.username:
             obj_user = self.model.objects.filter(user=self.request.user)
@@ -27,6 +51,9 @@ class BelongsToUserInUrlMixin(ListView):
         else:
             raise Http404
 
+    def get_etag_parts(self):
+        return [get_queryset_version(self.get_queryset(), 'modified')]
+
 class PayStubListViewUser(LoginRequiredMixin, BelongsToUserInUrlMixin):
     model = PayStub
     context_object_name = 'pay_stub_list'
@@ -77,4 +104,37 @@ class ReimbursementUpdateView(LoginRequiredMixin, UpdateView):
     def get_success_url(self):
         return reverse(
             'reimbursement-list-user',
-            kwargs={'username': self.request.user.username })
\ No newline at end of file
+            kwargs={'username': self.request.user.username })
+
+PAYROLL_EXPORTS = {
+    'csv': (generate_payroll_csv, 'text/csv'),
+    'ach': (generate_nacha, 'text/plain'),
+}
+
+@staff_member_required
+def payroll_export(request, format):
+    # Streams every pay stub from `start` to `end` (inclusive, defaulting to
+    # `start`) as CSV line items or as a NACHA file.
+    if format not in PAYROLL_EXPORTS:
+        raise Http404
+    try:
+        start = parse_date(request.GET.get('start', ''))
+        end = parse_date(request.GET.get('end') or '') or start
+    except ValueError:
+        start = None
+    if start is None or end < start:
+        return HttpResponseBadRequest(
+            'Give the pay dates to export as start and end, YYYY-MM-DD.')
+    if format == 'ach':
+        # Checked before streaming starts, while an error can still be sent.
+        try:
+            check_ach_settings()
+        except ImproperlyConfigured as error:
+            return HttpResponseBadRequest(str(error))
+    generate, content_type = PAYROLL_EXPORTS[format]
+    response = StreamingHttpResponse(
+        generate(start, end), content_type=content_type)
+    response['Content-Disposition'] = (
+        'attachment; filename="payroll-{0}-{1}.{2}"'.format(
+            start, end, format))
+    return response
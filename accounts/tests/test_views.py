@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse, resolve
 
@@ -6,6 +7,9 @@ from accounts.views import HostProfileListView, CustomUserUpdate
 from accounts.forms import CustomUserUpdateForm
 
 class HostProfileListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
     @classmethod
     def setUpTestData(cls):
         user = CustomUser.objects.create_user(
@@ -1,8 +1,11 @@
 from django.urls import path
 
+from triviacompany.cache import cache_anonymous_page
+
 from . import views
 
 urlpatterns = [
-    path('hosts/', views.HostProfileListView.as_view(), name='host-profile-list'),
+    path('hosts/', cache_anonymous_page(views.HostProfileListView.as_view()),
+        name='host-profile-list'),
     path('accounts/<str:username>/', views.CustomUserUpdate.as_view(), name='account-update'),
 ]
\ No newline at end of file
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-17 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0002_auto_20190506_1401'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venue',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -86,6 +86,7 @@ class Venue(models.Model):
     av_setup = models.TextField(blank=True)
     managers = models.ManyToManyField(
         settings.AUTH_USER_MODEL, blank=True, through='ManagementPeriod')
+    modified = models.DateTimeField(auto_now=True)
 
     class Meta:
         #db_table = 'venue'
@@ -1,11 +1,16 @@
+import datetime
+
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse, resolve
 from locations.models import Venue, Region, State, City, Zip
 from locations.views import VenueListView, VenueCreate, VenueUpdate
 from locations.forms import VenueForm
+from schedule.models import Event, EventOccurrence
 
 class VenueViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         region = Region.objects.create(name='ne')
         state = State.objects.create(name='New Jersey', region=region)
         city = City.objects.create(name='Jersey City', state=state)
@@ -66,4 +71,28 @@ class VenueViewTests(TestCase):
         url = reverse('venue-update', kwargs={'pk': 1})
         response = self.client.get(url)
         form = response.context.get('form')
-        self.assertIsInstance(form, VenueForm)
\ No newline at end of file
+        self.assertIsInstance(form, VenueForm)
+
+class LoadCitiesViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        state = State.objects.create(name='NY')
+        city = City.objects.create(name='New York', state=state)
+        City.objects.create(name='Albany', state=state)
+        venue = Venue.objects.create(
+            name='The Meatballery', state=state, city=city)
+        event = Event.objects.create(venue=venue)
+        EventOccurrence.objects.create(
+            event=event, date=datetime.date.today() + datetime.timedelta(days=1))
+
+    def test_reverse_city_dropdown_list_name_lists_cities_with_upcoming_events(self):
+        response = self.client.get(reverse('city-dropdown-list'), {'state': 'NY'})
+        self.assertContains(response, '<option value="1">New York, NY</option>')
+        self.assertNotContains(response, 'Albany')
+
+    def test_reverse_city_dropdown_list_name_costs_no_queries_once_cached(self):
+        url = reverse('city-dropdown-list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'New York, NY')
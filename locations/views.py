@@ -1,13 +1,13 @@
-import datetime
-
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.views import generic
 from django.views.generic.edit import CreateView, UpdateView
 
+from schedule.facets import get_schedule_map, load_facet_index
+
 from .filters import VenueFilter
 from .forms import VenueForm
-from .models import Venue, City
+from .models import Venue, City, State
 
 class VenueListView(generic.ListView):
     model = Venue
@@ -53,11 +53,18 @@ class VenueUpdate(UpdateView):
         return super().form_valid(form)
         
 def load_cities(request):
-    state_id = request.GET.get('state')
-    if state_id:
-        cities = City.objects.filter(state_id=state_id).order_by('name')
+    schedule_map = get_schedule_map(load_facet_index())
+    state = schedule_map['states'].get(request.GET.get('state'))
+    if state:
+        city_ids = [str(city_id) for city_id in state['cities']]
     else:
-        cities = City.objects.filter(
-            venues__events__event_occurrences__isnull=False,
-            venues__events__event_occurrences__date__gte=datetime.date.today()).distinct()
-    return render(request, 'locations/city_dropdown_list.html', {'cities': cities})
\ No newline at end of file
+        city_ids = sorted(
+            schedule_map['cities'],
+            key=lambda city_id: schedule_map['cities'][city_id]['name'])
+    cities = []
+    for city_id in city_ids:
+        city = schedule_map['cities'][city_id]
+        cities.append(City(
+            pk=int(city_id), name=city['name'],
+            state=city['state'] and State(name=city['state'])))
+    return render(request, 'locations/city_dropdown_list.html', {'cities': cities})
@@ -1,16 +1,19 @@
 from django.contrib import admin, messages
-from .models import Day, Time, Event, EventImage, EventOccurrence
+
+from accounting.admin import DeferredPayrollMixin
+
+from .models import (
+    Day, Time, Event, EventExceptionDate, EventImage, EventOccurrence,
+    bulk_generate_event_occurrences)
 
 admin.site.register(Day)
 admin.site.register(Time)
 
 def generate_event_occurrences_from_event(modeladmin, request, queryset):
-    total = 0
     for object in queryset:
         if not object.start_date:
             messages.error(request, 'Did not generate occurrences for {0} because it needs a start date.'.format(object))
-        generated = object.generate_event_occurrences()
-        total += generated
+    total, deleted = bulk_generate_event_occurrences(queryset, force=True)
     if total == 0:
         messages.warning(request, 'No event occurrences were generated.')
     else:
@@ -24,11 +27,15 @@ class EventOccurrenceInline(admin.TabularInline):
     extra = 0
     classes = ['collapse']
 
+class EventExceptionDateInline(admin.TabularInline):
+    model = EventExceptionDate
+    extra = 0
+
 class EventImageInline(admin.TabularInline):
     model = EventImage
     extra = 0
 
-class EventAdmin(admin.ModelAdmin):
+class EventAdmin(DeferredPayrollMixin, admin.ModelAdmin):
     list_display = (
         'venue', 'host', 'day', 'time', 'start_date', 'end_date', 
         'is_private', 'status',
@@ -40,6 +47,11 @@ class EventAdmin(admin.ModelAdmin):
                 'venue', 'host', 'day', 'time', 'start_date', 'end_date',
                 'is_private', 'status', 'request_future_restart')
         }),
+        ('Recurrence', {
+            'fields': (
+                'recurrence', 'week_of_month',
+                'season_start', 'season_end')
+        }),
         ('Prizes', {
             'fields': (
                 'first_place_prize', 'second_place_prize',
@@ -51,7 +63,8 @@ class EventAdmin(admin.ModelAdmin):
                 'incremental_teams', 'incremental_rate')
         }),
     )
-    inlines = (EventOccurrenceInline, EventImageInline)
+    inlines = (
+        EventOccurrenceInline, EventExceptionDateInline, EventImageInline)
     actions = [generate_event_occurrences_from_event]
 
 admin.site.register(Event, EventAdmin)
@@ -61,7 +74,7 @@ class EventImageAdmin(admin.ModelAdmin):
 
 admin.site.register(EventImage, EventImageAdmin)
 
-class EventOccurrenceAdmin(admin.ModelAdmin):
+class EventOccurrenceAdmin(DeferredPayrollMixin, admin.ModelAdmin):
     list_display = (
         'event', 'day', 'time', 'date', 'host', 'change_host',
         'status', 'cancellation_reason', 'cancelled_ahead', 'time_started',
@@ -0,0 +1,204 @@
+import datetime
+import hashlib
+
+from django.apps import apps
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from triviacompany.cache import get_queryset_version
+
+from .models import merge_virtual_occurrences
+
+CALENDAR_SALT = 'schedule.calendar'
+CALENDAR_NAMES = {
+    'host': 'Trivia City - My Events',
+    'venue': 'Trivia City - Venue Schedule',
+    'region': 'Trivia City - {0} Events',
+    'available': 'Trivia City - Available Events',
+}
+EVENT_DURATION = 'PT2H'
+VIRTUAL_OCCURRENCE_WEEKS = 26
+PRODID = '-//Trivia City//Schedule//EN'
+
+# Feeds are addressed by a signed token naming what they cover, so a
+# calendar app can poll them without a session. Hosts who want to revoke a
+# leaked feed URL need SECRET_KEY rotated.
+def get_calendar_token(kind, pk):
+    return signing.Signer(salt=CALENDAR_SALT).sign(
+        '{0}-{1}'.format(kind, pk))
+
+def read_calendar_token(token):
+    try:
+        kind, pk = signing.Signer(salt=CALENDAR_SALT).unsign(
+            token).split('-', 1)
+    except (signing.BadSignature, ValueError):
+        return None
+    if kind not in CALENDAR_NAMES:
+        return None
+    return kind, pk
+
+def get_calendar_url(kind, pk):
+    return reverse(
+        'event-occurrence-calendar', args=[get_calendar_token(kind, pk)])
+
+def get_calendar_etag(token, today=None):
+    # Read from the database rather than the cache, which may be local to
+    # the process, so writes made by another worker or by roll_schedule
+    # change it too. A poll that changes nothing costs two aggregates.
+    calendar = read_calendar_token(token)
+    if calendar is None:
+        return None
+    kind, pk = calendar
+    today = today or datetime.date.today()
+    parts = [
+        token, today,
+        get_queryset_version(
+            get_calendar_queryset(kind, pk, today), 'modified',
+            'event__modified', 'event__venue__modified'),
+        get_queryset_version(
+            get_calendar_events(kind, pk), 'modified', 'venue__modified',
+            'exception_dates__pk'),
+    ]
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+def get_calendar_queryset(kind, pk, today=None):
+    EventOccurrence = apps.get_model('schedule', 'EventOccurrence')
+    today = today or datetime.date.today()
+    event_occurrences = EventOccurrence.objects.filter(date__gte=today)
+    if kind == 'host':
+        event_occurrences = event_occurrences.filter(
+            Q(event__host=pk) | Q(host=pk))
+    elif kind == 'venue':
+        event_occurrences = event_occurrences.filter(
+            event__venue=pk, event__is_private=False)
+    elif kind == 'region':
+        event_occurrences = event_occurrences.filter(
+            event__venue__state=pk, event__is_private=False)
+    elif kind == 'available':
+        event_occurrences = event_occurrences.filter(change_host=True)
+    return (event_occurrences
+               .select_related('event__venue__city', 'host')
+               .order_by('date', 'time_id', 'pk'))
+
+def get_calendar_events(kind, pk):
+    # The events whose dates past the generated occurrences are added to a
+    # feed. Dates that are not generated yet have no one to cover them, so
+    # the available feed takes none.
+    Event = apps.get_model('schedule', 'Event')
+    events = Event.objects.filter(status__in=['S', 'A', 'E'])
+    if kind == 'host':
+        events = events.filter(host=pk)
+    elif kind == 'venue':
+        events = events.filter(venue=pk, is_private=False)
+    elif kind == 'region':
+        events = events.filter(venue__state=pk, is_private=False)
+    else:
+        events = events.none()
+    return events.select_related('venue__city', 'host', 'day', 'time')
+
+def get_calendar_event_occurrences(kind, pk, today=None):
+    # Saved occurrences and the event's recurrence rule, exception dates
+    # included, as the schedule pages show them.
+    today = today or datetime.date.today()
+    return merge_virtual_occurrences(
+        get_calendar_queryset(kind, pk, today),
+        get_calendar_events(kind, pk), today,
+        today + datetime.timedelta(weeks=VIRTUAL_OCCURRENCE_WEEKS))
+
+def escape_text(value):
+    return (str(value or '')
+               .replace('\\', '\\\\')
+               .replace(';', '\\;')
+               .replace(',', '\\,')
+               .replace('\n', '\\n'))
+
+def fold_line(line):
+    # Content lines are limited to 75 octets; longer ones continue on the
+    # next line after a single leading space.
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    chunks = []
+    while encoded:
+        limit = 75 if not chunks else 74
+        chunk = encoded[:limit]
+        while limit > 1:
+            try:
+                chunk.decode()
+                break
+            except UnicodeDecodeError:
+                limit -= 1
+                chunk = encoded[:limit]
+        chunks.append(chunk.decode())
+        encoded = encoded[limit:]
+    return '\r\n '.join(chunks) + '\r\n'
+
+def format_utc(value):
+    return value.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def format_event_occurrence(event_occurrence, domain):
+    event = event_occurrence.event
+    venue = event and event.venue
+    host = event_occurrence.host
+    summary = 'Trivia at {0}'.format(venue and venue.name or 'TBD')
+    if event_occurrence.change_host:
+        summary += ' (needs a host)'
+    location = ', '.join(part for part in (
+        venue and venue.address, venue and venue.city and venue.city.name,
+        venue and venue.state_id) if part)
+    # Keyed on the event and date rather than the row, so a date keeps its
+    # UID once someone acts on it and it is saved.
+    if event_occurrence.event_id and event_occurrence.date:
+        uid = 'event-{0}-{1}@{2}'.format(
+            event_occurrence.event_id,
+            event_occurrence.date.strftime('%Y%m%d'), domain)
+    else:
+        uid = 'event-occurrence-{0}@{1}'.format(event_occurrence.pk, domain)
+    modified = event_occurrence.modified or (event and event.modified)
+    lines = [
+        'BEGIN:VEVENT',
+        'UID:{0}'.format(uid),
+        'DTSTAMP:{0}'.format(format_utc(modified or timezone.now())),
+    ]
+    if event_occurrence.time_id:
+        # Written in UTC, so no VTIMEZONE block is needed.
+        start = timezone.make_aware(
+            datetime.datetime.combine(
+                event_occurrence.date, event_occurrence.time_id),
+            is_dst=False)
+        lines += [
+            'DTSTART:{0}'.format(format_utc(start)),
+            'DURATION:{0}'.format(EVENT_DURATION),
+        ]
+    else:
+        lines.append('DTSTART;VALUE=DATE:{0}'.format(
+            event_occurrence.date.strftime('%Y%m%d')))
+    lines += [
+        'SUMMARY:{0}'.format(escape_text(summary)),
+        'LOCATION:{0}'.format(escape_text(location)),
+        'DESCRIPTION:{0}'.format(escape_text('Host: {0} {1}'.format(
+            host and host.first_name or '',
+            host and host.last_name or '').strip())),
+        'STATUS:{0}'.format(
+            'CANCELLED' if event_occurrence.status == 'No Game'
+            else 'CONFIRMED'),
+        'END:VEVENT',
+    ]
+    return ''.join(fold_line(line) for line in lines)
+
+def get_calendar_name(kind, pk):
+    return CALENDAR_NAMES[kind].format(pk)
+
+def generate_calendar(event_occurrences, name, domain):
+    yield fold_line('BEGIN:VCALENDAR')
+    yield fold_line('VERSION:2.0')
+    yield fold_line('PRODID:{0}'.format(PRODID))
+    yield fold_line('CALSCALE:GREGORIAN')
+    yield fold_line('X-WR-CALNAME:{0}'.format(escape_text(name)))
+    yield fold_line('X-WR-TIMEZONE:{0}'.format(settings.TIME_ZONE))
+    for event_occurrence in event_occurrences:
+        yield format_event_occurrence(event_occurrence, domain)
+    yield fold_line('END:VCALENDAR')
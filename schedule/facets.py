@@ -0,0 +1,189 @@
+import calendar
+import datetime
+import hashlib
+import time
+import uuid
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db.models import Count
+
+FACET_INDEX_KEY = 'schedule:facet-index'
+FACET_INDEX_TIMEOUT = 60 * 60
+FACET_INDEX_LOCK_KEY = 'schedule:facet-index:lock'
+FACET_INDEX_LOCK_TIMEOUT = 10
+FACET_INDEX_LOCK_ATTEMPTS = 5
+FACET_INDEX_LOCK_WAIT = 0.01
+FACET_INDEX_STALE_KEY = 'schedule:facet-index:stale'
+SCHEDULE_MAP_KEY = 'schedule:map:{0}'
+FACETS = ('event__venue__state', 'event__venue__city', 'day')
+
+# How many upcoming occurrences each (state, city, day) combination has.
+# Occurrence writes adjust the counts in place; anything that can move many
+# occurrences at once (an event or venue edit) drops the index so the next
+# read rebuilds it. It is also rebuilt once a day, when yesterday's
+# occurrences stop being upcoming. The version changes whenever a
+# combination appears or disappears and on every rebuild, so a rename picked
+# up by a rebuild also reaches clients holding an older schedule map.
+#
+# Every write to the cached index happens under a short cache.add() lock, so
+# two processes adjusting counts cannot overwrite each other's changes. A
+# writer that cannot get the lock gives up on its change, marks the index
+# stale and drops it; the holder drops it again after writing if it finds
+# the mark, and the next read rebuilds from the database.
+def get_facet_version(combinations, built):
+    keys = sorted(repr(combination) for combination in combinations)
+    return hashlib.md5(repr((keys, built)).encode()).hexdigest()[:12]
+
+def build_facet_index(today):
+    EventOccurrence = apps.get_model('schedule', 'EventOccurrence')
+    rows = (EventOccurrence
+               .objects
+               .filter(date__gte=today)
+               .order_by()
+               .values_list(*FACETS)
+               .annotate(count=Count('pk')))
+    combinations = {
+        (state_id, city_id, day_id): count
+        for state_id, city_id, day_id, count in rows}
+    built = datetime.datetime.now().isoformat()
+    return {
+        'date': today,
+        'built': built,
+        'combinations': combinations,
+        'version': get_facet_version(combinations, built),
+    }
+
+def acquire_facet_index_lock(attempts=FACET_INDEX_LOCK_ATTEMPTS):
+    token = uuid.uuid4().hex
+    for attempt in range(attempts):
+        if cache.add(FACET_INDEX_LOCK_KEY, token, FACET_INDEX_LOCK_TIMEOUT):
+            return token
+        time.sleep(FACET_INDEX_LOCK_WAIT)
+    return None
+
+def release_facet_index_lock(token):
+    if cache.get(FACET_INDEX_LOCK_KEY) == token:
+        cache.delete(FACET_INDEX_LOCK_KEY)
+
+def load_facet_index(today=None):
+    today = today or datetime.date.today()
+    facet_index = cache.get(FACET_INDEX_KEY)
+    if facet_index is None or facet_index['date'] != today:
+        cache.delete(FACET_INDEX_STALE_KEY)
+        facet_index = build_facet_index(today)
+        # Only cached when nobody is adjusting the index meanwhile;
+        # otherwise the next read builds it again.
+        token = acquire_facet_index_lock(attempts=1)
+        if token is not None:
+            try:
+                cache.set(FACET_INDEX_KEY, facet_index, FACET_INDEX_TIMEOUT)
+            finally:
+                release_facet_index_lock(token)
+    return facet_index
+
+def get_facet_index(today=None):
+    counts = {facet: {} for facet in FACETS}
+    combinations = load_facet_index(today)['combinations']
+    for combination, count in combinations.items():
+        for facet, pk in zip(FACETS, combination):
+            if pk is not None:
+                counts[facet][pk] = counts[facet].get(pk, 0) + count
+    return counts
+
+def invalidate_facet_index():
+    cache.delete(FACET_INDEX_KEY)
+
+def update_facet_index(changes):
+    # changes are (event_id, day_id, date, delta) tuples.
+    facet_index = cache.get(FACET_INDEX_KEY)
+    if facet_index is None:
+        return
+    changes = [
+        change for change in changes
+        if change[2] and change[2] >= facet_index['date'] and change[3]]
+    if not changes:
+        return
+    Event = apps.get_model('schedule', 'Event')
+    venues = {
+        pk: (state_id, city_id)
+        for pk, state_id, city_id in (Event
+                                         .objects
+                                         .filter(pk__in=set(
+                                             change[0] for change in changes))
+                                         .values_list(
+                                             'pk', 'venue__state',
+                                             'venue__city'))}
+    token = acquire_facet_index_lock()
+    if token is None:
+        cache.set(FACET_INDEX_STALE_KEY, True, FACET_INDEX_TIMEOUT)
+        invalidate_facet_index()
+        return
+    try:
+        # Read again under the lock; the copy above may be out of date.
+        date = facet_index['date']
+        facet_index = cache.get(FACET_INDEX_KEY)
+        if facet_index is None or facet_index['date'] != date:
+            return
+        combinations = facet_index['combinations']
+        for event_id, day_id, date, delta in changes:
+            combination = venues.get(event_id, (None, None)) + (day_id,)
+            count = combinations.get(combination, 0) + delta
+            if count > 0:
+                combinations[combination] = count
+            else:
+                combinations.pop(combination, None)
+        facet_index['version'] = get_facet_version(
+            combinations, facet_index['built'])
+        cache.set(FACET_INDEX_KEY, facet_index, FACET_INDEX_TIMEOUT)
+        if cache.get(FACET_INDEX_STALE_KEY):
+            invalidate_facet_index()
+    finally:
+        release_facet_index_lock(token)
+
+def get_schedule_map(facet_index):
+    # Built once per version; the dropdowns are filled from it client side.
+    key = SCHEDULE_MAP_KEY.format(facet_index['version'])
+    schedule_map = cache.get(key)
+    if schedule_map is None:
+        City = apps.get_model('locations', 'City')
+        combinations = list(facet_index['combinations'])
+        city_names = dict(City
+                             .objects
+                             .filter(pk__in=set(
+                                 city_id for state_id, city_id, day_id
+                                 in combinations))
+                             .values_list('pk', 'name'))
+        states = {}
+        cities = {}
+        for state_id, city_id, day_id in combinations:
+            entries = []
+            if state_id is not None:
+                state = states.setdefault(
+                    state_id, {'cities': [], 'days': []})
+                entries.append(state)
+                if city_id is not None and city_id not in state['cities']:
+                    state['cities'].append(city_id)
+            if city_id is not None:
+                entries.append(cities.setdefault(str(city_id), {
+                    'name': city_names[city_id], 'state': state_id,
+                    'days': []}))
+            for entry in entries:
+                if day_id is not None and day_id not in entry['days']:
+                    entry['days'].append(day_id)
+        for entry in list(states.values()) + list(cities.values()):
+            entry['days'].sort()
+        for state in states.values():
+            state['cities'].sort(key=lambda city_id: city_names[city_id])
+        schedule_map = {
+            'version': facet_index['version'],
+            'states': states,
+            'cities': cities,
+            'days': {
+                str(day_id): calendar.day_abbr[day_id]
+                for day_id in sorted(set(
+                    day_id for state_id, city_id, day_id in combinations
+                    if day_id is not None))},
+        }
+        cache.set(key, schedule_map, FACET_INDEX_TIMEOUT)
+    return schedule_map
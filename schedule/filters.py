@@ -1,6 +1,7 @@
 import django_filters
 from django import forms
 
+from .facets import get_facet_index
 from .models import Day, EventOccurrence
 
 from locations.models import City, State
@@ -17,11 +18,29 @@ class EventOccurrenceFilter(django_filters.FilterSet):
         fields = ['event__venue__state', 'event__venue__city', 'day']
 
     def narrow_choices(self, field, model):
-        pks = self.queryset.values_list(field, flat=True)
+        pks = list(self.facet_counts[field])
         self.filters[field].field.queryset = model.objects.filter(pk__in=pks)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Choices come from the cached index of upcoming occurrences
+        # rather than a scan of the occurrence table.
+        self.facet_counts = get_facet_index()
         self.narrow_choices('event__venue__state', State)
         self.narrow_choices('event__venue__city', City)
         self.narrow_choices('day', Day)
+
+    def filter_events(self, events):
+        # Mirrors filter_queryset: invalid fields are left out of
+        # cleaned_data and so are ignored.
+        self.errors
+        lookups = {
+            'event__venue__state': 'venue__state',
+            'event__venue__city': 'venue__city',
+            'day': 'day',
+        }
+        for field, lookup in lookups.items():
+            value = self.form.cleaned_data.get(field)
+            if value:
+                events = events.filter(**{lookup: value})
+        return events
@@ -0,0 +1,184 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from accounting.models import (
+    EventOccurrencePayment, PayStub, get_pay_date, payday)
+from accounts.models import CustomUser
+from locations.models import City, State, Venue
+from schedule.models import Day, Time, Event, EventOccurrence
+
+INDEXED_MODELS = (Event, EventOccurrence, EventOccurrencePayment)
+PAGE_SIZE = 50
+
+def seed_schedule(years, events, hosts=20, today=None):
+    # Weekly occurrences for every event, reaching `years` back and eight
+    # weeks ahead, with payments and pay stubs for everything in the past.
+    today = today or datetime.date.today()
+    rng = random.Random(0)
+    state = State.objects.create(name='NY')
+    city = City.objects.create(name='New York')
+    days = Day.objects.bulk_create([Day(day=day) for day in range(7)])
+    times = Time.objects.bulk_create([
+        Time(time=datetime.time(hour, 0)) for hour in (19, 20, 21)])
+    # bulk_create only sets primary keys on PostgreSQL, so rows are read
+    # back before anything points at them.
+    CustomUser.objects.bulk_create([
+        CustomUser(username='benchmark-host-{0}'.format(number))
+        for number in range(hosts)])
+    users = list(CustomUser.objects.filter(
+        username__startswith='benchmark-host-'))
+    Venue.objects.bulk_create([
+        Venue(name='Venue {0}'.format(number), city=city, state=state)
+        for number in range(events)])
+    venues = list(Venue.objects.filter(city=city))
+    first_date = today - datetime.timedelta(days=365 * years)
+    Event.objects.bulk_create([
+        Event(venue=venue, host=rng.choice(users), day=rng.choice(days),
+              time=rng.choice(times), start_date=first_date, status='A')
+        for venue in venues])
+    event_occurrences = []
+    for event in Event.objects.all():
+        date = first_date + datetime.timedelta(
+            days=(event.day_id - first_date.weekday()) % 7)
+        while date <= today + datetime.timedelta(weeks=8):
+            change_host = rng.random() < 0.05
+            event_occurrences.append(EventOccurrence(
+                event=event, date=date, day_id=event.day_id,
+                time_id=event.time_id, change_host=change_host,
+                host=rng.choice(users) if change_host else event.host))
+            date += datetime.timedelta(weeks=1)
+    EventOccurrence.objects.bulk_create(event_occurrences, batch_size=500)
+
+    pay_stubs = {}
+    for date in set(get_pay_date(occurrence.date, payday)
+                    for occurrence in event_occurrences
+                    if occurrence.date < today):
+        for user in users:
+            pay_stubs[user.pk, date] = PayStub(
+                user=user, pay_date=date, paid=date < today)
+    PayStub.objects.bulk_create(pay_stubs.values(), batch_size=500)
+    pay_stubs = {
+        (pay_stub.user_id, pay_stub.pay_date): pay_stub
+        for pay_stub in PayStub.objects.all()}
+    payments = []
+    for pk, date, host_id in (EventOccurrence
+                                 .objects
+                                 .filter(date__lt=today)
+                                 .values_list('pk', 'date', 'host')):
+        pay_date = get_pay_date(date, payday)
+        payments.append(EventOccurrencePayment(
+            event_occurrence_id=pk, submission_date=date,
+            paid=pay_date < today,
+            pay_stub=pay_stubs[host_id, pay_date]))
+    EventOccurrencePayment.objects.bulk_create(payments, batch_size=500)
+    if connection.vendor in ('postgresql', 'sqlite'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    return len(event_occurrences), len(payments)
+
+def get_benchmark_queries(today=None):
+    today = today or datetime.date.today()
+    host = CustomUser.objects.filter(
+        username__startswith='benchmark-host-').order_by('pk').first()
+    pay_stub = PayStub.objects.filter(paid=False).order_by('pk').first()
+    event_occurrence = (EventOccurrence
+                           .objects
+                           .filter(date__lt=today)
+                           .order_by('-pk')
+                           .first())
+    ordering = ('date', 'time_id', 'pk')
+    return [
+        ('upcoming', EventOccurrence.objects
+            .filter(date__gte=today).order_by(*ordering)[:PAGE_SIZE]),
+        ('past', EventOccurrence.objects
+            .filter(date__lte=today)
+            .order_by('-date', '-time_id', '-pk')[:PAGE_SIZE]),
+        ('available', EventOccurrence.objects
+            .filter(change_host=True, date__gte=today)
+            .order_by(*ordering)[:PAGE_SIZE]),
+        ('host', EventOccurrence.objects
+            .filter(Q(event__host=host) | Q(host=host), date__gte=today)
+            .order_by(*ordering)[:PAGE_SIZE]),
+        ('paid occurrence', EventOccurrencePayment.objects
+            .filter(event_occurrence=event_occurrence, paid=True)),
+        ('pay stub', EventOccurrencePayment.objects
+            .filter(pay_stub=pay_stub, paid=False)),
+    ]
+
+def time_query(queryset, repeat):
+    timings = []
+    for run in range(repeat):
+        started = time.perf_counter()
+        list(queryset.all())
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+def set_indexes(enabled):
+    with connection.schema_editor() as schema_editor:
+        for model in INDEXED_MODELS:
+            for index in model._meta.indexes:
+                if enabled:
+                    schema_editor.add_index(model, index)
+                else:
+                    schema_editor.remove_index(model, index)
+
+def benchmark_queries(repeat=5):
+    # Each query is planned and timed without the tailored indexes and then
+    # again with them, on the same data.
+    results = {}
+    queries = get_benchmark_queries()
+    set_indexes(False)
+    try:
+        for name, queryset in queries:
+            results[name] = {
+                'before': (queryset.explain(), time_query(queryset, repeat))}
+    finally:
+        set_indexes(True)
+    for name, queryset in queries:
+        results[name]['after'] = (
+            queryset.explain(), time_query(queryset, repeat))
+    return [(name, results[name]) for name, queryset in queries]
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway test database with years of occurrences and '
+            'prints the plan and timing of the schedule and payment list '
+            'queries without and with their indexes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years', type=int, default=3,
+            help='Years of past occurrences to seed (default 3).')
+        parser.add_argument(
+            '--events', type=int, default=200,
+            help='Number of weekly events to seed (default 200).')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs per query; the fastest is reported (default 5).')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            occurrences, payments = seed_schedule(
+                options['years'], options['events'])
+            self.stdout.write(
+                'Seeded {0} occurrences and {1} payments.'.format(
+                    occurrences, payments))
+            self.write_results(benchmark_queries(options['repeat']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def write_results(self, results):
+        for name, result in results:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label in ('before', 'after'):
+                plan, milliseconds = result[label]
+                self.stdout.write('{0}: {1:.2f} ms'.format(label, milliseconds))
+                for line in plan.splitlines():
+                    self.stdout.write('    ' + line)
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from accounting.payroll import deferred_payroll
+from schedule.models import (
+    Event, bulk_generate_event_occurrences, update_event_statuses)
+
+def roll_chunk(event_pks, weeks, force=False):
+    # Payments outlive trimmed occurrences (their link is set to null), so
+    # stub totals stand; any pay stub recalculation the chunk does cause
+    # happens once per stub.
+    started = time.time()
+    events = Event.objects.filter(pk__in=event_pks)
+    with deferred_payroll():
+        generated, deleted = bulk_generate_event_occurrences(
+            events, weeks=weeks, force=force)
+    return generated, deleted, time.time() - started
+
+def roll_chunk_in_worker(event_pks, weeks, force=False):
+    # Each worker thread opens its own connection; close it when done so
+    # the pool does not leave idle connections behind.
+    try:
+        return roll_chunk(event_pks, weeks, force)
+    finally:
+        connections.close_all()
+
+class Command(BaseCommand):
+    help = ('Generates event occurrences up to the horizon for every '
+            'starting, active and ending event.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--weeks', type=int, default=8,
+            help='Number of weeks ahead to generate (default 8).')
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help='Number of events processed per chunk (default 100).')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of chunks processed in parallel (default 4).')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate events even if they are already up to date.')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        weeks = options['weeks']
+        force = options['force']
+        transitions = update_event_statuses()
+        self.stdout.write(
+            'Updated the status of {0} events.'.format(len(transitions)))
+        chunk_size = max(options['chunk_size'], 1)
+        event_pks = list(Event.objects
+                             .filter(status__in=['S', 'A', 'E'])
+                             .order_by('pk')
+                             .values_list('pk', flat=True))
+        chunks = [event_pks[i:i + chunk_size]
+                  for i in range(0, len(event_pks), chunk_size)]
+
+        if options['workers'] > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = pool.map(
+                    roll_chunk_in_worker, chunks,
+                    [weeks] * len(chunks), [force] * len(chunks))
+                results = list(results)
+        else:
+            results = [roll_chunk(chunk, weeks, force) for chunk in chunks]
+
+        total_generated = 0
+        total_deleted = 0
+        for number, (generated, deleted, seconds) in enumerate(results, 1):
+            total_generated += generated
+            total_deleted += deleted
+            self.stdout.write(
+                'Chunk {0}/{1}: generated {2}, deleted {3} in {4:.2f}s'.format(
+                    number, len(chunks), generated, deleted, seconds))
+        self.stdout.write(self.style.SUCCESS(
+            'Rolled {0} events: generated {1}, deleted {2} in {3:.2f}s'.format(
+                len(event_pks), total_generated, total_deleted,
+                time.time() - started)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from schedule.models import update_event_statuses
+
+class Command(BaseCommand):
+    help = ('Recalculates the status of every event from its start and '
+            'end dates and picks up requested restarts.')
+
+    def handle(self, *args, **options):
+        transitions = update_event_statuses()
+        for pk, venue, old_status, new_status in transitions:
+            self.stdout.write('Event {0} ({1}): {2} -> {3}'.format(
+                pk, venue, old_status or '-', new_status))
+        self.stdout.write(self.style.SUCCESS(
+            'Updated the status of {0} events.'.format(len(transitions))))
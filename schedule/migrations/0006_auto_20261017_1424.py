@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-17 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0005_event_is_private'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='generated_through',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='generation_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
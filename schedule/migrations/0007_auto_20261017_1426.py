@@ -0,0 +1,47 @@
+# Generated by Django 2.2 on 2026-10-17 18:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0006_auto_20261017_1424'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='recurrence',
+            field=models.CharField(choices=[('W', 'Weekly'), ('B', 'Every other week'), ('M', 'Monthly')], default='W', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='season_end',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(1, 'January'), (2, 'February'), (3, 'March'), (4, 'April'), (5, 'May'), (6, 'June'), (7, 'July'), (8, 'August'), (9, 'September'), (10, 'October'), (11, 'November'), (12, 'December')], help_text='Only for seasonal events. Last month of the season.', null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='season_start',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(1, 'January'), (2, 'February'), (3, 'March'), (4, 'April'), (5, 'May'), (6, 'June'), (7, 'July'), (8, 'August'), (9, 'September'), (10, 'October'), (11, 'November'), (12, 'December')], help_text='Only for seasonal events. First month of the season.', null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='week_of_month',
+            field=models.SmallIntegerField(blank=True, choices=[(1, 'First'), (2, 'Second'), (3, 'Third'), (4, 'Fourth'), (-1, 'Last')], help_text='Only required for monthly events.', null=True),
+        ),
+        migrations.CreateModel(
+            name='EventExceptionDate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('reason', models.CharField(blank=True, max_length=100)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exception_dates', to='schedule.Event')),
+            ],
+            options={
+                'ordering': ['date'],
+                'unique_together': {('event', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-17 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0007_auto_20261017_1426'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='eventoccurrence',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2 on 2026-10-17 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0008_auto_20261017_1456'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['host', 'status'], name='event_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventoccurrence',
+            index=models.Index(fields=['date', 'time', 'id'], name='event_occurrence_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventoccurrence',
+            index=models.Index(fields=['host', 'date'], name='event_occurrence_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventoccurrence',
+            index=models.Index(fields=['event', 'date'], name='event_occurrence_event_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventoccurrence',
+            index=models.Index(condition=models.Q(change_host=True), fields=['date', 'time'], name='event_occurrence_avail_idx'),
+        ),
+    ]
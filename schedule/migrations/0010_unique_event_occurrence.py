@@ -0,0 +1,97 @@
+# Generated by Django 2.2 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+# What someone records on an occurrence after it is generated.
+GAME_FIELDS = (
+    'host', 'change_host', 'status', 'cancellation_reason', 'cancelled_ahead',
+    'time_started', 'time_ended', 'number_of_teams', 'scoresheet', 'notes')
+
+def get_game_record(row):
+    # The game fields that differ from what generating the row writes.
+    generated = {'host': row['event__host'], 'change_host': False,
+                 'status': 'Game', 'cancelled_ahead': False}
+    return {field: row[field] for field in GAME_FIELDS
+            if row[field] not in (None, '')
+            and row[field] != generated.get(field)}
+
+def merge_duplicate_event_occurrences(apps, schema_editor):
+    # Keeps one occurrence per (event, date): the first one with a payment,
+    # otherwise the oldest. What was recorded on any of them is copied onto
+    # it, and payments of the others are moved onto it before they are
+    # deleted, so no payment loses its occurrence. Duplicates that recorded
+    # different values for the same field stop the migration, listed, to
+    # be resolved by hand.
+    EventOccurrence = apps.get_model('schedule', 'EventOccurrence')
+    EventOccurrencePayment = apps.get_model(
+        'accounting', 'EventOccurrencePayment')
+    duplicates = (EventOccurrence
+                     .objects
+                     .filter(event__isnull=False)
+                     .order_by()
+                     .values_list('event', 'date')
+                     .annotate(count=models.Count('pk'))
+                     .filter(count__gt=1))
+    conflicts = []
+    for event_id, date, count in duplicates:
+        rows = list(EventOccurrence
+                       .objects
+                       .filter(event=event_id, date=date)
+                       .annotate(payments=models.Count(
+                           'event_occurrence_payments'))
+                       .order_by('-payments', 'pk')
+                       .values('pk', 'event__host', *GAME_FIELDS))
+        record = {}
+        clashing = set()
+        for row in rows:
+            for field, value in get_game_record(row).items():
+                if record.setdefault(field, value) != value:
+                    clashing.add(field)
+        if clashing:
+            conflicts.append('event {0} on {1}: {2}'.format(
+                event_id, date, ', '.join(sorted(clashing))))
+            continue
+        keep, others = rows[0]['pk'], [row['pk'] for row in rows[1:]]
+        if record:
+            EventOccurrence.objects.filter(pk=keep).update(**record)
+        (EventOccurrencePayment
+            .objects
+            .filter(event_occurrence__in=others)
+            .update(event_occurrence=keep))
+        EventOccurrence.objects.filter(pk__in=others).delete()
+    if conflicts:
+        raise RuntimeError(
+            'Duplicate event occurrences disagree and must be merged by '
+            'hand before migrating:\n' + '\n'.join(conflicts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0009_schedule_query_indexes'),
+        ('accounting', '0006_payment_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_event_occurrences, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='eventoccurrence',
+            name='event_occurrence_event_idx',
+        ),
+        # SQLite rebuilds the table to add the constraint and cannot carry
+        # the partial index across, so it is dropped and recreated around it.
+        migrations.RemoveIndex(
+            model_name='eventoccurrence',
+            name='event_occurrence_avail_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='eventoccurrence',
+            constraint=models.UniqueConstraint(fields=('event', 'date'), name='unique_event_occurrence'),
+        ),
+        migrations.AddIndex(
+            model_name='eventoccurrence',
+            index=models.Index(condition=models.Q(change_host=True), fields=['date', 'time'], name='event_occurrence_avail_idx'),
+        ),
+    ]
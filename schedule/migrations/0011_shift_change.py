@@ -0,0 +1,25 @@
+# Generated by Django 2.2 on 2026-10-17 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0010_unique_event_occurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShiftChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('shift-released', 'Released'), ('shift-taken', 'Taken')], max_length=20)),
+                ('data', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+    ]
@@ -1,21 +1,40 @@
 import calendar
 import datetime
+import hashlib
+import logging
 import os
+from functools import partial
 
 from django.apps import apps
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.storage import FileSystemStorage
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 
+from accounting.payroll import recalculate_pay_stub
 from locations.models import Venue
+from triviacompany.cache import invalidate_public_pages
+from triviacompany.tracking import FieldTrackerMixin
+
+from .facets import update_facet_index
+from .shifts import SHIFT_RELEASED, SHIFT_TAKEN, publish_shift_change
+from .recurrence import (
+    FREQUENCY, MONTH, MONTHLY, WEEK_OF_MONTH, WEEKLY, Recurrence)
 
 from PIL import Image, ExifTags
 from io import BytesIO
 
+logger = logging.getLogger(__name__)
+
+ENDING_MARGIN = datetime.timedelta(days=14)
+PAID_OCCURRENCE_MESSAGE = (
+    'This event has already been paid, so its game details can no longer '
+    'be changed.')
+
 class OverwriteStorage(FileSystemStorage):
 
     def get_available_name(self, name, max_length=None):
@@ -48,6 +67,30 @@ def compare_day_and_date(self, day, date, name):
         raise ValidationError(
             _('Please specify the day of the week.'), code='invalid')
 
+def get_event_status(start_date, end_date, status='', today=None):
+    today = today or datetime.date.today()
+    if start_date and start_date > today:
+        return 'S'
+    elif end_date and end_date < today:
+        return 'T'
+    elif end_date and end_date < today + ENDING_MARGIN:
+        return 'E'
+    elif start_date and start_date < today:
+        return 'A'
+    return status
+
+def event_status_expression(today=None):
+    # The same rules as get_event_status, evaluated by the database.
+    today = today or datetime.date.today()
+    return models.Case(
+        models.When(start_date__gt=today, then=models.Value('S')),
+        models.When(end_date__lt=today, then=models.Value('T')),
+        models.When(
+            end_date__lt=today + ENDING_MARGIN, then=models.Value('E')),
+        models.When(start_date__lt=today, then=models.Value('A')),
+        default=models.F('status'),
+        output_field=models.CharField())
+
 def find_closest_date(date, weekday_int): # 0=Mon, 1=Tue...
     days_ahead = weekday_int - date.weekday()
     if days_ahead <= 0:
@@ -124,6 +167,23 @@ class Event(models.Model):
     status = models.CharField(max_length=1, choices=EVENT_STATUS, blank=True)
     request_future_restart = models.BooleanField(default=False)
 
+    recurrence = models.CharField(
+        max_length=1, choices=FREQUENCY, default=WEEKLY)
+    week_of_month = models.SmallIntegerField(
+        choices=WEEK_OF_MONTH, null=True, blank=True,
+        help_text='Only required for monthly events.')
+    season_start = models.PositiveSmallIntegerField(
+        choices=MONTH, null=True, blank=True,
+        help_text='Only for seasonal events. First month of the season.')
+    season_end = models.PositiveSmallIntegerField(
+        choices=MONTH, null=True, blank=True,
+        help_text='Only for seasonal events. Last month of the season.')
+
+    generated_through = models.DateField(
+        null=True, blank=True, editable=False)
+    generation_fingerprint = models.CharField(
+        max_length=32, blank=True, editable=False)
+
     BASE_TEAMS = 5
     BASE_RATE = 125
     INCREMENTAL_TEAMS = 1
@@ -139,9 +199,13 @@ class Event(models.Model):
     incremental_rate = models.DecimalField(
         max_digits=6, decimal_places=2,
         default=INCREMENTAL_RATE, null=True, blank=True)
+    modified = models.DateTimeField(auto_now=True)
 
-    # class Meta:
+    class Meta:
         # db_table = 'event'
+        indexes = [
+            models.Index(fields=['host', 'status'], name='event_host_idx'),
+        ]
 
     def __str__(self):
         return '{0} ({1} at {2})'.format(
@@ -163,51 +227,92 @@ class Event(models.Model):
                         _('The start date is later than the end date. '
                         'Please correct.'), code='invalid')
 
-        margin = datetime.timedelta(days = 14)
-        if self.start_date and self.start_date > datetime.date.today():
-            self.status = 'S'
-        elif self.end_date and self.end_date < datetime.date.today():
-            self.status = 'T'
-        elif self.end_date and self.end_date < datetime.date.today() + margin:
-            self.status = 'E'
-        elif self.start_date and self.start_date < datetime.date.today():
-            self.status = 'A'
-
-    def generate_event_occurrences(self, weeks=8):
-        generated = 0
-        if self.start_date:
-            today = datetime.date.today()
-            closest_date = find_closest_date(today, self.day.day)
-            if closest_date < self.start_date:
-                break_point = self.start_date
-            else:
-                break_point = closest_date
-            last_occurrence_date = closest_date + datetime.timedelta(weeks=weeks-1)
-            if self.end_date and self.end_date >= today:
-                if self.end_date < closest_date:
-                    break_point = self.end_date
-                if last_occurrence_date > self.end_date:
-                    while last_occurrence_date > self.end_date:
-                        if EventOccurrence.objects.filter(
-                                event=self, day=self.day, time=self.time,
-                                date=last_occurrence_date).exists():
-                            EventOccurrence.objects.filter(
-                                event=self, day=self.day, time=self.time,
-                                date=last_occurrence_date).delete()
-                        last_occurrence_date -= datetime.timedelta(weeks=1)
-            elif self.end_date and self.end_date < today:
-                return 0
-            while last_occurrence_date >= break_point:
-                if not EventOccurrence.objects.filter(
-                    event=self, day=self.day, time=self.time, host=self.host,
-                    date=last_occurrence_date).exists():
-                    EventOccurrence.objects.create(
-                        event=self, day=self.day, time=self.time, host=self.host,
-                        date=last_occurrence_date)
-                    generated += 1
-                last_occurrence_date -= datetime.timedelta(weeks=1)
+        if self.recurrence == MONTHLY and not self.week_of_month:
+            raise ValidationError({
+                'week_of_month': ValidationError(
+                    _('Please specify the week of the month.'),
+                    code='required')})
+
+        if bool(self.season_start) != bool(self.season_end):
+            raise ValidationError(
+                _('Please specify both the first and last month '
+                'of the season.'), code='invalid')
+
+        self.status = get_event_status(
+            self.start_date, self.end_date, self.status)
+
+    def get_generation_fingerprint(self):
+        values = [
+            self.day_id, self.time_id, self.host_id,
+            self.start_date, self.end_date, self.recurrence,
+            self.week_of_month, self.season_start, self.season_end]
+        return hashlib.md5(repr(values).encode()).hexdigest()
+
+    def get_generation_horizon(self, weeks=8, today=None):
+        today = today or datetime.date.today()
+        return (find_closest_date(today, self.day_id)
+                + datetime.timedelta(weeks=weeks-1))
+
+    def needs_generation(self, weeks=8, today=None):
+        if not self.start_date or self.day_id is None:
+            return False
+        horizon = self.get_generation_horizon(weeks, today)
+        if self.end_date and self.end_date < horizon:
+            horizon = self.end_date
+        return (self.generation_fingerprint != self.get_generation_fingerprint()
+                or not self.generated_through
+                or self.generated_through < horizon)
+
+    def get_recurrence(self, exception_dates=()):
+        return Recurrence(
+            self.day_id, frequency=self.recurrence,
+            week_of_month=self.week_of_month,
+            start_date=self.start_date, end_date=self.end_date,
+            season_start=self.season_start, season_end=self.season_end,
+            exception_dates=exception_dates)
+
+    def get_generation_window(self, weeks=8, today=None):
+        if not self.start_date or self.day_id is None:
+            return None
+        today = today or datetime.date.today()
+        if self.end_date and self.end_date < today:
+            return None
+        window_start = today + datetime.timedelta(days=1)
+        if self.end_date and self.end_date < window_start:
+            # An event ending today still keeps its last occurrence.
+            window_start = self.end_date
+        return window_start, self.get_generation_horizon(weeks, today)
+
+    def generate_event_occurrences(self, weeks=8, force=False):
+        generated, deleted = bulk_generate_event_occurrences(
+            [self], weeks=weeks, force=force)
         return generated
 
+class EventExceptionDate(models.Model):
+    event = models.ForeignKey(
+        Event, on_delete=models.CASCADE, related_name='exception_dates')
+    date = models.DateField()
+    reason = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ['date']
+        unique_together = ('event', 'date')
+
+    def __str__(self):
+        return '{0} - {1}'.format(self.event, self.date)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.reset_event_generation()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        self.reset_event_generation()
+
+    def reset_event_generation(self):
+        Event.objects.filter(pk=self.event_id).update(
+            generated_through=None, modified=timezone.now())
+
 class EventImage(models.Model):
     event = models.ForeignKey(
         Event, on_delete=models.SET_NULL, null=True,
@@ -245,7 +350,7 @@ class EventImage(models.Model):
             self.image = File(outputstream, self.image.name)
         super().save(*args, **kwargs)
 
-class EventOccurrence(models.Model):
+class EventOccurrence(FieldTrackerMixin, models.Model):
     event = models.ForeignKey(
         Event, on_delete=models.SET_NULL, null=True,
         blank=True, related_name='event_occurrences')
@@ -298,20 +403,66 @@ class EventOccurrence(models.Model):
         help_text=('Please include notes about the game here. '
                   'For example, technical problems, '
                   'customer issues, suggestions, etc...'))
+    modified = models.DateTimeField(auto_now=True)
+
+    # The fields the occurrence's payment is worked out from.
+    PAYMENT_FIELDS = (
+        'event', 'host', 'status', 'cancellation_reason', 'cancelled_ahead',
+        'time_started', 'time_ended', 'number_of_teams')
 
     class Meta:
         # db_table = 'event_occurrence'
         ordering = ('date', 'time')
+        # Lists page on (date, time, pk); host lists OR together the
+        # event's host and the occurrence's host, so both sides get a
+        # (host, date) path (the event side through the unique constraint);
+        # open shifts are a small slice of the table.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['event', 'date'], name='unique_event_occurrence'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['date', 'time', 'id'],
+                name='event_occurrence_date_idx'),
+            models.Index(
+                fields=['host', 'date'], name='event_occurrence_host_idx'),
+            models.Index(
+                fields=['date', 'time'], name='event_occurrence_avail_idx',
+                condition=models.Q(change_host=True)),
+        ]
 
     def __str__(self):
         return '{0} - {1} ({2})'.format(self.event, self.date, self.host)
 
+    def get_facet_key(self, values=None):
+        values = self.__dict__ if values is None else values
+        fields = ('event_id', 'day_id', 'date')
+        if any(field not in values for field in fields):
+            return None
+        return tuple(values[field] for field in fields)
+
+    def get_loaded_facet_key(self):
+        # Only instances loaded from the database (or saved since) carry
+        # loaded values; one built by hand has none until its first save.
+        return self.get_facet_key(getattr(self, 'loaded_values', None) or {})
+
+    @property
+    def is_virtual(self):
+        return self.pk is None
+
+    # Listing querysets precompute the flags below as annotations (see
+    # annotate_event_occurrence_list), so rows render without extra queries.
     @property
     def is_different_time(self):
+        if 'different_time' in self.__dict__:
+            return self.different_time
         return self.time != self.event.time
 
     @property
     def is_different_day(self):
+        if 'different_day' in self.__dict__:
+            return self.different_day
         return self.day != self.event.day
 
     @property
@@ -320,6 +471,8 @@ class EventOccurrence(models.Model):
 
     @property
     def is_complete(self):
+        if 'complete' in self.__dict__:
+            return self.complete
         if (self.status == 'Game'
                 and self.time_started
                 and self.time_ended
@@ -332,6 +485,8 @@ class EventOccurrence(models.Model):
 
     @property
     def has_passed(self):
+        if 'passed' in self.__dict__:
+            return self.passed
         return(datetime.datetime.combine(self.date, self.time.time)
             < datetime.datetime.now())
 
@@ -341,6 +496,8 @@ class EventOccurrence(models.Model):
 
     @property
     def is_late(self):
+        if 'late' in self.__dict__:
+            return self.late
         if not self.is_complete and (
             (datetime.datetime.combine(self.date, self.time.time)
             + datetime.timedelta(days=2)) < datetime.datetime.now()):
@@ -348,6 +505,13 @@ class EventOccurrence(models.Model):
         else:
             return False
 
+    @property
+    def is_paid(self):
+        if 'paid' in self.__dict__:
+            return self.paid
+        payment = self.event_occurrence_payments.first()
+        return bool(payment and payment.paid)
+
     def display_game_length(self):
         if self.time_started and self.time_ended:
             return (datetime.datetime.combine(
@@ -358,26 +522,70 @@ class EventOccurrence(models.Model):
             return 'Not applicable'
     display_game_length.short_description = 'Game Length'
 
+    def get_payment(self):
+        # Read once, with its pay stub, for clean() and save() to share;
+        # save() lets go of it when it is done.
+        if '_payment' not in self.__dict__:
+            EventOccurrencePayment = apps.get_model(
+                'accounting', 'EventOccurrencePayment')
+            self._payment = self.pk and (EventOccurrencePayment
+                                            .objects
+                                            .filter(event_occurrence=self)
+                                            .select_related('pay_stub')
+                                            .first())
+        return self._payment
+
+    def is_payment_locked(self):
+        if '_payment_locked' not in self.__dict__:
+            payment = self.get_payment()
+            self._payment_locked = bool(payment) and payment.is_locked()
+        return self._payment_locked
+
+    def has_locked_payment(self):
+        # Once the occurrence's payment has been paid, or its pay period
+        # closed, nothing that decides the pay may change.
+        if not self.pk:
+            return False
+        dirty_fields = self.get_dirty_fields()
+        if dirty_fields is not None and not any(
+                field in self.PAYMENT_FIELDS for field in dirty_fields):
+            return False
+        return self.is_payment_locked()
+
     def save(self, *args, **kwargs):
-        super(EventOccurrence, self).save(*args, **kwargs)
+        try:
+            if self.has_locked_payment():
+                raise ValidationError(
+                    _(PAID_OCCURRENCE_MESSAGE), code='locked')
+            payment = self.get_payment()
+            super(EventOccurrence, self).save(*args, **kwargs)
+            self.save_payment(payment)
+        finally:
+            self.__dict__.pop('_payment', None)
+            self.__dict__.pop('_payment_locked', None)
+
+    def save_payment(self, payment):
         EventOccurrencePayment = apps.get_model(
             'accounting', 'EventOccurrencePayment')
         if self.is_complete and not self.cancelled_ahead:
-            payment, created = EventOccurrencePayment.objects.get_or_create(
-                event_occurrence=self)
+            if payment is None:
+                # An occurrence has at most one payment (see the unique
+                # constraint), so get_or_create is safe against concurrent
+                # submissions.
+                payment, created = (EventOccurrencePayment
+                                       .objects
+                                       .get_or_create(event_occurrence=self))
+            payment.event_occurrence = self
             payment.save()
-        elif not self.is_complete or self.cancelled_ahead:
-            if (EventOccurrencePayment
-                    .objects
-                    .filter(event_occurrence=self)
-                    .exists()):
-                false_payment = EventOccurrencePayment.objects.get(
-                    event_occurrence=self)
-                pay_stub = false_payment.pay_stub
-                false_payment.delete()
-                pay_stub.save()
+        elif payment and not self.is_payment_locked():
+            pay_stub = payment.pay_stub
+            payment.delete()
+            if pay_stub:
+                recalculate_pay_stub(pay_stub)
 
     def clean(self):
+        if self.has_locked_payment():
+            raise ValidationError(_(PAID_OCCURRENCE_MESSAGE), code='locked')
         if self.date:
             compare_day_and_date(self, self.day, self.date, 'date')
         if self.cancelled_ahead and not self.cancellation_reason:
@@ -402,3 +610,312 @@ class EventOccurrence(models.Model):
                 'number_of_teams': ValidationError(
                     _('Required together.'), code='required_together'),
                  })
+
+class ShiftChange(models.Model):
+    # The shift stream's log (see shifts.py), kept in the database so every
+    # worker reads the same one whatever the cache backend.
+    KIND = (
+        (SHIFT_RELEASED, 'Released'),
+        (SHIFT_TAKEN, 'Taken'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND)
+    data = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.pk, self.kind)
+
+def occurred_before(moment):
+    # Occurrences whose date and time fall before the given moment.
+    return (models.Q(date__lt=moment.date())
+            | models.Q(date=moment.date(), time__time__lt=moment.time()))
+
+def pick_up_event_occurrence(pk, user, now=None):
+    # The checks the pick-up page makes are repeated in the UPDATE itself,
+    # so when several hosts submit at once exactly one matches the row and
+    # the rest update nothing. No lock is held between page and submit.
+    now = now or datetime.datetime.now()
+    picked_up = (EventOccurrence
+                    .objects
+                    .filter(pk=pk, change_host=True, cancelled_ahead=False)
+                    .exclude(occurred_before(now))
+                    .update(
+                        change_host=False, host=user,
+                        modified=timezone.now()))
+    if not picked_up:
+        return False
+    # update() sends no signals.
+    event_occurrence = (EventOccurrence
+                           .objects
+                           .select_related('event__venue', 'time')
+                           .get(pk=pk))
+    transaction.on_commit(
+        partial(publish_shift_change, SHIFT_TAKEN, event_occurrence))
+    transaction.on_commit(invalidate_public_pages)
+    return True
+
+def boolean_case(condition, unless=None):
+    whens = [models.When(condition, then=models.Value(True))]
+    if unless is not None:
+        whens.insert(0, models.When(unless, then=models.Value(False)))
+    return models.Case(
+        *whens, default=models.Value(False),
+        output_field=models.BooleanField())
+
+def annotate_event_occurrence_list(queryset, now=None):
+    now = now or datetime.datetime.now()
+    EventOccurrencePayment = apps.get_model(
+        'accounting', 'EventOccurrencePayment')
+    complete = (
+        models.Q(status='Game',
+                 time_started__isnull=False,
+                 time_ended__isnull=False,
+                 number_of_teams__gt=0)
+        | (models.Q(status='No Game') & ~models.Q(cancellation_reason='')))
+    return (queryset
+               .select_related(
+                   'event__venue__city', 'event__venue__state',
+                   'event__venue__zip', 'event__host', 'event__day',
+                   'event__time', 'host', 'day', 'time')
+               .annotate(
+                   complete=boolean_case(complete),
+                   passed=boolean_case(occurred_before(now)),
+                   late=boolean_case(
+                       occurred_before(now - datetime.timedelta(days=2)),
+                       unless=complete),
+                   different_day=boolean_case(
+                       models.Q(day__isnull=False) | models.Q(
+                           event__day__isnull=False),
+                       unless=models.Q(day=models.F('event__day'))),
+                   different_time=boolean_case(
+                       models.Q(time__isnull=False) | models.Q(
+                           event__time__isnull=False),
+                       unless=models.Q(time=models.F('event__time'))),
+                   paid=models.Exists(
+                       EventOccurrencePayment.objects.filter(
+                           event_occurrence=models.OuterRef('pk'),
+                           paid=True))))
+
+def get_exception_dates(events):
+    exception_dates = {}
+    if events:
+        for event_id, date in (EventExceptionDate
+                                  .objects
+                                  .filter(event__in=events)
+                                  .values_list('event', 'date')):
+            exception_dates.setdefault(event_id, []).append(date)
+    return exception_dates
+
+def expand_events(events, start, end):
+    events = [event for event in events if event.day_id is not None]
+    exception_dates = get_exception_dates(events)
+    return {
+        event.pk: (event
+                      .get_recurrence(exception_dates.get(event.pk, ()))
+                      .between(start, end))
+        for event in events}
+
+def update_event_statuses(today=None):
+    today = today or datetime.date.today()
+
+    # A restart is picked up once the event has been given a new start
+    # date after its old end date.
+    restarted = (Event
+                    .objects
+                    .filter(request_future_restart=True, start_date__gt=today)
+                    .filter(
+                        models.Q(end_date__isnull=True)
+                        | models.Q(end_date__lt=models.F('start_date'))))
+    for pk, venue, start_date in restarted.values_list(
+            'pk', 'venue__name', 'start_date'):
+        logger.info(
+            'Event %s (%s) restarts on %s.', pk, venue, start_date)
+    restarts = restarted.update(
+        end_date=None, request_future_restart=False, modified=timezone.now())
+
+    status = event_status_expression(today)
+    transitions = list(Event
+                          .objects
+                          .annotate(new_status=status)
+                          .exclude(status=models.F('new_status'))
+                          .values_list(
+                              'pk', 'venue__name', 'status', 'new_status'))
+    for pk, venue, old_status, new_status in transitions:
+        logger.info(
+            'Event %s (%s) changed status from %s to %s.',
+            pk, venue, old_status or '-', new_status)
+    if transitions:
+        Event.objects.exclude(status=status).update(
+            status=status, modified=timezone.now())
+    if restarts or transitions:
+        transaction.on_commit(invalidate_public_pages)
+
+    for pk, venue in (Event
+                         .objects
+                         .filter(request_future_restart=True, status='T')
+                         .values_list('pk', 'venue__name')):
+        logger.warning(
+            'Event %s (%s) is terminated and waiting for a restart date.',
+            pk, venue)
+    return transitions
+
+def merge_virtual_occurrences(event_occurrences, events, start, end):
+    # Dates beyond an event's generated_through are not in the database
+    # yet, so they are shown as unsaved occurrences built from the rule.
+    # They are only written once someone acts on them.
+    events = [event for event in events if event.day_id is not None]
+    virtual_occurrences = []
+    if events:
+        dates = expand_events(events, start, end)
+        existing = set(EventOccurrence
+                           .objects
+                           .filter(event__in=events, date__range=(start, end))
+                           .order_by()
+                           .values_list('event', 'date'))
+        for event in events:
+            for date in dates[event.pk]:
+                if event.generated_through and date <= event.generated_through:
+                    continue
+                if (event.pk, date) in existing:
+                    continue
+                virtual_occurrences.append(EventOccurrence(
+                    event=event, day=event.day, time=event.time,
+                    host=event.host, date=date))
+    return sorted(
+        list(event_occurrences) + virtual_occurrences,
+        key=lambda occurrence: (
+            occurrence.date or datetime.date.min,
+            occurrence.time_id or datetime.time.min))
+
+# What is recorded on an occurrence once it is generated.
+RECORDED_FIELDS = (
+    'change_host', 'cancelled_ahead', 'cancellation_reason', 'time_started',
+    'time_ended', 'number_of_teams', 'scoresheet', 'notes')
+
+def is_untouched(occurrence, event):
+    # Only occurrences nobody has acted on are trimmed when their date
+    # drops off the rule: a shift someone picked up or asked off, or one
+    # with a game record or a payment, stays to be sorted out by hand.
+    return (occurrence.host == event.host_id
+            and occurrence.status == 'Game'
+            and not occurrence.has_payment
+            and not any(getattr(occurrence, field)
+                        for field in RECORDED_FIELDS))
+
+def bulk_generate_event_occurrences(events, weeks=8, force=False):
+    # Events whose generation fields are unchanged since the last run and
+    # whose occurrences already reach the horizon are skipped without
+    # touching the database.
+    today = datetime.date.today()
+    stale_events = [
+        event for event in events
+        if force or event.needs_generation(weeks, today)]
+    if not stale_events:
+        return 0, 0
+
+    plans = []
+    for event in stale_events:
+        window = event.get_generation_window(weeks, today)
+        if window:
+            plans.append((event, window))
+            event.generated_through = event.get_generation_horizon(
+                weeks, today)
+            event.generation_fingerprint = event.get_generation_fingerprint()
+            event.modified = timezone.now()
+    stale_events = [event for event, window in plans if event.pk]
+    if not plans:
+        return 0, 0
+
+    exception_dates = get_exception_dates(stale_events)
+    EventOccurrencePayment = apps.get_model(
+        'accounting', 'EventOccurrencePayment')
+    payments = EventOccurrencePayment.objects.filter(
+        event_occurrence=models.OuterRef('pk'))
+    existing_occurrences = (EventOccurrence
+                               .objects
+                               .filter(
+                                   event__in=stale_events,
+                                   date__range=(
+                                       min(window[0] for event, window in plans),
+                                       max(window[1] for event, window in plans)))
+                               .annotate(has_payment=models.Exists(payments))
+                               .order_by()
+                               .values_list(
+                                   'pk', 'event', 'day', 'time', 'date', 'host',
+                                   'status', 'has_payment', *RECORDED_FIELDS,
+                                   named=True))
+    existing = {}
+    taken = set()
+    for occurrence in existing_occurrences:
+        key = (occurrence.event, occurrence.day, occurrence.time)
+        existing.setdefault(key, []).append(occurrence)
+        taken.add((occurrence.event, occurrence.date))
+
+    new_occurrences = []
+    trimmed_pks = []
+    for event, (window_start, window_end) in plans:
+        recurrence = event.get_recurrence(exception_dates.get(event.pk, ()))
+        dates = recurrence.between(window_start, window_end)
+        key = (event.pk, event.day_id, event.time_id)
+        for occurrence in existing.get(key, []):
+            if (occurrence.date not in dates
+                    and window_start <= occurrence.date <= window_end):
+                if is_untouched(occurrence, event):
+                    trimmed_pks.append(occurrence.pk)
+                else:
+                    logger.warning(
+                        'Kept event occurrence %s (event %s on %s), which is '
+                        'no longer on the schedule but has been acted on.',
+                        occurrence.pk, event.pk, occurrence.date)
+        for date in dates:
+            if (event.pk, date) not in taken:
+                new_occurrences.append(EventOccurrence(
+                    event=event, day_id=event.day_id, time_id=event.time_id,
+                    host_id=event.host_id, date=date))
+
+    deleted = 0
+    inserted = []
+    with transaction.atomic():
+        if trimmed_pks:
+            deleted, deleted_per_model = (EventOccurrence
+                                              .objects
+                                              .filter(pk__in=trimmed_pks)
+                                              .delete())
+            deleted = deleted_per_model.get(EventOccurrence._meta.label, 0)
+        if new_occurrences:
+            # A concurrent run may have inserted some of the same dates
+            # since they were read; the unique constraint turns those into
+            # no-ops. No primary keys come back from such an insert, so
+            # the rows that are ours are told apart by the modified stamp
+            # each one was written with.
+            EventOccurrence.objects.bulk_create(
+                new_occurrences, ignore_conflicts=True)
+            stamps = {
+                (occurrence.event_id, occurrence.date): occurrence.modified
+                for occurrence in new_occurrences}
+            written = (EventOccurrence
+                          .objects
+                          .filter(
+                              event__in=stale_events,
+                              date__range=(
+                                  min(date for event_id, date in stamps),
+                                  max(date for event_id, date in stamps)))
+                          .order_by()
+                          .values_list('event', 'day', 'date', 'modified'))
+            inserted = [
+                (event_id, day_id, date)
+                for event_id, day_id, date, modified in written
+                if stamps.get((event_id, date)) == modified]
+        Event.objects.bulk_update(
+            stale_events,
+            ['generated_through', 'generation_fingerprint', 'modified'])
+    # bulk_create and bulk_update send no signals, so the facet counts and
+    # cached pages are updated here.
+    transaction.on_commit(partial(update_facet_index, [
+        (event_id, day_id, date, 1) for event_id, day_id, date in inserted]))
+    transaction.on_commit(invalidate_public_pages)
+    return len(inserted), deleted
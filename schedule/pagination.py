@@ -0,0 +1,64 @@
+import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 50
+
+# Lists are paged by a cursor on (date, time, pk) instead of an offset, so
+# each page is an index range scan no matter how much history there is.
+# Virtual occurrences have no pk; they sort ahead of saved rows on the same
+# date and time and are told apart by their event.
+def get_keyset(event_occurrence):
+    if event_occurrence.pk:
+        return (event_occurrence.date or datetime.date.min,
+                event_occurrence.time_id or datetime.time.min,
+                event_occurrence.pk, 0)
+    return (event_occurrence.date or datetime.date.min,
+            event_occurrence.time_id or datetime.time.min,
+            0, event_occurrence.event_id or 0)
+
+def encode_cursor(keyset):
+    date, time, pk, event_id = keyset
+    return '{0}_{1}_{2}_{3}'.format(
+        date.isoformat(), time.strftime('%H%M%S'), pk, event_id)
+
+def decode_cursor(cursor):
+    date, time, pk, event_id = cursor.split('_')
+    return (datetime.datetime.strptime(date, '%Y-%m-%d').date(),
+            datetime.datetime.strptime(time, '%H%M%S').time(),
+            int(pk), int(event_id))
+
+def filter_after(queryset, keyset, descending=False):
+    date, time, pk, event_id = keyset
+    after = 'lt' if descending else 'gt'
+    return queryset.filter(
+        Q(**{'date__' + after: date})
+        | Q(date=date, **{'time__' + after: time})
+        | Q(date=date, time=time, **{'pk__' + after: pk}))
+
+def paginate_event_occurrences(queryset, after=None, page_size=PAGE_SIZE,
+                               descending=False, merge=None):
+    if descending:
+        queryset = queryset.order_by('-date', '-time_id', '-pk')
+    else:
+        queryset = queryset.order_by('date', 'time_id', 'pk')
+    if after:
+        queryset = filter_after(queryset, after, descending)
+    event_occurrences = list(queryset[:page_size + 1])
+    has_next = len(event_occurrences) > page_size
+    event_occurrences = event_occurrences[:page_size]
+    if merge:
+        # Virtual occurrences past the last saved row belong to a later page.
+        last = has_next and get_keyset(event_occurrences[-1])
+        event_occurrences = sorted(
+            (event_occurrence
+                for event_occurrence in merge(event_occurrences)
+                if (not after or get_keyset(event_occurrence) > after)
+                    and (not last or get_keyset(event_occurrence) <= last)),
+            key=get_keyset)
+        has_next = has_next or len(event_occurrences) > page_size
+        event_occurrences = event_occurrences[:page_size]
+    next_cursor = None
+    if has_next:
+        next_cursor = encode_cursor(get_keyset(event_occurrences[-1]))
+    return event_occurrences, next_cursor
@@ -0,0 +1,107 @@
+import calendar
+
+import numpy
+
+WEEKLY = 'W'
+BIWEEKLY = 'B'
+MONTHLY = 'M'
+
+FREQUENCY = (
+    (WEEKLY, 'Weekly'),
+    (BIWEEKLY, 'Every other week'),
+    (MONTHLY, 'Monthly'),
+)
+
+WEEK_OF_MONTH = (
+    (1, 'First'),
+    (2, 'Second'),
+    (3, 'Third'),
+    (4, 'Fourth'),
+    (-1, 'Last'),
+)
+
+MONTH = tuple(
+    (month, calendar.month_name[month]) for month in range(1, 13))
+
+ONE_DAY = numpy.timedelta64(1, 'D')
+
+def weekmask(weekday): # 0=Mon, 1=Tue...
+    return ''.join('1' if day == weekday else '0' for day in range(7))
+
+# Dates are built as numpy datetime64 arrays and filtered in bulk, so
+# expanding years of an event's schedule never loops day by day.
+class Recurrence:
+
+    def __init__(self, weekday, frequency=WEEKLY, week_of_month=None,
+                 start_date=None, end_date=None, season_start=None,
+                 season_end=None, exception_dates=()):
+        self.weekday = weekday
+        self.frequency = frequency
+        self.week_of_month = week_of_month
+        self.start_date = start_date
+        self.end_date = end_date
+        self.season_start = season_start
+        self.season_end = season_end
+        self.exception_dates = numpy.array(
+            sorted(exception_dates), dtype='datetime64[D]')
+
+    def between(self, start, end):
+        if self.start_date and self.start_date > start:
+            start = self.start_date
+        if self.end_date and self.end_date < end:
+            end = self.end_date
+        if start > end:
+            return []
+        start = numpy.datetime64(start, 'D')
+        end = numpy.datetime64(end, 'D')
+
+        if self.frequency == MONTHLY:
+            dates = self._monthly(start, end)
+        else:
+            dates = self._weekly(start, end)
+
+        if self.season_start and self.season_end:
+            months = dates.astype('datetime64[M]').astype(int) % 12 + 1
+            if self.season_start <= self.season_end:
+                in_season = ((months >= self.season_start)
+                             & (months <= self.season_end))
+            else:
+                in_season = ((months >= self.season_start)
+                             | (months <= self.season_end))
+            dates = dates[in_season]
+        if self.exception_dates.size:
+            dates = dates[~numpy.isin(dates, self.exception_dates)]
+        return dates.tolist()
+
+    def _weekly(self, start, end):
+        first = numpy.busday_offset(
+            start, 0, roll='forward', weekmask=weekmask(self.weekday))
+        step = 7
+        if self.frequency == BIWEEKLY:
+            step = 14
+            # Every other week counts from the first occurrence on or after
+            # the start date, so the cadence does not shift with the window.
+            anchor = numpy.busday_offset(
+                numpy.datetime64(self.start_date or first, 'D'), 0,
+                roll='forward', weekmask=weekmask(self.weekday))
+            if (first - anchor).astype(int) % 14:
+                first = first + numpy.timedelta64(7, 'D')
+        return numpy.arange(
+            first, end + ONE_DAY, numpy.timedelta64(step, 'D'))
+
+    def _monthly(self, start, end):
+        months = numpy.arange(
+            start.astype('datetime64[M]'),
+            end.astype('datetime64[M]') + numpy.timedelta64(1, 'M'))
+        mask = weekmask(self.weekday)
+        if self.week_of_month == -1:
+            last_days = (months + numpy.timedelta64(1, 'M')).astype(
+                'datetime64[D]') - ONE_DAY
+            dates = numpy.busday_offset(
+                last_days, 0, roll='backward', weekmask=mask)
+        else:
+            first_days = months.astype('datetime64[D]')
+            dates = numpy.busday_offset(
+                first_days, (self.week_of_month or 1) - 1,
+                roll='forward', weekmask=mask)
+        return dates[(dates >= start) & (dates <= end)]
@@ -0,0 +1,87 @@
+import json
+import time
+
+from django.apps import apps
+from django.db.models import Max
+from django.urls import reverse
+
+SHIFT_BACKLOG = 100
+SHIFT_STREAM_DURATION = 0
+SHIFT_STREAM_POLL = 1
+SHIFT_STREAM_HEARTBEAT = 15
+SHIFT_STREAM_RETRY = 5000
+SHIFT_RELEASED = 'shift-released'
+SHIFT_TAKEN = 'shift-taken'
+
+# Shift changes are rows of ShiftChange, numbered by its primary key, so
+# every worker and management command publishes to and reads the same
+# log. Only the last SHIFT_BACKLOG of them are kept.
+def publish_shift_change(kind, event_occurrence):
+    ShiftChange = apps.get_model('schedule', 'ShiftChange')
+    venue = event_occurrence.event and event_occurrence.event.venue
+    shift_change = ShiftChange.objects.create(kind=kind, data=json.dumps({
+        'type': kind,
+        'event_occurrence': event_occurrence.pk,
+        'date': event_occurrence.date and event_occurrence.date.isoformat(),
+        'time': event_occurrence.time and str(event_occurrence.time),
+        'venue': venue and venue.name,
+        'url': reverse('pick-up', args=[event_occurrence.pk]),
+    }))
+    ShiftChange.objects.filter(
+        pk__lte=shift_change.pk - SHIFT_BACKLOG).delete()
+    return shift_change.pk
+
+def get_shift_changes(after=None):
+    # Returns the cursor to resume from and the changes after `after`. A
+    # cursor past the end of the log, e.g. one from before the log was
+    # emptied, is moved back to it.
+    ShiftChange = apps.get_model('schedule', 'ShiftChange')
+    changes = []
+    if after is not None:
+        changes = list(ShiftChange
+                          .objects
+                          .filter(pk__gt=after)
+                          .order_by('pk')
+                          .values_list('pk', 'data')[:SHIFT_BACKLOG])
+    if changes:
+        return changes[-1][0], [
+            dict(json.loads(data), id=pk) for pk, data in changes]
+    latest = ShiftChange.objects.aggregate(latest=Max('pk'))['latest'] or 0
+    if after is None or after > latest:
+        return latest, []
+    return after, []
+
+def format_shift_change(message):
+    return 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(
+        message['id'], message['type'], json.dumps(message))
+
+def stream_shift_changes(after=None, duration=None, poll=None,
+                         heartbeat=None, sleep=time.sleep,
+                         clock=time.monotonic):
+    # The response runs on a regular WSGI worker, which is tied up for as
+    # long as the stream stays open, so by default it checks once and ends.
+    # The browser reconnects every SHIFT_STREAM_RETRY milliseconds and
+    # resumes from the id sent last, making this cheap polling over the
+    # EventSource API; a longer `duration` only suits async workers.
+    duration = SHIFT_STREAM_DURATION if duration is None else duration
+    poll = poll or SHIFT_STREAM_POLL
+    heartbeat = heartbeat or SHIFT_STREAM_HEARTBEAT
+    yield 'retry: {0}\n\n'.format(SHIFT_STREAM_RETRY)
+    if after is None:
+        after = get_shift_changes()[0]
+    deadline = clock() + duration
+    last_sent = clock()
+    while True:
+        after, messages = get_shift_changes(after)
+        for message in messages:
+            yield format_shift_change(message)
+            last_sent = clock()
+        if clock() >= deadline:
+            break
+        if clock() - last_sent >= heartbeat:
+            yield ': keep-alive\n\n'
+            last_sent = clock()
+        sleep(poll)
+    # An id with no data moves the browser's Last-Event-ID on without
+    # firing an event, so the next connection starts where this one ended.
+    yield 'id: {0}\n\n'.format(after)
@@ -0,0 +1,76 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import HostProfile
+from locations.models import City, Venue
+from triviacompany.cache import invalidate_public_pages
+
+from .facets import invalidate_facet_index, update_facet_index
+from .models import Event, EventExceptionDate, EventOccurrence
+from .shifts import SHIFT_RELEASED, SHIFT_TAKEN, publish_shift_change
+
+# The handlers below compare against the values the occurrence was loaded
+# with (see FieldTrackerMixin), which are only replaced once post_save has
+# run. An occurrence built by hand has none, so an update to it counts as
+# unknown. The deltas are worked out now but applied to the cached index
+# when the write commits, so a rolled-back save leaves the counts alone.
+@receiver(post_save, sender=EventOccurrence)
+def update_facets_on_save(sender, instance, created, **kwargs):
+    key = instance.get_facet_key()
+    previous = instance.get_loaded_facet_key()
+    if created:
+        transaction.on_commit(partial(update_facet_index, [key + (1,)]))
+    elif previous is None or key is None:
+        transaction.on_commit(invalidate_facet_index)
+    elif previous != key:
+        transaction.on_commit(partial(
+            update_facet_index, [previous + (-1,), key + (1,)]))
+
+@receiver(post_save, sender=EventOccurrence)
+def publish_shift_changes(sender, instance, created, **kwargs):
+    # Sent once the change is committed, so listeners never hear about a
+    # shift that was rolled back or see it before they can load it.
+    previous = (getattr(instance, 'loaded_values', None) or {}).get(
+        'change_host')
+    if instance.change_host and (created or previous is False):
+        transaction.on_commit(
+            partial(publish_shift_change, SHIFT_RELEASED, instance))
+    elif not instance.change_host and previous:
+        transaction.on_commit(
+            partial(publish_shift_change, SHIFT_TAKEN, instance))
+
+@receiver(post_delete, sender=EventOccurrence)
+def update_facets_on_delete(sender, instance, **kwargs):
+    key = instance.get_loaded_facet_key() or instance.get_facet_key()
+    if key is None:
+        transaction.on_commit(invalidate_facet_index)
+    else:
+        transaction.on_commit(partial(update_facet_index, [key + (-1,)]))
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=Venue)
+@receiver(post_delete, sender=Venue)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_facets(sender, **kwargs):
+    transaction.on_commit(invalidate_facet_index)
+
+
+@receiver(post_save, sender=EventOccurrence)
+@receiver(post_delete, sender=EventOccurrence)
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=EventExceptionDate)
+@receiver(post_delete, sender=EventExceptionDate)
+@receiver(post_save, sender=Venue)
+@receiver(post_delete, sender=Venue)
+@receiver(post_save, sender=HostProfile)
+@receiver(post_delete, sender=HostProfile)
+def invalidate_pages(sender, **kwargs):
+    # Only once the write is committed: before that, a concurrent request
+    # would cache the old page under the new version.
+    transaction.on_commit(invalidate_public_pages)
@@ -0,0 +1,196 @@
+import datetime
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from locations.models import State, Venue
+from schedule.calendars import (
+    escape_text, fold_line, format_event_occurrence, get_calendar_token,
+    get_calendar_url, read_calendar_token)
+from schedule.models import (
+    Day, Time, Event, EventExceptionDate, EventOccurrence)
+
+
+class CalendarFormatTest(SimpleTestCase):
+
+    def test_calendar_token_round_trips(self):
+        token = get_calendar_token('region', 'NY')
+        self.assertEqual(read_calendar_token(token), ('region', 'NY'))
+
+    def test_tampered_calendar_token_is_rejected(self):
+        token = get_calendar_token('host', 1)
+        self.assertIsNone(read_calendar_token(token.replace('host-1', 'host-2')))
+
+    def test_calendar_token_of_unknown_kind_is_rejected(self):
+        self.assertIsNone(read_calendar_token(get_calendar_token('payroll', 1)))
+
+    def test_escape_text_escapes_separators_and_newlines(self):
+        self.assertEqual(
+            escape_text('Pizza, beer; trivia\nnight'),
+            'Pizza\\, beer\\; trivia\\nnight')
+
+    def test_fold_line_keeps_lines_to_75_octets(self):
+        folded = fold_line('DESCRIPTION:' + 'é' * 100)
+        lines = folded.split('\r\n')[:-1]
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        self.assertEqual(
+            ''.join(line[1:] if i else line for i, line in enumerate(lines)),
+            'DESCRIPTION:' + 'é' * 100)
+
+
+class EventOccurrenceCalendarViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti',
+            first_name='Carol', last_name='Smith')
+        state = State.objects.create(name='NY')
+        self.venue = Venue.objects.create(
+            name='The Meatballery', address='123 Street', state=state)
+        day = Day.objects.create(day=tomorrow.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        self.event = Event.objects.create(
+            venue=self.venue, host=self.host, day=day, time=time)
+        self.event_occurrence = EventOccurrence.objects.create(
+            event=self.event, date=tomorrow, day=day, time=time,
+            host=self.host)
+        EventOccurrence.objects.create(
+            event=self.event, date=tomorrow - datetime.timedelta(weeks=1),
+            day=day, time=time, host=self.host)
+        self.url = get_calendar_url('host', self.host.pk)
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def start_event(self):
+        self.event.start_date = self.event_occurrence.date
+        self.event.status = 'A'
+        self.event.generated_through = self.event_occurrence.date
+        self.event.save()
+
+    def test_calendar_streams_upcoming_event_occurrences(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Type'], 'text/calendar; charset=utf-8')
+        content = self.read(response)
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(content.count('BEGIN:VEVENT'), 1)
+        self.assertIn(
+            'UID:event-{0}-{1}@testserver'.format(
+                self.event.pk, self.event_occurrence.date.strftime('%Y%m%d')),
+            content)
+        start = timezone.make_aware(datetime.datetime.combine(
+            self.event_occurrence.date, datetime.time(20,0)))
+        self.assertIn('DTSTART:{0}'.format(
+            start.astimezone(datetime.timezone.utc).strftime(
+                '%Y%m%dT%H%M%SZ')), content)
+        self.assertIn('LOCATION:123 Street\\, NY', content)
+
+    def test_calendar_writes_times_in_utc_without_timezone_ids(self):
+        content = self.read(self.client.get(self.url))
+        self.assertNotIn('TZID=', content)
+        self.assertNotIn('BEGIN:VTIMEZONE', content)
+
+    def test_calendar_writes_summer_and_winter_times_in_utc(self):
+        for date, start in ((datetime.date(2030, 7, 1), '20300702T000000Z'),
+                            (datetime.date(2030, 1, 7), '20300108T010000Z')):
+            self.event_occurrence.date = date
+            self.assertIn(
+                'DTSTART:{0}'.format(start),
+                format_event_occurrence(self.event_occurrence, 'testserver'))
+
+    def test_calendar_uses_same_queries_with_virtual_occurrences(self):
+        with self.assertNumQueries(4):
+            self.read(self.client.get(self.url))
+        self.start_event()
+        with self.assertNumQueries(6):
+            self.read(self.client.get(self.url))
+
+    def test_calendar_adds_dates_not_generated_yet(self):
+        self.start_event()
+        content = self.read(self.client.get(self.url))
+        far_date = self.event_occurrence.date + datetime.timedelta(weeks=20)
+        self.assertIn('UID:event-{0}-{1}@testserver'.format(
+            self.event.pk, far_date.strftime('%Y%m%d')), content)
+        self.assertEqual(
+            content.count('UID:event-{0}-{1}@testserver'.format(
+                self.event.pk,
+                self.event_occurrence.date.strftime('%Y%m%d'))), 1)
+        self.assertEqual(EventOccurrence.objects.count(), 2)
+
+    def test_calendar_leaves_out_exception_dates(self):
+        self.start_event()
+        far_date = self.event_occurrence.date + datetime.timedelta(weeks=20)
+        EventExceptionDate.objects.create(event=self.event, date=far_date)
+        content = self.read(self.client.get(self.url))
+        self.assertNotIn('UID:event-{0}-{1}@testserver'.format(
+            self.event.pk, far_date.strftime('%Y%m%d')), content)
+        self.assertIn('UID:event-{0}-{1}@testserver'.format(
+            self.event.pk, (far_date + datetime.timedelta(weeks=1)).strftime(
+                '%Y%m%d')), content)
+
+    def test_available_calendar_leaves_out_dates_not_generated_yet(self):
+        self.start_event()
+        url = get_calendar_url('available', self.host.pk)
+        self.assertNotIn('BEGIN:VEVENT', self.read(self.client.get(url)))
+
+    def test_calendar_not_modified_from_two_queries_if_etag_matches(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_calendar_etag_does_not_depend_on_the_cache(self):
+        etag = self.client.get(self.url)['ETag']
+        cache.clear()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_calendar_etag_changes_when_data_changes_without_signals(self):
+        # As when another process writes: no version in this cache moves.
+        etag = self.client.get(self.url)['ETag']
+        EventOccurrence.objects.filter(pk=self.event_occurrence.pk).update(
+            status='No Game', cancellation_reason='Holiday',
+            modified=timezone.now() + datetime.timedelta(seconds=1))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('STATUS:CANCELLED', self.read(response))
+
+    def test_calendar_etag_changes_when_event_occurrence_saved(self):
+        etag = self.client.get(self.url)['ETag']
+        self.event_occurrence.status = 'No Game'
+        self.event_occurrence.cancellation_reason = 'Holiday'
+        self.event_occurrence.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('STATUS:CANCELLED', self.read(response))
+
+    def test_calendar_invalid_token_not_found(self):
+        url = reverse('event-occurrence-calendar', args=['host-1:forged'])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_venue_calendar_excludes_private_events(self):
+        self.event.is_private = True
+        self.event.save()
+        response = self.client.get(get_calendar_url('venue', self.venue.pk))
+        self.assertNotIn('BEGIN:VEVENT', self.read(response))
+
+    def test_available_calendar_lists_only_occurrences_needing_a_host(self):
+        url = get_calendar_url('available', self.host.pk)
+        self.assertNotIn('BEGIN:VEVENT', self.read(self.client.get(url)))
+        self.event_occurrence.change_host = True
+        self.event_occurrence.save()
+        self.assertIn('(needs a host)', self.read(self.client.get(url)))
+
+    def test_host_event_list_links_to_calendar(self):
+        self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.get(reverse(
+            'event-occurrence-list-future-host', kwargs={'username': 'carol'}))
+        self.assertContains(response, self.url)
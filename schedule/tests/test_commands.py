@@ -0,0 +1,106 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from locations.models import Venue
+from schedule.management.commands.explain_schedule_queries import (
+    benchmark_queries, get_benchmark_queries, seed_schedule)
+from schedule.models import Day, Time, Event, EventOccurrence
+
+class RollScheduleCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        venue = Venue.objects.create(name='The Meatballery')
+        day = Day.objects.create(day=yesterday.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        week = datetime.timedelta(weeks=1)
+        dates = [
+            (yesterday + week, None),
+            (yesterday, None),
+            (yesterday - 4 * week, yesterday + week),
+            (yesterday - 4 * week, yesterday - week),
+        ]
+        for start_date, end_date in dates:
+            event = Event(
+                venue=venue, day=day, time=time,
+                start_date=start_date, end_date=end_date)
+            event.full_clean()
+            event.save()
+
+    def test_roll_schedule_generates_for_starting_active_and_ending_events(self):
+        out = StringIO()
+        call_command('roll_schedule', workers=1, stdout=out)
+        self.assertEqual(EventOccurrence.objects.count(), 17)
+        self.assertFalse(
+            EventOccurrence.objects.filter(event__status='T').exists())
+        self.assertIn('Rolled 3 events: generated 17, deleted 0', out.getvalue())
+
+    def test_roll_schedule_reports_each_chunk(self):
+        out = StringIO()
+        call_command('roll_schedule', workers=1, chunk_size=2, stdout=out)
+        self.assertIn('Chunk 1/2: generated 16, deleted 0', out.getvalue())
+        self.assertIn('Chunk 2/2: generated 1, deleted 0', out.getvalue())
+
+    def test_roll_schedule_deletes_occurrences_past_end_date(self):
+        call_command('roll_schedule', workers=1, stdout=StringIO())
+        event = Event.objects.filter(status='A').first()
+        event.end_date = event.start_date + datetime.timedelta(weeks=4)
+        event.save()
+        out = StringIO()
+        call_command('roll_schedule', workers=1, stdout=out)
+        self.assertIn('generated 0, deleted 4', out.getvalue())
+
+    def test_roll_schedule_skips_up_to_date_events_unless_forced(self):
+        call_command('roll_schedule', workers=1, stdout=StringIO())
+        EventOccurrence.objects.all().delete()
+        call_command('roll_schedule', workers=1, stdout=StringIO())
+        self.assertEqual(EventOccurrence.objects.count(), 0)
+        call_command('roll_schedule', workers=1, force=True, stdout=StringIO())
+        self.assertEqual(EventOccurrence.objects.count(), 17)
+
+    def test_roll_schedule_updates_event_statuses_first(self):
+        Event.objects.update(status='')
+        out = StringIO()
+        call_command('roll_schedule', workers=1, stdout=out)
+        self.assertIn('Updated the status of 4 events.', out.getvalue())
+        self.assertIn('Rolled 3 events: generated 17', out.getvalue())
+
+class UpdateEventStatusesCommandTest(TestCase):
+
+    def test_update_event_statuses_reports_transitions(self):
+        venue = Venue.objects.create(name='The Meatballery')
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        Event.objects.create(venue=venue, start_date=tomorrow, status='T')
+        out = StringIO()
+        call_command('update_event_statuses', stdout=out)
+        self.assertIn('Event 1 (The Meatballery): T -> S', out.getvalue())
+        self.assertIn('Updated the status of 1 events.', out.getvalue())
+
+class ExplainScheduleQueriesTest(TransactionTestCase):
+
+    def test_benchmark_reports_plans_before_and_after_indexes(self):
+        occurrences, payments = seed_schedule(years=1, events=3, hosts=2)
+        self.assertEqual(EventOccurrence.objects.count(), occurrences)
+        results = dict(benchmark_queries(repeat=1))
+        self.assertEqual(
+            list(results), [name for name, queryset in get_benchmark_queries()])
+        for result in results.values():
+            self.assertEqual(set(result), {'before', 'after'})
+        if connection.vendor == 'sqlite':
+            self.assertNotIn(
+                'event_occurrence_date_idx', results['upcoming']['before'][0])
+            self.assertIn(
+                'event_occurrence_date_idx', results['upcoming']['after'][0])
+
+    def test_benchmark_leaves_indexes_in_place(self):
+        seed_schedule(years=1, events=1, hosts=1)
+        benchmark_queries(repeat=1)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, EventOccurrence._meta.db_table)
+        for index in EventOccurrence._meta.indexes:
+            self.assertIn(index.name, constraints)
@@ -0,0 +1,164 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from locations.models import City, State, Venue
+from schedule import facets
+from schedule.facets import get_facet_index, update_facet_index
+from schedule.filters import EventOccurrenceFilter
+from schedule.models import Day, Time, Event, EventOccurrence
+
+
+# Counts change when the write commits, which TestCase never does.
+class FacetIndexTest(TransactionTestCase):
+    def setUp(self):
+        state = State.objects.create(name='NY')
+        self.city = City.objects.create(name='New York')
+        self.venue = Venue.objects.create(
+            name='The Meatballery', state=state, city=self.city)
+        Day.objects.create(day=0)
+        Day.objects.create(day=1)
+        self.event = Event.objects.create(venue=self.venue, day_id=0)
+        cache.clear()
+        self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+
+    def test_get_facet_index_counts_upcoming_occurrences_only(self):
+        event = self.event
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        EventOccurrence.objects.create(event=event, day_id=0, date=self.tomorrow)
+        other_event = Event.objects.create(venue=event.venue, day_id=1)
+        EventOccurrence.objects.create(
+            event=other_event, day_id=1, date=self.tomorrow)
+        EventOccurrence.objects.create(event=event, day_id=0, date=yesterday)
+        counts = get_facet_index()
+        self.assertEqual(counts['event__venue__state'], {'NY': 2})
+        self.assertEqual(counts['event__venue__city'], {self.city.pk: 2})
+        self.assertEqual(counts['day'], {0: 1, 1: 1})
+
+    def test_get_facet_index_uses_cache(self):
+        get_facet_index()
+        with self.assertNumQueries(0):
+            get_facet_index()
+
+    def test_get_facet_index_rebuilds_on_new_day(self):
+        event = self.event
+        EventOccurrence.objects.create(event=event, day_id=0, date=self.tomorrow)
+        get_facet_index()
+        counts = get_facet_index(self.tomorrow + datetime.timedelta(days=1))
+        self.assertEqual(counts['day'], {})
+
+    def test_saving_event_occurrence_updates_counts_incrementally(self):
+        event = self.event
+        get_facet_index()
+        occurrence = EventOccurrence.objects.create(
+            event=event, day_id=0, date=self.tomorrow)
+        self.assertEqual(get_facet_index()['day'], {0: 1})
+        occurrence = EventOccurrence.objects.get(pk=occurrence.pk)
+        occurrence.day_id = 1
+        occurrence.save()
+        with self.assertNumQueries(0):
+            counts = get_facet_index()
+        self.assertEqual(counts['day'], {1: 1})
+        self.assertEqual(counts['event__venue__state'], {'NY': 1})
+        occurrence.delete()
+        self.assertEqual(get_facet_index()['event__venue__state'], {})
+
+    def test_interleaved_updates_do_not_lose_counts(self):
+        event = self.event
+        other_event = Event.objects.create(venue=event.venue, day_id=1)
+        get_facet_index()
+        get_facet_version = facets.get_facet_version
+        interleaved = []
+
+        # The second save lands while the first one holds the index.
+        def save_during_update(*args):
+            if not interleaved:
+                interleaved.append(EventOccurrence.objects.create(
+                    event=other_event, day_id=1, date=self.tomorrow))
+            return get_facet_version(*args)
+
+        with mock.patch.object(
+                facets, 'get_facet_version', side_effect=save_during_update):
+            EventOccurrence.objects.create(
+                event=event, day_id=0, date=self.tomorrow)
+        self.assertEqual(len(interleaved), 1)
+        counts = get_facet_index()
+        self.assertEqual(counts['day'], {0: 1, 1: 1})
+        self.assertEqual(counts['event__venue__state'], {'NY': 2})
+
+    def test_update_facet_index_rereads_index_under_lock(self):
+        event = self.event
+        get_facet_index()
+        add = facets.cache.add
+        updated = []
+
+        # Another process adds a count between the first read and the lock.
+        def add_after_other_update(key, *args):
+            if key == facets.FACET_INDEX_LOCK_KEY and not updated:
+                updated.append(True)
+                facet_index = facets.cache.get(facets.FACET_INDEX_KEY)
+                facet_index['combinations'][('NY', self.city.pk, 1)] = 1
+                facets.cache.set(facets.FACET_INDEX_KEY, facet_index)
+            return add(key, *args)
+
+        with mock.patch.object(
+                facets.cache, 'add', side_effect=add_after_other_update):
+            update_facet_index([(event.pk, 0, self.tomorrow, 1)])
+        self.assertTrue(updated)
+        with self.assertNumQueries(0):
+            counts = get_facet_index()
+        self.assertEqual(counts['day'], {0: 1, 1: 1})
+
+    def test_rolled_back_save_leaves_counts_alone(self):
+        event = self.event
+        get_facet_index()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                EventOccurrence.objects.create(
+                    event=event, day_id=0, date=self.tomorrow)
+                raise ValueError
+        with self.assertNumQueries(0):
+            counts = get_facet_index()
+        self.assertEqual(counts['day'], {})
+
+    def test_saving_venue_invalidates_index(self):
+        event = self.event
+        EventOccurrence.objects.create(event=event, day_id=0, date=self.tomorrow)
+        get_facet_index()
+        venue = self.venue
+        venue.state = State.objects.create(name='NJ')
+        venue.save()
+        self.assertEqual(get_facet_index()['event__venue__state'], {'NJ': 1})
+
+    def test_generating_event_occurrences_adds_counts(self):
+        tomorrow = self.tomorrow
+        day = Day.objects.get_or_create(day=tomorrow.weekday())[0]
+        time = Time.objects.create(time=datetime.time(20,0))
+        event = self.event
+        event.day = day
+        event.time = time
+        event.start_date = tomorrow
+        event.save()
+        get_facet_index()
+        event.generate_event_occurrences(weeks=2)
+        with self.assertNumQueries(0):
+            counts = get_facet_index()
+        self.assertEqual(counts['day'], {tomorrow.weekday(): 2})
+
+    def test_event_occurrence_filter_narrows_choices_without_scanning_occurrences(self):
+        event = self.event
+        other_event = Event.objects.create(venue=event.venue, day_id=1)
+        EventOccurrence.objects.create(
+            event=other_event, day_id=1, date=self.tomorrow)
+        State.objects.create(name='NJ')
+        get_facet_index()
+        with self.assertNumQueries(0):
+            filter = EventOccurrenceFilter(
+                {}, queryset=EventOccurrence.objects.all())
+        states = filter.filters['event__venue__state'].field.queryset
+        days = filter.filters['day'].field.queryset
+        self.assertEqual([state.name for state in states], ['NY'])
+        self.assertEqual([day.day for day in days], [1])
@@ -2,16 +2,26 @@ import calendar
 import datetime
 import os
 import shutil
+import threading
+from unittest import mock
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from accounts.models import CustomUser
 from locations.models import Venue
-from schedule.models import Day, Time, Event, EventImage, EventOccurrence, find_closest_date
+from schedule.facets import get_facet_index
+from schedule.models import (
+    Day, Time, Event, EventExceptionDate, EventImage, EventOccurrence,
+    annotate_event_occurrence_list, bulk_generate_event_occurrences,
+    expand_events, find_closest_date, pick_up_event_occurrence,
+    update_event_statuses)
 
 from PIL import Image
 from io import BytesIO
@@ -572,6 +582,270 @@ class EventModelTest(TestCase):
         self.assertTrue(five_weeks_out in original_dates)
         self.assertFalse(five_weeks_out in new_dates)
 
+    def test_generate_event_occurrences_does_not_duplicate_occurrence_with_different_host(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        event.refresh_from_db()
+        event.generate_event_occurrences(weeks=2)
+        cover = CustomUser.objects.create_user(
+            username='cover', password='Ilovemeatballs')
+        EventOccurrence.objects.filter(
+            date=yesterday + datetime.timedelta(weeks=1)).update(host=cover)
+        generated = event.generate_event_occurrences(weeks=2, force=True)
+        self.assertEqual(generated, 0)
+        self.assertEqual(EventOccurrence.objects.count(), 2)
+
+    def test_bulk_generate_event_occurrences_returns_generated_and_deleted(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (8, 0))
+        event.end_date = yesterday + datetime.timedelta(weeks=4)
+        event.save()
+        generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (0, 4))
+
+    def test_bulk_generate_event_occurrences_keeps_trimmed_dates_someone_acted_on(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        bulk_generate_event_occurrences([event])
+        cover = CustomUser.objects.create_user(
+            username='cover', password='Ilovemeatballs')
+        acted_on = [
+            {'host': cover}, {'change_host': True}, {'notes': 'Call venue'}]
+        for weeks, values in enumerate(acted_on, start=5):
+            EventOccurrence.objects.filter(
+                date=yesterday + datetime.timedelta(weeks=weeks)).update(
+                **values)
+        event.end_date = yesterday + datetime.timedelta(weeks=4)
+        event.save()
+        with self.assertLogs('schedule.models', 'WARNING') as logs:
+            generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (0, 1))
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(
+            sorted(EventOccurrence.objects.filter(
+                date__gt=event.end_date).values_list('date', flat=True)),
+            [yesterday + datetime.timedelta(weeks=weeks)
+             for weeks in (5, 6, 7)])
+
+    def test_bulk_generate_event_occurrences_uses_same_queries_for_many_events(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        time = Time.objects.get(time=datetime.time(20,0))
+        venue = Venue.objects.get(pk=1)
+        events = [
+            Event.objects.create(
+                venue=venue, day=day, time=time, start_date=yesterday)
+            for i in range(30)]
+        fields = [
+            field for field in EventOccurrence._meta.concrete_fields
+            if not field.primary_key]
+        query_counts = []
+        for batch, rows in ((events[:10], 80), (events[10:], 160)):
+            with CaptureQueriesContext(connection) as queries:
+                generated, deleted = bulk_generate_event_occurrences(batch)
+            self.assertEqual(generated, rows)
+            # SQLite caps the bound parameters per statement, so the backend
+            # may split the INSERT; everything else must stay the same.
+            inserts = [
+                query for query in queries.captured_queries
+                if query['sql'].startswith('INSERT')]
+            batch_size = connection.ops.bulk_batch_size(
+                fields, [None] * rows)
+            self.assertEqual(len(inserts), -(-rows // batch_size))
+            query_counts.append(len(queries) - len(inserts))
+        self.assertEqual(query_counts, [6, 6])
+        self.assertEqual(EventOccurrence.objects.count(), 240)
+
+    def test_generate_event_occurrences_records_generated_through_and_fingerprint(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        event.generate_event_occurrences()
+        event.refresh_from_db()
+        self.assertEqual(
+            event.generated_through, yesterday + datetime.timedelta(weeks=8))
+        self.assertEqual(
+            event.generation_fingerprint, event.get_generation_fingerprint())
+
+    def test_bulk_generate_event_occurrences_skips_unchanged_events_without_queries(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        bulk_generate_event_occurrences([event])
+        event.refresh_from_db()
+        with self.assertNumQueries(0):
+            generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (0, 0))
+
+    def test_bulk_generate_event_occurrences_regenerates_when_fingerprint_changes(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        bulk_generate_event_occurrences([event])
+        event.refresh_from_db()
+        event.end_date = yesterday + datetime.timedelta(weeks=4)
+        event.save()
+        generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (0, 4))
+
+    def test_bulk_generate_event_occurrences_skips_dates_taken_by_moved_occurrence(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        EventOccurrence.objects.create(
+            event=event, day=event.day, date=yesterday + datetime.timedelta(weeks=1),
+            time=Time.objects.create(time=datetime.time(18,0)))
+        generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (7, 0))
+        self.assertEqual(EventOccurrence.objects.count(), 8)
+
+    def test_bulk_generate_event_occurrences_regenerates_when_horizon_runs_out(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        bulk_generate_event_occurrences([event])
+        event.refresh_from_db()
+        event.generated_through -= datetime.timedelta(weeks=1)
+        self.assertTrue(event.needs_generation())
+        generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (0, 0))
+        self.assertFalse(event.needs_generation())
+
+    def test_generate_event_occurrences_biweekly_generates_every_other_week(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.recurrence = 'B'
+        event.save()
+        generated = event.generate_event_occurrences()
+        occurrence_dates = [occ.date for occ in EventOccurrence.objects.all()]
+        self.assertEqual(generated, 4)
+        self.assertTrue(yesterday + datetime.timedelta(weeks=2) in occurrence_dates)
+        self.assertFalse(yesterday + datetime.timedelta(weeks=1) in occurrence_dates)
+
+    def test_generate_event_occurrences_skips_and_removes_exception_dates(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = Event.objects.get(pk=1)
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        event.generate_event_occurrences()
+        holiday = yesterday + datetime.timedelta(weeks=3)
+        EventExceptionDate.objects.create(event=event, date=holiday)
+        event.refresh_from_db()
+        generated = event.generate_event_occurrences()
+        occurrence_dates = [occ.date for occ in EventOccurrence.objects.all()]
+        self.assertEqual(len(occurrence_dates), 7)
+        self.assertFalse(holiday in occurrence_dates)
+
+    def test_event_clean_monthly_without_week_of_month_validation_error(self):
+        event = Event.objects.get(pk=1)
+        event.recurrence = 'M'
+        with self.assertRaises(ValidationError) as cm:
+            event.full_clean()
+        self.assertEqual(
+            cm.exception.message_dict['week_of_month'],
+            ['Please specify the week of the month.'])
+
+    def test_event_clean_season_needs_start_and_end(self):
+        event = Event.objects.get(pk=1)
+        event.season_start = 11
+        with self.assertRaises(ValidationError) as cm:
+            event.full_clean()
+        self.assertEqual(
+            cm.exception.messages,
+            ['Please specify both the first and last month of the season.'])
+
+    def test_expand_events_returns_dates_per_event(self):
+        event = Event.objects.get(pk=1)
+        event.start_date = datetime.date(2019, 8, 20)
+        EventExceptionDate.objects.create(
+            event=event, date=datetime.date(2019, 8, 27))
+        dates = expand_events(
+            [event], datetime.date(2019, 8, 1), datetime.date(2019, 9, 10))
+        self.assertEqual(dates, {event.pk: [
+            datetime.date(2019, 8, 20),
+            datetime.date(2019, 9, 3),
+            datetime.date(2019, 9, 10)]})
+
+    def test_update_event_statuses_recalculates_status_in_bulk(self):
+        today = datetime.date.today()
+        venue = Venue.objects.get(pk=1)
+        dates = {
+            'S': (today + datetime.timedelta(days=1), None),
+            'A': (today - datetime.timedelta(days=1), None),
+            'E': (None, today + datetime.timedelta(days=13)),
+            'T': (None, today - datetime.timedelta(days=1)),
+        }
+        events = {}
+        for status, (start_date, end_date) in dates.items():
+            events[status] = Event.objects.create(
+                venue=venue, start_date=start_date, end_date=end_date)
+        with self.assertNumQueries(5):
+            transitions = update_event_statuses()
+        self.assertEqual(len(transitions), 4)
+        for status, event in events.items():
+            event.refresh_from_db()
+            self.assertEqual(event.status, status)
+
+    def test_update_event_statuses_keeps_status_without_dates(self):
+        event = Event.objects.get(pk=1)
+        event.status = 'A'
+        event.save()
+        transitions = update_event_statuses()
+        event.refresh_from_db()
+        self.assertEqual(transitions, [])
+        self.assertEqual(event.status, 'A')
+
+    def test_update_event_statuses_restarts_rescheduled_event(self):
+        today = datetime.date.today()
+        event = Event.objects.get(pk=1)
+        event.start_date = today + datetime.timedelta(weeks=2)
+        event.end_date = today - datetime.timedelta(weeks=2)
+        event.request_future_restart = True
+        event.status = 'T'
+        event.save()
+        update_event_statuses()
+        event.refresh_from_db()
+        self.assertIsNone(event.end_date)
+        self.assertFalse(event.request_future_restart)
+        self.assertEqual(event.status, 'S')
+
+    def test_update_event_statuses_leaves_terminated_event_waiting_for_restart(self):
+        today = datetime.date.today()
+        event = Event.objects.get(pk=1)
+        event.start_date = today - datetime.timedelta(weeks=4)
+        event.end_date = today - datetime.timedelta(weeks=2)
+        event.request_future_restart = True
+        event.save()
+        with self.assertLogs('schedule.models', level='WARNING'):
+            update_event_statuses()
+        event.refresh_from_db()
+        self.assertTrue(event.request_future_restart)
+        self.assertEqual(event.status, 'T')
+
     def test_find_closest_date_with_day_past(self):
         test_date = datetime.date(2019, 8, 22) # Thur
         test_day_int = 0 # Mon
@@ -593,6 +867,78 @@ class EventModelTest(TestCase):
         target_date = datetime.date(2019, 8, 29)
         self.assertEqual(date, target_date)
 
+# Facet counts are updated when the write commits, which TestCase never does.
+class BulkGenerateFacetTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = Event.objects.create(
+            venue=Venue.objects.create(name='The Meatballery'),
+            time=Time.objects.create(time=datetime.time(20,0)))
+
+    def test_bulk_generate_event_occurrences_does_not_count_rows_inserted_concurrently(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        event = self.event
+        event.day, created = Day.objects.get_or_create(day=yesterday.weekday())
+        event.start_date = yesterday
+        event.save()
+        get_facet_index()
+        bulk_create = EventOccurrence.objects.bulk_create
+
+        # Another run writes one of the dates between the read and the insert.
+        def bulk_create_after_other_run(objs, **kwargs):
+            EventOccurrence.objects.create(
+                event=event, day=event.day, time=event.time,
+                date=objs[0].date)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(
+                EventOccurrence.objects, 'bulk_create',
+                side_effect=bulk_create_after_other_run):
+            generated, deleted = bulk_generate_event_occurrences([event])
+        self.assertEqual((generated, deleted), (7, 0))
+        self.assertEqual(EventOccurrence.objects.count(), 8)
+        self.assertEqual(get_facet_index()['day'], {event.day_id: 8})
+
+class EventExceptionDateModelTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        venue = Venue.objects.create(name='The Meatballery')
+        event = Event.objects.create(
+            venue=venue, generated_through=datetime.date(2019, 8, 27))
+        EventExceptionDate.objects.create(
+            event=event, date=datetime.date(2019, 8, 20))
+
+    def test_event_delete_cascade(self):
+        Event.objects.get(pk=1).delete()
+        self.assertEqual(EventExceptionDate.objects.count(), 0)
+
+    def test_event_related_name_is_exception_dates(self):
+        event = Event.objects.get(pk=1)
+        self.assertEqual(event.exception_dates.count(), 1)
+
+    def test_string_representation(self):
+        exception_date = EventExceptionDate.objects.get(pk=1)
+        self.assertEqual(
+            str(exception_date),
+            '{0} - {1}'.format(exception_date.event, exception_date.date))
+
+    def test_save_resets_event_generated_through(self):
+        event = Event.objects.get(pk=1)
+        event.generated_through = datetime.date(2019, 8, 27)
+        event.save()
+        EventExceptionDate.objects.create(
+            event=event, date=datetime.date(2019, 8, 27))
+        event.refresh_from_db()
+        self.assertIsNone(event.generated_through)
+
+    def test_delete_resets_event_generated_through(self):
+        event = Event.objects.get(pk=1)
+        event.generated_through = datetime.date(2019, 8, 27)
+        event.save()
+        EventExceptionDate.objects.get(pk=1).delete()
+        event.refresh_from_db()
+        self.assertIsNone(event.generated_through)
+
 @override_settings(MEDIA_ROOT='temp_event_image_files')
 class EventImageModelTest(TestCase):
     @classmethod
@@ -703,6 +1049,34 @@ class EventOccurrenceModelTest(TestCase):
         shutil.rmtree('temp_event_occurrence_files')
         super().tearDownClass()
 
+    def test_event_and_date_are_unique_together(self):
+        event_occurrence = EventOccurrence.objects.get(pk=1)
+        with self.assertRaises(IntegrityError):
+            EventOccurrence.objects.create(
+                event=event_occurrence.event, date=event_occurrence.date)
+
+    def test_loaded_event_occurrence_tracks_dirty_fields(self):
+        event_occurrence = EventOccurrence.objects.get(pk=1)
+        self.assertEqual(event_occurrence.get_dirty_fields(), [])
+        event_occurrence.change_host = True
+        event_occurrence.date = datetime.date(2019, 5, 21)
+        self.assertEqual(
+            event_occurrence.get_dirty_fields(), ['date', 'change_host'])
+        self.assertEqual(
+            event_occurrence.get_loaded_facet_key(),
+            (1, 1, datetime.date(2019, 5, 14)))
+        event_occurrence.save()
+        self.assertEqual(event_occurrence.get_dirty_fields(), [])
+        self.assertEqual(
+            event_occurrence.get_loaded_facet_key(),
+            (1, 1, datetime.date(2019, 5, 21)))
+
+    def test_event_occurrence_built_by_hand_has_no_loaded_values(self):
+        event_occurrence = EventOccurrence(
+            pk=1, event_id=1, day_id=1, date=datetime.date(2019, 5, 14))
+        self.assertIsNone(event_occurrence.get_dirty_fields())
+        self.assertIsNone(event_occurrence.get_loaded_facet_key())
+
     def test_event_label(self):
         event_occurrence = EventOccurrence.objects.get(pk=1)
         field_label = event_occurrence._meta.get_field('event').verbose_name
@@ -1054,6 +1428,44 @@ class EventOccurrenceModelTest(TestCase):
         event_occurrence.status = 'Game'
         self.assertFalse(event_occurrence.is_late)
 
+    def test_annotate_event_occurrence_list_flags_match_properties(self):
+        event = Event.objects.get(pk=1)
+        now = datetime.datetime.now()
+        other_day = Day.objects.create(day=2)
+        other_time = Time.objects.create(time=datetime.time(19,0))
+        EventOccurrence.objects.create(
+            event=event, day=event.day, time=event.time,
+            date=now.date() + datetime.timedelta(days=1))
+        EventOccurrence.objects.create(
+            event=event, day=other_day, time=other_time,
+            date=now.date() - datetime.timedelta(days=3),
+            status='No Game', cancellation_reason='Holiday', host=event.host)
+        EventOccurrence.objects.create(
+            event=event, day=event.day, time=event.time,
+            date=now.date() - datetime.timedelta(days=4),
+            time_started=datetime.time(20,15), time_ended=datetime.time(22,15),
+            number_of_teams=0, host=event.host)
+        paid = EventOccurrence.objects.create(
+            event=event, day=event.day, time=event.time,
+            date=now.date() - datetime.timedelta(days=5),
+            time_started=datetime.time(20,15), time_ended=datetime.time(22,15),
+            number_of_teams=5, host=event.host)
+        paid.event_occurrence_payments.update(paid=True)
+        flags = [
+            'is_complete', 'has_passed', 'is_late', 'is_different_day',
+            'is_different_time', 'is_paid', 'can_be_edited']
+        annotated = annotate_event_occurrence_list(
+            EventOccurrence.objects.all(), now)
+        with self.assertNumQueries(1):
+            annotated_flags = [
+                [getattr(occurrence, flag) for flag in flags]
+                for occurrence in annotated]
+        expected_flags = [
+            [getattr(occurrence, flag) for flag in flags]
+            for occurrence in EventOccurrence.objects.all()]
+        self.assertEqual(annotated_flags, expected_flags)
+        self.assertIn(True, [row[5] for row in annotated_flags])
+
     def test_display_game_length_no_value(self):
         event_occurrence = EventOccurrence.objects.get(pk=1)
         event_occurrence.status = 'Game'
@@ -1107,4 +1519,58 @@ class EventOccurrenceModelTest(TestCase):
         self.assertEqual(
             exception.messages,
             ['You have a cancellation reason when there '
-            'was a game. Please correct.'])
\ No newline at end of file
+            'was a game. Please correct.'])
+class PickUpEventOccurrenceTest(TransactionTestCase):
+    def setUp(self):
+        venue = Venue.objects.create(name='The Meatballery')
+        time = Time.objects.create(time=datetime.time(20,0))
+        self.event_occurrence = EventOccurrence.objects.create(
+            event=Event.objects.create(venue=venue), time=time,
+            date=datetime.date.today() + datetime.timedelta(days=1),
+            change_host=True)
+        self.hosts = [
+            CustomUser.objects.create_user(username='host{0}'.format(number))
+            for number in range(8)]
+
+    def test_pick_up_event_occurrence_in_past_fails(self):
+        self.assertFalse(pick_up_event_occurrence(
+            self.event_occurrence.pk, self.hosts[0],
+            now=datetime.datetime.now() + datetime.timedelta(days=2)))
+
+    def test_pick_up_event_occurrence_succeeds_once_under_concurrent_requests(self):
+        barrier = threading.Barrier(len(self.hosts))
+        results = {}
+        locked = []
+
+        def pick_up(host):
+            try:
+                barrier.wait()
+                for attempt in range(10):
+                    try:
+                        results[host.pk] = pick_up_event_occurrence(
+                            self.event_occurrence.pk, host)
+                        break
+                    except OperationalError:
+                        # The shared in-memory SQLite test database reports
+                        # a locked table rather than waiting for it.
+                        threading.Event().wait(0.05)
+                else:
+                    locked.append(host.pk)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=pick_up, args=[host])
+            for host in self.hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(
+            locked, 'Pick-ups still found the table locked after 10 attempts.')
+        winners = [pk for pk, picked_up in results.items() if picked_up]
+        self.assertEqual(len(results), len(self.hosts))
+        self.assertEqual(len(winners), 1)
+        self.event_occurrence.refresh_from_db()
+        self.assertFalse(self.event_occurrence.change_host)
+        self.assertEqual(self.event_occurrence.host_id, winners[0])
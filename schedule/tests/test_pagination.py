@@ -0,0 +1,26 @@
+import datetime
+
+from django.test import SimpleTestCase
+
+from schedule.models import EventOccurrence
+from schedule.pagination import decode_cursor, encode_cursor, get_keyset
+
+
+class CursorTest(SimpleTestCase):
+
+    def test_encode_cursor_round_trips_through_decode_cursor(self):
+        keyset = (datetime.date(2019, 5, 14), datetime.time(20, 0), 15, 0)
+        self.assertEqual(decode_cursor(encode_cursor(keyset)), keyset)
+
+    def test_decode_cursor_invalid_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('2019-05-14_2000')
+
+    def test_get_keyset_sorts_virtual_occurrence_before_saved_one_at_same_time(self):
+        date = datetime.date(2019, 5, 14)
+        saved = EventOccurrence(pk=3, date=date, time_id=datetime.time(20, 0))
+        virtual = EventOccurrence(
+            date=date, time_id=datetime.time(20, 0), event_id=7)
+        self.assertLess(get_keyset(virtual), get_keyset(saved))
+        self.assertEqual(
+            get_keyset(virtual), (date, datetime.time(20, 0), 0, 7))
@@ -0,0 +1,84 @@
+import datetime
+
+from django.test import SimpleTestCase
+
+from schedule.recurrence import BIWEEKLY, MONTHLY, WEEKLY, Recurrence
+
+class RecurrenceTest(SimpleTestCase):
+
+    def test_weekly_between_returns_every_weekday_in_range(self):
+        recurrence = Recurrence(3) # Thur
+        dates = recurrence.between(
+            datetime.date(2019, 8, 20), datetime.date(2019, 9, 5))
+        self.assertEqual(dates, [
+            datetime.date(2019, 8, 22),
+            datetime.date(2019, 8, 29),
+            datetime.date(2019, 9, 5)])
+
+    def test_between_respects_start_and_end_dates(self):
+        recurrence = Recurrence(
+            3, start_date=datetime.date(2019, 8, 29),
+            end_date=datetime.date(2019, 9, 12))
+        dates = recurrence.between(
+            datetime.date(2019, 8, 1), datetime.date(2019, 12, 31))
+        self.assertEqual(dates, [
+            datetime.date(2019, 8, 29),
+            datetime.date(2019, 9, 5),
+            datetime.date(2019, 9, 12)])
+
+    def test_between_with_start_after_end_returns_no_dates(self):
+        recurrence = Recurrence(3, end_date=datetime.date(2019, 8, 1))
+        dates = recurrence.between(
+            datetime.date(2019, 8, 20), datetime.date(2019, 9, 5))
+        self.assertEqual(dates, [])
+
+    def test_biweekly_counts_from_start_date(self):
+        recurrence = Recurrence(
+            3, frequency=BIWEEKLY, start_date=datetime.date(2019, 8, 22))
+        dates = recurrence.between(
+            datetime.date(2019, 8, 27), datetime.date(2019, 9, 30))
+        self.assertEqual(dates, [
+            datetime.date(2019, 9, 5),
+            datetime.date(2019, 9, 19)])
+
+    def test_monthly_nth_weekday(self):
+        recurrence = Recurrence(1, frequency=MONTHLY, week_of_month=2) # Tue
+        dates = recurrence.between(
+            datetime.date(2019, 8, 1), datetime.date(2019, 10, 31))
+        self.assertEqual(dates, [
+            datetime.date(2019, 8, 13),
+            datetime.date(2019, 9, 10),
+            datetime.date(2019, 10, 8)])
+
+    def test_monthly_last_weekday(self):
+        recurrence = Recurrence(4, frequency=MONTHLY, week_of_month=-1) # Fri
+        dates = recurrence.between(
+            datetime.date(2019, 8, 1), datetime.date(2019, 10, 31))
+        self.assertEqual(dates, [
+            datetime.date(2019, 8, 30),
+            datetime.date(2019, 9, 27),
+            datetime.date(2019, 10, 25)])
+
+    def test_season_wrapping_the_new_year(self):
+        recurrence = Recurrence(0, season_start=12, season_end=1) # Mon
+        dates = recurrence.between(
+            datetime.date(2019, 11, 20), datetime.date(2020, 2, 10))
+        months = set(date.month for date in dates)
+        self.assertEqual(months, {12, 1})
+        self.assertEqual(len(dates), 9)
+
+    def test_exception_dates_are_skipped(self):
+        recurrence = Recurrence(
+            3, exception_dates=[datetime.date(2019, 8, 29)])
+        dates = recurrence.between(
+            datetime.date(2019, 8, 20), datetime.date(2019, 9, 5))
+        self.assertEqual(dates, [
+            datetime.date(2019, 8, 22),
+            datetime.date(2019, 9, 5)])
+
+    def test_between_returns_dates(self):
+        recurrence = Recurrence(3, frequency=WEEKLY)
+        dates = recurrence.between(
+            datetime.date(2019, 1, 1), datetime.date(2029, 12, 31))
+        self.assertEqual(len(dates), 574)
+        self.assertIsInstance(dates[0], datetime.date)
@@ -0,0 +1,186 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from accounts.models import CustomUser
+from locations.models import Venue
+from schedule.models import Day, Time, Event, EventOccurrence, ShiftChange
+from schedule.models import pick_up_event_occurrence
+from schedule.shifts import (
+    SHIFT_BACKLOG, SHIFT_RELEASED, SHIFT_STREAM_RETRY, SHIFT_TAKEN, get_shift_changes,
+    publish_shift_change, stream_shift_changes)
+
+
+class ShiftFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        venue = Venue.objects.create(name='The Meatballery')
+        day = Day.objects.create(day=tomorrow.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        event = Event.objects.create(
+            venue=venue, host=host, day=day, time=time)
+        EventOccurrence.objects.create(
+            event=event, date=tomorrow, day=day, time=time, host=host)
+
+    def setUp(self):
+        cache.clear()
+        self.event_occurrence = EventOccurrence.objects.get()
+
+    def test_get_shift_changes_without_cursor_starts_at_latest(self):
+        publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        self.assertEqual(get_shift_changes(), (1, []))
+
+    def test_get_shift_changes_returns_messages_after_cursor(self):
+        publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        publish_shift_change(SHIFT_TAKEN, self.event_occurrence)
+        latest, messages = get_shift_changes(1)
+        self.assertEqual(latest, 2)
+        self.assertEqual([message['type'] for message in messages], [SHIFT_TAKEN])
+        self.assertEqual(messages[0]['venue'], 'The Meatballery')
+        self.assertEqual(
+            messages[0]['url'],
+            reverse('pick-up', args=[self.event_occurrence.pk]))
+
+    def test_shift_changes_do_not_depend_on_the_cache(self):
+        publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        cache.clear()
+        latest, messages = get_shift_changes(0)
+        self.assertEqual(
+            [message['type'] for message in messages], [SHIFT_RELEASED])
+
+    def test_get_shift_changes_moves_cursor_past_the_end_back(self):
+        publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        self.assertEqual(get_shift_changes(50), (1, []))
+
+    def test_publish_shift_change_keeps_only_the_backlog(self):
+        for i in range(SHIFT_BACKLOG + 5):
+            publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        self.assertEqual(ShiftChange.objects.count(), SHIFT_BACKLOG)
+        latest, messages = get_shift_changes(0)
+        self.assertEqual(messages[0]['id'], 6)
+
+    def test_stream_shift_changes_sends_changes_published_while_waiting(self):
+        clock = iter(range(100)).__next__
+        def sleep(seconds):
+            publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        stream = stream_shift_changes(
+            duration=10, heartbeat=100, sleep=sleep, clock=clock)
+        chunks = list(stream)
+        self.assertEqual(
+            chunks[0], 'retry: {0}\n\n'.format(SHIFT_STREAM_RETRY))
+        self.assertTrue(chunks[1].startswith('id: 1\nevent: shift-released\n'))
+
+    def test_stream_shift_changes_checks_once_and_ends_with_cursor_by_default(self):
+        publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        sleep = mock.Mock()
+        chunks = list(stream_shift_changes(after=0, sleep=sleep))
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(chunks[1].startswith('id: 1\nevent: shift-released\n'))
+        self.assertEqual(chunks[2], 'id: 1\n\n')
+        sleep.assert_not_called()
+
+    def test_stream_shift_changes_without_cursor_sends_latest_id(self):
+        publish_shift_change(SHIFT_RELEASED, self.event_occurrence)
+        chunks = list(stream_shift_changes())
+        self.assertEqual(chunks[1:], ['id: 1\n\n'])
+
+    def test_stream_shift_changes_sends_heartbeat_when_idle(self):
+        clock = iter(range(100)).__next__
+        stream = stream_shift_changes(
+            after=0, duration=4, heartbeat=1, sleep=lambda seconds: None,
+            clock=clock)
+        self.assertIn(': keep-alive\n\n', list(stream))
+
+
+class ShiftPublishTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        venue = Venue.objects.create(name='The Meatballery')
+        day = Day.objects.create(day=tomorrow.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        event = Event.objects.create(
+            venue=venue, host=host, day=day, time=time)
+        self.event_occurrence = EventOccurrence.objects.create(
+            event=event, date=tomorrow, day=day, time=time, host=host)
+
+    def test_requesting_off_and_picking_up_publish_shift_changes(self):
+        self.event_occurrence.change_host = True
+        self.event_occurrence.save()
+        self.event_occurrence.change_host = False
+        self.event_occurrence.save()
+        self.event_occurrence.notes = 'Bring pencils'
+        self.event_occurrence.save()
+        latest, messages = get_shift_changes(0)
+        self.assertEqual(
+            [message['type'] for message in messages],
+            [SHIFT_RELEASED, SHIFT_TAKEN])
+
+    def test_shift_changes_publish_only_after_commit(self):
+        with transaction.atomic():
+            self.event_occurrence.change_host = True
+            self.event_occurrence.save()
+            self.assertEqual(get_shift_changes(0), (0, []))
+        latest, messages = get_shift_changes(0)
+        self.assertEqual(
+            [message['type'] for message in messages], [SHIFT_RELEASED])
+
+    def test_rolled_back_shift_change_is_not_published(self):
+        try:
+            with transaction.atomic():
+                self.event_occurrence.change_host = True
+                self.event_occurrence.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(get_shift_changes(0), (0, []))
+
+    def test_picking_up_publishes_shift_taken_after_commit(self):
+        EventOccurrence.objects.filter(
+            pk=self.event_occurrence.pk).update(change_host=True)
+        cover = CustomUser.objects.create_user(
+            username='matt', password='Iloveanimals')
+        with transaction.atomic():
+            pick_up_event_occurrence(self.event_occurrence.pk, cover)
+            self.assertEqual(get_shift_changes(0), (0, []))
+        latest, messages = get_shift_changes(0)
+        self.assertEqual(
+            [message['type'] for message in messages], [SHIFT_TAKEN])
+
+
+class AvailableShiftStreamViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+
+    def test_available_shift_stream_redirects_to_login_if_not_logged_in(self):
+        url = reverse('available-shift-stream')
+        response = self.client.get(url)
+        self.assertRedirects(
+            response, '{0}?next={1}'.format(reverse('login'), url))
+
+    def test_available_shift_stream_is_an_event_stream(self):
+        self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.get(
+            reverse('available-shift-stream'), HTTP_LAST_EVENT_ID='0')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'retry: {0}\n\nid: 0\n\n'.format(SHIFT_STREAM_RETRY))
+
+    def test_available_list_links_to_shift_stream(self):
+        self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.get(reverse('event-occurrence-list-available'))
+        self.assertEqual(
+            response.context['shift_stream_url'],
+            reverse('available-shift-stream'))
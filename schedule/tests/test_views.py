@@ -1,7 +1,10 @@
 import calendar
 import datetime
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
 
 from accounting.models import EventOccurrencePayment
@@ -9,7 +12,8 @@ from accounts.models import CustomUser, HostProfile
 from locations.models import City, State, Zip, Venue
 from schedule.filters import EventOccurrenceFilter
 from schedule.forms import EventOccurrenceForm, ChangeHostForm
-from schedule.models import Day, Time, Event, EventOccurrence
+from schedule.models import (
+    Day, Time, Event, EventExceptionDate, EventOccurrence)
 from schedule.views import (
     EventDetailView,
     EventOccurrenceListView,
@@ -21,11 +25,13 @@ from schedule.views import (
     PickUp,
     RequestOff,
     EventOccurrenceDetail,
+    materialize_event_occurrence,
 )
 
 
 class EventDetailViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         host = CustomUser.objects.create_user(
             username='carol', password='Ilovespaghetti')
         venue = Venue.objects.create(name='The Meatballery')
@@ -69,6 +75,8 @@ class EventDetailViewTests(TestCase):
         # self.assertNotContains(response, 'href="{0}"'.format(update_url))
 
 class EventOccurrenceListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
 
     def test_events_url_maps_to_event_occurrence_list_name(self):
         url = '/events/'
@@ -1310,6 +1318,28 @@ class PickUpViewTests(TestCase):
         success_url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
         self.assertRedirects(response, success_url)
         
+    def test_reverse_pick_up_name_second_host_told_shift_already_taken(self):
+        occurrence = EventOccurrence.objects.get(pk=1)
+        occurrence.date = datetime.date.today() + datetime.timedelta(days=1)
+        occurrence.time = Time.objects.create(time=datetime.time(20,0))
+        occurrence.save()
+        CustomUser.objects.create_user(username='matt', password='Iloveanimals')
+        url = reverse('pick-up', kwargs={'pk': 1})
+        self.client.login(username='matt', password='Iloveanimals')
+        self.client.post(url, {})
+        self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.post(url, {}, follow=True)
+        self.assertRedirects(
+            response, reverse('event-occurrence-list-available'))
+        self.assertContains(response, 'this shift has already been picked up')
+        occurrence.refresh_from_db()
+        self.assertEqual(str(occurrence.host), 'matt')
+
+    def test_reverse_pick_up_name_post_not_found_if_event_occurrence_does_not_exist(self):
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.post(reverse('pick-up', kwargs={'pk': 99}), {})
+        self.assertEqual(response.status_code, 404)
+
     def test_change_host_form_csrf(self):
         second_after_now = (datetime.datetime.now() + datetime.timedelta(seconds=1)).time()
         time = Time.objects.create(time=second_after_now)
@@ -1321,4 +1351,439 @@ class PickUpViewTests(TestCase):
         login = self.client.login(username='carol', password='Ilovespaghetti')
         url = reverse('pick-up', kwargs={'pk': 1})
         response = self.client.get(url)
-        self.assertContains(response, 'csrfmiddlewaretoken')
\ No newline at end of file
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+class VirtualOccurrenceListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        venue = Venue.objects.create(name='The Meatballery')
+        day = Day.objects.create(day=tomorrow.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        event = Event.objects.create(
+            venue=venue, host=host, day=day, time=time,
+            start_date=tomorrow, status='S')
+        event.generate_event_occurrences(weeks=2)
+
+    def test_reverse_event_occurrence_list_name_shows_virtual_occurrences_past_generated_dates(self):
+        event = Event.objects.get(pk=1)
+        far_date = event.start_date + datetime.timedelta(weeks=20)
+        response = self.client.get(reverse('event-occurrence-list'))
+        schedule = response.context['schedule']
+        self.assertEqual(len(schedule), 26)
+        self.assertEqual(len([occ for occ in schedule if occ.is_virtual]), 24)
+        self.assertIn(far_date, [occ.date for occ in schedule])
+        self.assertEqual(EventOccurrence.objects.count(), 2)
+
+    def test_reverse_event_occurrence_list_name_filters_virtual_occurrences(self):
+        event = Event.objects.get(pk=1)
+        state = State.objects.create(name='NJ')
+        venue = Venue.objects.create(name='Pet Shop', state=state)
+        event_2 = Event.objects.create(
+            venue=venue, day=event.day, time=event.time,
+            start_date=event.start_date, status='S')
+        event_2.generate_event_occurrences(weeks=2)
+        response = self.client.get(
+            reverse('event-occurrence-list'), {'event__venue__state': 'NJ'})
+        venues = set(occ.event.venue.name for occ in response.context['schedule'])
+        self.assertEqual(venues, {'Pet Shop'})
+
+    def test_reverse_event_occurrence_list_host_name_links_virtual_occurrences_to_materialize(self):
+        event = Event.objects.get(pk=1)
+        far_date = event.start_date + datetime.timedelta(weeks=20)
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
+        response = self.client.get(url)
+        materialize_url = reverse(
+            'event-occurrence-materialize',
+            args=[event.pk, far_date.strftime('%Y-%m-%d'), 'request-off'])
+        self.assertContains(
+            response, 'action="{0}" method="post"'.format(materialize_url))
+
+class EventOccurrenceListQueryCountTests(TestCase):
+    def setUp(self):
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        CustomUser.objects.create_user(
+            username='matt', password='Iloveanimals')
+        state = State.objects.create(name='NY')
+        city = City.objects.create(name='New York')
+        zip = Zip.objects.create(code='10001')
+        Time.objects.create(time=datetime.time(20,0))
+        for day in range(7):
+            Day.objects.create(day=day)
+        self.venue = Venue.objects.create(
+            name='The Meatballery', address='123 Street',
+            city=city, state=state, zip=zip)
+        self.client.login(username='carol', password='Ilovespaghetti')
+
+    def add_event_occurrences(self, weeks):
+        host = CustomUser.objects.get(username='carol')
+        cover = CustomUser.objects.get(username='matt')
+        event = Event.objects.create(
+            venue=self.venue, host=host, day=Day.objects.get(day=0),
+            time=Time.objects.get(time=datetime.time(20,0)))
+        first_date = datetime.date.today() - datetime.timedelta(weeks=weeks)
+        for week in range(weeks * 2):
+            date = first_date + datetime.timedelta(weeks=week)
+            occurrence = EventOccurrence.objects.create(
+                event=event, date=date, day=Day.objects.get(day=date.weekday()),
+                time=event.time, host=host if week % 2 else cover,
+                change_host=week % 3 == 0)
+            if week % 2:
+                occurrence.status = 'No Game'
+                occurrence.cancellation_reason = 'Holiday'
+                occurrence.save()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_event_occurrence_list_views_use_constant_number_of_queries(self):
+        urls = [
+            reverse('event-occurrence-list-host', kwargs={'username': 'carol'}),
+            reverse('event-occurrence-list-past-host', kwargs={'username': 'carol'}),
+            reverse('event-occurrence-list-future-host', kwargs={'username': 'carol'}),
+            reverse('event-occurrence-list-available'),
+            reverse('event-occurrence-list'),
+        ]
+        self.add_event_occurrences(weeks=2)
+        counts = [self.count_queries(url) for url in urls]
+        self.add_event_occurrences(weeks=6)
+        self.assertEqual([self.count_queries(url) for url in urls], counts)
+
+class EventOccurrenceListPaginationTests(TestCase):
+    def setUp(self):
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        venue = Venue.objects.create(name='The Meatballery')
+        self.time = Time.objects.create(time=datetime.time(20,0))
+        self.event = Event.objects.create(venue=venue, host=host)
+        first_date = datetime.date.today() - datetime.timedelta(days=119)
+        EventOccurrence.objects.bulk_create([
+            EventOccurrence(
+                event=self.event, host=host, time=self.time,
+                date=first_date + datetime.timedelta(days=days))
+            for days in range(120)])
+        self.client.login(username='carol', password='Ilovespaghetti')
+
+    def walk(self, url):
+        dates = []
+        params = {}
+        while True:
+            response = self.client.get(url, params)
+            dates += [occ.date for occ in response.context['event_occurrence_list']]
+            if not response.context['next_cursor']:
+                return dates
+            params = {'after': response.context['next_cursor']}
+
+    def test_reverse_event_occurrence_list_past_host_name_pages_through_every_occurrence_newest_first(self):
+        url = reverse('event-occurrence-list-past-host', kwargs={'username': 'carol'})
+        dates = self.walk(url)
+        self.assertEqual(len(dates), 120)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_reverse_event_occurrence_list_host_name_limits_page_size(self):
+        url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['event_occurrence_list']), 50)
+        self.assertContains(response, 'after={0}'.format(
+            response.context['next_cursor']))
+
+    def test_reverse_event_occurrence_list_host_name_keeps_ties_on_date_and_time_in_order(self):
+        host = CustomUser.objects.get(username='carol')
+        date = EventOccurrence.objects.order_by('date')[49].date
+        for i in range(3):
+            event = Event.objects.create(venue=self.event.venue, host=host)
+            EventOccurrence.objects.create(
+                event=event, host=host, time=self.time, date=date)
+        url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
+        pks = []
+        params = {}
+        while True:
+            response = self.client.get(url, params)
+            pks += [occ.pk for occ in response.context['event_occurrence_list']]
+            if not response.context['next_cursor']:
+                break
+            params = {'after': response.context['next_cursor']}
+        self.assertEqual(len(pks), 123)
+        self.assertEqual(len(set(pks)), 123)
+
+    def test_reverse_event_occurrence_list_host_name_fragment_renders_rows_only(self):
+        url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
+        response = self.client.get(url)
+        response = self.client.get(
+            url, {'after': response.context['next_cursor'], 'fragment': 1})
+        self.assertTemplateUsed(response, 'schedule/event_occurrence_list_rows.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertNotContains(response, '<table')
+        self.assertContains(response, 'class="next-page"')
+
+    def test_reverse_event_occurrence_list_host_name_not_found_for_invalid_cursor(self):
+        url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
+        response = self.client.get(url, {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_reverse_event_occurrence_list_host_name_uses_same_number_of_queries_on_later_pages(self):
+        url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(url)
+        with CaptureQueriesContext(connection) as second_page:
+            self.client.get(url, {'after': response.context['next_cursor']})
+        self.assertEqual(
+            len(first_page.captured_queries), len(second_page.captured_queries))
+
+    def test_reverse_event_occurrence_list_host_name_pages_through_virtual_occurrences(self):
+        host = CustomUser.objects.get(username='carol')
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        venue = Venue.objects.create(name='Pet Shop')
+        day = Day.objects.create(day=tomorrow.weekday())
+        event = Event.objects.create(
+            venue=venue, host=host, day=day, time=self.time,
+            start_date=tomorrow, status='S')
+        event.generate_event_occurrences(weeks=2)
+        url = reverse('event-occurrence-list-host', kwargs={'username': 'carol'})
+        occurrences = []
+        params = {}
+        while True:
+            response = self.client.get(url, params)
+            occurrences += response.context['event_occurrence_list']
+            if not response.context['next_cursor']:
+                break
+            params = {'after': response.context['next_cursor']}
+        self.assertEqual(len(occurrences), 120 + 26)
+        self.assertEqual(
+            len([occ for occ in occurrences if occ.is_virtual]), 24)
+        keys = [(occ.date, occ.time_id) for occ in occurrences]
+        self.assertEqual(keys, sorted(keys))
+
+class ScheduleMapViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        state = State.objects.create(name='NY')
+        city = City.objects.create(name='New York', state=state)
+        venue = Venue.objects.create(
+            name='The Meatballery', state=state, city=city)
+        day = Day.objects.create(day=tomorrow.weekday())
+        event = Event.objects.create(venue=venue, day=day)
+        EventOccurrence.objects.create(event=event, day=day, date=tomorrow)
+
+    def test_reverse_event_occurrence_list_name_links_current_schedule_map(self):
+        response = self.client.get(reverse('event-occurrence-list'))
+        url = reverse(
+            'schedule-map', args=[response.context['schedule_map_version']])
+        self.assertContains(response, 'schedule-map-url="{0}"'.format(url))
+
+    def test_reverse_schedule_map_name_returns_states_cities_and_days(self):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        response = self.client.get(reverse('event-occurrence-list'))
+        url = reverse(
+            'schedule-map', args=[response.context['schedule_map_version']])
+        schedule_map = self.client.get(url).json()
+        self.assertEqual(schedule_map['states'], {
+            'NY': {'cities': [1], 'days': [tomorrow.weekday()]}})
+        self.assertEqual(schedule_map['cities'], {
+            '1': {'name': 'New York', 'state': 'NY',
+                  'days': [tomorrow.weekday()]}})
+        self.assertEqual(schedule_map['days'], {
+            str(tomorrow.weekday()): calendar.day_abbr[tomorrow.weekday()]})
+
+    def test_reverse_schedule_map_name_is_cacheable_and_costs_no_queries(self):
+        response = self.client.get(reverse('event-occurrence-list'))
+        url = reverse(
+            'schedule-map', args=[response.context['schedule_map_version']])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_reverse_schedule_map_name_redirects_outdated_version(self):
+        version = self.client.get(
+            reverse('event-occurrence-list')).context['schedule_map_version']
+        response = self.client.get(reverse('schedule-map', args=['outdated']))
+        self.assertRedirects(response, reverse('schedule-map', args=[version]))
+
+    def test_reverse_day_dropdown_list_name_uses_schedule_map(self):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        url = reverse('day-dropdown-list')
+        self.client.get(url, {'state': 'NY'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'state': 'NY'})
+        self.assertContains(response, '<option value="{0}">{1}</option>'.format(
+            tomorrow.weekday(), calendar.day_abbr[tomorrow.weekday()]))
+
+# The cached schedule page is dropped when the write commits, which
+# TestCase never does.
+class ScheduleMapVersionTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        state = State.objects.create(name='NY')
+        venue = Venue.objects.create(
+            name='The Meatballery', state=state,
+            city=City.objects.create(name='New York', state=state))
+        self.day = Day.objects.create(day=tomorrow.weekday())
+        self.event = Event.objects.create(venue=venue, day=self.day)
+        EventOccurrence.objects.create(
+            event=self.event, day=self.day, date=tomorrow)
+
+    def test_schedule_map_version_changes_when_schedule_changes(self):
+        url = reverse('event-occurrence-list')
+        version = self.client.get(url).context['schedule_map_version']
+        EventOccurrence.objects.create(
+            event=self.event,
+            day=Day.objects.create(day=(self.day.day + 1) % 7),
+            date=datetime.date.today() + datetime.timedelta(days=2))
+        self.assertNotEqual(
+            self.client.get(url).context['schedule_map_version'], version)
+
+class MaterializeEventOccurrenceViewTests(TestCase):
+    def setUp(self):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        venue = Venue.objects.create(name='The Meatballery')
+        day = Day.objects.create(day=tomorrow.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        event = Event.objects.create(
+            venue=venue, host=host, day=day, time=time,
+            start_date=tomorrow, status='S')
+        self.far_date = tomorrow + datetime.timedelta(weeks=20)
+
+    def get_url(self, date, action='request-off'):
+        return reverse(
+            'event-occurrence-materialize',
+            args=[1, date.strftime('%Y-%m-%d'), action])
+
+    def test_materialize_url_resolves_to_materialize_view(self):
+        view = resolve(self.get_url(self.far_date))
+        self.assertEqual(view.func, materialize_event_occurrence)
+
+    def test_materialize_redirects_to_accounts_login_page_if_not_logged_in(self):
+        url = self.get_url(self.far_date)
+        response = self.client.post(url)
+        self.assertRedirects(
+            response, '{0}?next={1}'.format(reverse('login'), url))
+
+    def test_materialize_creates_occurrence_and_redirects_to_action(self):
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.post(self.get_url(self.far_date))
+        occurrence = EventOccurrence.objects.get()
+        self.assertEqual(occurrence.date, self.far_date)
+        self.assertEqual(occurrence.host.username, 'carol')
+        self.assertRedirects(
+            response, reverse('request-off', kwargs={'pk': occurrence.pk}))
+
+    def test_materialize_twice_reuses_occurrence(self):
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        self.client.post(self.get_url(self.far_date))
+        self.client.post(self.get_url(self.far_date))
+        self.assertEqual(EventOccurrence.objects.count(), 1)
+
+    def test_materialize_get_not_allowed(self):
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.get(self.get_url(self.far_date))
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(EventOccurrence.objects.count(), 0)
+
+    def test_materialize_by_other_user_not_found(self):
+        CustomUser.objects.create_user(
+            username='matt', password='Iloveanimals')
+        login = self.client.login(username='matt', password='Iloveanimals')
+        response = self.client.post(self.get_url(self.far_date))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(EventOccurrence.objects.count(), 0)
+
+    def test_materialize_by_staff_creates_occurrence(self):
+        CustomUser.objects.create_user(
+            username='matt', password='Iloveanimals', is_staff=True)
+        login = self.client.login(username='matt', password='Iloveanimals')
+        response = self.client.post(self.get_url(self.far_date))
+        self.assertEqual(EventOccurrence.objects.get().date, self.far_date)
+
+    def test_materialize_date_not_on_schedule_not_found(self):
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        off_date = self.far_date + datetime.timedelta(days=1)
+        response = self.client.post(self.get_url(off_date))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(EventOccurrence.objects.count(), 0)
+
+    def test_materialize_exception_date_not_found(self):
+        EventExceptionDate.objects.create(event_id=1, date=self.far_date)
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.post(self.get_url(self.far_date))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(EventOccurrence.objects.count(), 0)
+
+    def test_materialize_unknown_action_not_found(self):
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.post(self.get_url(self.far_date, 'delete'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_materialize_pick_up_action_not_found(self):
+        login = self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.post(self.get_url(self.far_date, 'pick-up'))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(EventOccurrence.objects.count(), 0)
+
+class EventOccurrenceListConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        host = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        venue = Venue.objects.create(name='The Meatballery')
+        day = Day.objects.create(day=tomorrow.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        self.event = Event.objects.create(
+            venue=venue, host=host, day=day, time=time)
+        self.event_occurrence = EventOccurrence.objects.create(
+            event=self.event, date=tomorrow, day=day, time=time, host=host)
+        self.url = reverse(
+            'event-occurrence-list-host', kwargs={'username': 'carol'})
+        self.client.login(username='carol', password='Ilovespaghetti')
+
+    def test_event_occurrence_list_sets_private_etag(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_event_occurrence_list_not_modified_if_etag_matches(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertTemplateNotUsed(
+                'schedule/event_occurrence_list.html'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_event_occurrence_list_etag_changes_when_occurrence_saved(self):
+        etag = self.client.get(self.url)['ETag']
+        self.event_occurrence.notes = 'Bring extra pencils'
+        self.event_occurrence.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_event_occurrence_list_etag_changes_when_venue_saved(self):
+        etag = self.client.get(self.url)['ETag']
+        venue = self.event.venue
+        venue.name = 'The Meatball Shop'
+        venue.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_event_occurrence_list_etag_differs_between_users(self):
+        etag = self.client.get(self.url)['ETag']
+        CustomUser.objects.create_user(
+            username='matt', password='Iloveanimals')
+        self.client.login(username='matt', password='Iloveanimals')
+        response = self.client.get(
+            reverse('event-occurrence-list-available'),
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
@@ -1,12 +1,18 @@
 from django.urls import path
 
+from triviacompany.cache import cache_anonymous_page
+
 from . import views
 
 urlpatterns = [
-    path('events/', views.EventOccurrenceListView.as_view(
-            template_name = 'schedule/event_occurrence_list_with_filter.html'),
+    path('events/', cache_anonymous_page(views.EventOccurrenceListView.as_view(
+            template_name = 'schedule/event_occurrence_list_with_filter.html',
+            fragment_template_name = (
+                'schedule/event_occurrence_list_with_filter_rows.html'),
+            include_virtual=True)),
         name='event-occurrence-list'),
-    path('event-details/<int:pk>/', views.EventDetailView.as_view(),
+    path('event-details/<int:pk>/',
+        cache_anonymous_page(views.EventDetailView.as_view()),
         name='event-detail'),
     path('events/<int:pk>/update/', views.EventOccurrenceUpdate.as_view(),
         name='event-occurrence-update'),
@@ -16,8 +22,13 @@ urlpatterns = [
         name='request-off'),
     path('events/<int:pk>/pick-up/', views.PickUp.as_view(),
         name='pick-up'),
+    path('events/schedule/<int:event_pk>/<str:date>/<str:action>/',
+        views.materialize_event_occurrence,
+        name='event-occurrence-materialize'),
     path('events/available/', views.EventOccurrenceListViewAvailable.as_view(),
         name='event-occurrence-list-available'),
+    path('events/available/stream/', views.available_shift_stream,
+        name='available-shift-stream'),
     path('events/<str:username>/all/', views.EventOccurrenceListViewHost.as_view(),
         name='event-occurrence-list-host'),
     path('events/<str:username>/past/', views.EventOccurrenceListViewPastHost.as_view(),
@@ -25,4 +36,8 @@ urlpatterns = [
     path('events/<str:username>/future/', views.EventOccurrenceListViewFutureHost.as_view(),
         name='event-occurrence-list-future-host'),
     path('events/ajax/days/', views.load_days, name='day-dropdown-list'),
+    path('events/calendar/<str:token>.ics', views.event_occurrence_calendar,
+        name='event-occurrence-calendar'),
+    path('events/ajax/schedule-map/<str:version>/', views.schedule_map,
+        name='schedule-map'),
     ]
\ No newline at end of file
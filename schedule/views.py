@@ -1,43 +1,175 @@
 import datetime
 
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Q
-from django.http import Http404
+from django.db.models import Count, Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect, reverse
 from django.views import generic
 from django.views.generic.edit import UpdateView
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_POST
 
+from triviacompany.cache import ConditionalGetMixin, get_queryset_version
+
+from .calendars import (
+    generate_calendar, get_calendar_etag, get_calendar_event_occurrences,
+    get_calendar_name, get_calendar_url, read_calendar_token)
+from .facets import get_schedule_map, load_facet_index
 from .filters import EventOccurrenceFilter
 from .forms import ChangeHostForm, EventOccurrenceForm
-from .models import Event, EventOccurrence, Day
+from .models import (
+    Event, EventOccurrence, Day, annotate_event_occurrence_list,
+    expand_events, merge_virtual_occurrences, occurred_before,
+    pick_up_event_occurrence)
+from .pagination import decode_cursor, paginate_event_occurrences
+from .shifts import stream_shift_changes
+
+VIRTUAL_OCCURRENCE_WEEKS = 26
+SCHEDULE_MAP_MAX_AGE = 60 * 60 * 24 * 365
+# Only actions that make sense on a row that does not exist yet: a
+# virtual occurrence has no cover to pick up and nothing to report on.
+MATERIALIZE_ACTIONS = {
+    'request-off': 'request-off',
+}
+
+def merge_virtual_schedule(event_occurrences, events,
+                           weeks=VIRTUAL_OCCURRENCE_WEEKS):
+    today = datetime.date.today()
+    events = (events
+                 .filter(status__in=['S', 'A', 'E'])
+                 .select_related(
+                     'venue__city', 'venue__state', 'venue__zip',
+                     'host', 'day', 'time'))
+    return merge_virtual_occurrences(
+        event_occurrences, events, today,
+        today + datetime.timedelta(weeks=weeks))
+
+class HostVirtualOccurrenceMixin:
+
+    def get_virtual_events(self):
+        return Event.objects.filter(host=self.request.user)
 
-class EventDetailView(generic.DetailView):
+    def get_calendar_url(self):
+        return get_calendar_url('host', self.request.user.pk)
+
+class EventDetailView(ConditionalGetMixin, generic.DetailView):
     model = Event
     context_object_name = 'event'
     template_name = 'schedule/event_detail.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        venue = self.object.venue
+        if venue and not self.object.is_private:
+            context['calendar_url'] = get_calendar_url('venue', venue.pk)
+            if venue.state_id:
+                context['region_calendar_url'] = get_calendar_url(
+                    'region', venue.state_id)
+        return context
+
+    def get_etag_parts(self):
+        event = Event.objects.filter(pk=self.kwargs['pk'])
+        return [get_queryset_version(
+            event, 'modified', 'venue__modified', 'images__pk')]
     
-class EventOccurrenceListView(generic.ListView):
+class EventOccurrenceListView(ConditionalGetMixin, generic.ListView):
     model = EventOccurrence
     context_object_name = 'event_occurrence_list'
     template_name = 'schedule/event_occurrence_list.html'
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    fragment_template_name = 'schedule/event_occurrence_list_rows.html'
+    include_virtual = False
+    descending = False
+
+    def get_queryset(self):
+        return EventOccurrence.objects.all()
+
+    def get_template_names(self):
+        if 'fragment' in self.request.GET:
+            return [self.fragment_template_name]
+        return super().get_template_names()
+
+    def get_virtual_events(self):
+        return None
+
+    def paginate(self, queryset, events=None):
+        try:
+            after = self.request.GET.get('after')
+            after = after and decode_cursor(after)
+        except ValueError:
+            raise Http404
+        merge = None
+        if events is not None:
+            merge = lambda event_occurrences: merge_virtual_schedule(
+                event_occurrences, events)
+        return paginate_event_occurrences(
+            annotate_event_occurrence_list(queryset), after,
+            descending=self.descending, merge=merge)
+
+    def get_event_occurrence_filter(self):
         now = datetime.datetime.now()
         event_occurrence_list_future = EventOccurrence.objects.filter(
             date__gte=now).order_by('date')
-        event_occurrence_filter = EventOccurrenceFilter(
+        return EventOccurrenceFilter(
             self.request.GET, queryset=event_occurrence_list_future)
+
+    def get_schedule(self, event_occurrence_filter):
+        # The saved occurrences to list and the events whose virtual
+        # occurrences are merged into them.
+        if self.include_virtual:
+            return (
+                event_occurrence_filter.qs.exclude(event__is_private=True),
+                event_occurrence_filter.filter_events(
+                    Event.objects.filter(is_private=False)))
+        return self.get_queryset(), self.get_virtual_events()
+
+    def get_calendar_url(self):
+        return None
+
+    def get_etag_parts(self):
+        now = datetime.datetime.now()
+        event_occurrences, events = self.get_schedule(
+            self.get_event_occurrence_filter())
+        parts = [get_queryset_version(
+            event_occurrences, 'modified', 'event__modified',
+            'event__venue__modified', 'event_occurrence_payments__modified',
+            passed=Count('pk', filter=occurred_before(now)),
+            late=Count('pk', filter=occurred_before(
+                now - datetime.timedelta(days=2))))]
+        if events is not None:
+            parts.append(get_queryset_version(events, 'modified'))
+        if self.include_virtual:
+            parts.append(load_facet_index()['version'])
+        return parts
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        event_occurrence_filter = self.get_event_occurrence_filter()
         context['filter'] = event_occurrence_filter
+        event_occurrences, events = self.get_schedule(event_occurrence_filter)
+        list_name = 'event_occurrence_list'
+        if self.include_virtual:
+            list_name = 'schedule'
+            context['schedule_map_version'] = load_facet_index()['version']
+        context[list_name], next_cursor = self.paginate(
+            event_occurrences, events)
+        context['next_cursor'] = next_cursor
+        context['calendar_url'] = self.get_calendar_url()
+        if next_cursor:
+            query = self.request.GET.copy()
+            query['after'] = next_cursor
+            query.pop('fragment', None)
+            context['next_query'] = query.urlencode()
         return context
     
 class EventOccurrenceListViewPast(EventOccurrenceListView):
+    descending = True
 
     def get_queryset(self):
         now = datetime.datetime.now()
-        event_occurrence_list = EventOccurrence.objects.filter(
+        event_occurrence_list = super().get_queryset().filter(
             date__lte=now).order_by('-date')
         return event_occurrence_list
         
@@ -45,7 +177,7 @@ class EventOccurrenceListViewFuture(EventOccurrenceListView):
 
     def get_queryset(self):
         now = datetime.datetime.now()
-        event_occurrence_list = EventOccurrence.objects.filter(
+        event_occurrence_list = super().get_queryset().filter(
             date__gte=now).order_by('date')
         return event_occurrence_list
         
@@ -53,11 +185,20 @@ class EventOccurrenceListViewAvailable(LoginRequiredMixin, EventOccurrenceListVi
 
     def get_queryset(self):
         now = datetime.datetime.now()
-        event_occurrence_list = EventOccurrence.objects.filter(
+        event_occurrence_list = super().get_queryset().filter(
             change_host=True, date__gte=now).order_by('date')
         return event_occurrence_list
 
-class EventOccurrenceListViewHost(LoginRequiredMixin, EventOccurrenceListView):
+    def get_calendar_url(self):
+        return get_calendar_url('available', self.request.user.pk)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['shift_stream_url'] = reverse('available-shift-stream')
+        return context
+
+class EventOccurrenceListViewHost(
+        LoginRequiredMixin, HostVirtualOccurrenceMixin, EventOccurrenceListView):
         
     def get_queryset(self):
         event_occurrence_list = super().get_queryset()
@@ -79,7 +220,9 @@ class EventOccurrenceListViewPastHost(LoginRequiredMixin, EventOccurrenceListVie
         else:
             raise Http404
         
-class EventOccurrenceListViewFutureHost(LoginRequiredMixin, EventOccurrenceListViewFuture):
+class EventOccurrenceListViewFutureHost(
+        LoginRequiredMixin, HostVirtualOccurrenceMixin,
+        EventOccurrenceListViewFuture):
 
     def get_queryset(self):
         event_occurrence_list = super().get_queryset()
@@ -205,26 +348,95 @@ class PickUp(LoginRequiredMixin, UpdateView):
         context['input_value'] = 'Yes, Pick Up'
         return context
     
-    def form_valid(self, form):
-        form.instance.change_host = False
-        form.instance.host = self.request.user
+    def post(self, request, *args, **kwargs):
+        # Decided by a conditional UPDATE rather than a form save, so only
+        # the first of several simultaneous submissions gets the shift.
+        if not pick_up_event_occurrence(self.kwargs['pk'], request.user):
+            get_object_or_404(EventOccurrence, pk=self.kwargs['pk'])
+            messages.warning(
+                request, 'Sorry, this shift has already been picked up '
+                'or is no longer available.')
+            return redirect('event-occurrence-list-available')
         messages.info(
-            self.request, 'Thanks for picking up the shift! '
+            request, 'Thanks for picking up the shift! '
             'Mark your calendar and check the details page '
             'for further information.')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
         
     def get_success_url(self):
         return reverse(
             'event-occurrence-list-host',
             kwargs={'username': self.request.user.username })
             
+@login_required
+@require_POST
+def materialize_event_occurrence(request, event_pk, date, action):
+    event = get_object_or_404(Event, pk=event_pk)
+    if event.host_id != request.user.pk and not request.user.is_staff:
+        raise Http404
+    try:
+        date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        raise Http404
+    if (action not in MATERIALIZE_ACTIONS
+            or date not in expand_events([event], date, date).get(event.pk, [])):
+        raise Http404
+    event_occurrence, created = EventOccurrence.objects.get_or_create(
+        event=event, date=date,
+        defaults={'day': event.day, 'time': event.time, 'host': event.host})
+    return redirect(
+        reverse(MATERIALIZE_ACTIONS[action], kwargs={'pk': event_occurrence.pk}))
+
+def schedule_map(request, version):
+    # The URL carries the version, so a response never goes stale and
+    # browsers can keep it; outdated versions redirect to the current one.
+    facet_index = load_facet_index()
+    if version != facet_index['version']:
+        return redirect('schedule-map', version=facet_index['version'])
+    response = JsonResponse(get_schedule_map(facet_index))
+    patch_cache_control(
+        response, public=True, max_age=SCHEDULE_MAP_MAX_AGE, immutable=True)
+    return response
+
 def load_days(request):
-    state_id = request.GET.get('state')
-    if state_id:
-        days = Day.objects.filter(event_occurrences__event__venue__state_id=state_id).distinct()
+    schedule_map = get_schedule_map(load_facet_index())
+    state = schedule_map['states'].get(request.GET.get('state'))
+    if state:
+        day_ids = state['days']
     else:
-        days = Day.objects.filter(
-            event_occurrences__isnull=False,
-            event_occurrences__date__gte=datetime.date.today()).distinct()
-    return render(request, 'schedule/day_dropdown_list.html', {'days': days})
\ No newline at end of file
+        day_ids = [int(day_id) for day_id in schedule_map['days']]
+    days = [Day(day=day_id) for day_id in day_ids]
+    return render(request, 'schedule/day_dropdown_list.html', {'days': days})
+
+@login_required
+def available_shift_stream(request):
+    # Server-sent events for shifts being released and picked up, so the
+    # available list can update in place instead of being reloaded.
+    after = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('after')
+    try:
+        after = int(after) if after else None
+    except ValueError:
+        after = None
+    response = StreamingHttpResponse(
+        stream_shift_changes(after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@condition(etag_func=lambda request, token: get_calendar_etag(token))
+def event_occurrence_calendar(request, token):
+    # Saved and virtual occurrences from a fixed handful of queries,
+    # streamed straight into the response; no templates.
+    calendar = read_calendar_token(token)
+    if calendar is None:
+        raise Http404
+    kind, pk = calendar
+    event_occurrences = get_calendar_event_occurrences(kind, pk)
+    response = StreamingHttpResponse(
+        generate_calendar(
+            event_occurrences, get_calendar_name(kind, pk),
+            request.get_host()),
+        content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = 'inline; filename="{0}.ics"'.format(kind)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,103 @@
+import datetime
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.core.checks import Error, Tags, register
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+PUBLIC_PAGE_TIMEOUT = 60 * 15
+PUBLIC_PAGE_VERSION_KEY = 'public-pages:version'
+PUBLIC_PAGE_KEY = 'public-pages:{0}:{1}:{2}'
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# The public page version and the facet index and its lock are shared
+# through the default cache, so outside of development every web worker
+# and management command has to see the same one. REQUIRE_SHARED_CACHE
+# follows DEBUG as configured, not as the test runner resets it.
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if (not settings.REQUIRE_SHARED_CACHE
+            or backend not in PROCESS_LOCAL_CACHES):
+        return []
+    return [Error(
+        'The default cache backend {0} is not shared between '
+        'processes.'.format(backend),
+        hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared cache, '
+             'such as memcached or Redis.',
+        id='triviacompany.E001')]
+
+# Every cached public page is keyed by a shared version, so a single
+# increment drops them all whenever the schedule, venues or hosts change.
+def get_public_page_version():
+    version = cache.get(PUBLIC_PAGE_VERSION_KEY)
+    if version is None:
+        cache.add(PUBLIC_PAGE_VERSION_KEY, int(time.time()), None)
+        version = cache.get(PUBLIC_PAGE_VERSION_KEY)
+    return version
+
+def invalidate_public_pages():
+    try:
+        cache.incr(PUBLIC_PAGE_VERSION_KEY)
+    except ValueError:
+        get_public_page_version()
+
+def cache_anonymous_page(view):
+    @wraps(view)
+    def wrapped_view(request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated):
+            return view(request, *args, **kwargs)
+        key = PUBLIC_PAGE_KEY.format(
+            get_public_page_version(), datetime.date.today(),
+            hashlib.md5(request.get_full_path().encode()).hexdigest())
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            if (response.status_code == 200
+                    and not response.cookies
+                    and not len(messages.get_messages(request))):
+                cache.set(key, response, PUBLIC_PAGE_TIMEOUT)
+        return response
+    return wrapped_view
+
+def get_queryset_version(queryset, *fields, **aggregates):
+    # A cheap fingerprint of the rows a page shows: how many there are and
+    # the latest modification stamp of each model involved.
+    aggregates['count'] = Count('pk')
+    for field in fields:
+        aggregates[field.replace('__', '_')] = Max(field)
+    return sorted(queryset.order_by().aggregate(**aggregates).items())
+
+class ConditionalGetMixin:
+    # Views list what their page depends on in get_etag_parts(); a matching
+    # If-None-Match is answered with 304 before the template is rendered.
+
+    def get_etag_parts(self):
+        return []
+
+    def get_etag(self, request, *args, **kwargs):
+        if len(messages.get_messages(request)):
+            return None
+        parts = [
+            request.user.pk, request.get_full_path(), datetime.date.today()]
+        parts += self.get_etag_parts()
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        view = condition(etag_func=self.get_etag)(super().dispatch)
+        response = view(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
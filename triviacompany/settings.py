@@ -96,6 +96,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+# Checked at startup (see triviacompany.cache.check_shared_cache).
+REQUIRE_SHARED_CACHE = config(
+    'REQUIRE_SHARED_CACHE', default=not DEBUG, cast=bool)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -161,3 +177,11 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 
 DEFAULT_FROM_EMAIL = 'Trivia City <noreply@triviacityevents.com>'
 EMAIL_SUBJECT_PREFIX = '[Trivia City]'
+
+# Originator details for the NACHA payroll export.
+ACH_IMMEDIATE_DESTINATION = config('ACH_IMMEDIATE_DESTINATION', default='')
+ACH_IMMEDIATE_DESTINATION_NAME = config('ACH_IMMEDIATE_DESTINATION_NAME', default='')
+ACH_IMMEDIATE_ORIGIN = config('ACH_IMMEDIATE_ORIGIN', default='')
+ACH_COMPANY_NAME = config('ACH_COMPANY_NAME', default='Trivia City')
+ACH_COMPANY_ID = config('ACH_COMPANY_ID', default='')
+ACH_ORIGINATING_DFI = config('ACH_ORIGINATING_DFI', default='')
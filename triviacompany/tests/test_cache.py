@@ -0,0 +1,115 @@
+import datetime
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import CustomUser, HostProfile
+from locations.models import Venue
+from schedule.models import Day, Time, Event, EventOccurrence, update_event_statuses
+from triviacompany.cache import check_shared_cache, get_public_page_version
+
+# Pages are invalidated when the write commits, which TestCase never does.
+class PublicPageCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.venue = Venue.objects.create(name='The Meatballery')
+        self.event = Event.objects.create(venue=self.venue)
+        self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+
+    def test_anonymous_public_pages_are_served_from_cache(self):
+        urls = [
+            reverse('event-occurrence-list'),
+            reverse('venue-list'),
+            reverse('host-profile-list'),
+            reverse('event-detail', kwargs={'pk': self.event.pk}),
+        ]
+        for url in urls:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_cached_pages_are_keyed_by_query_string(self):
+        url = reverse('event-occurrence-list')
+        self.client.get(url, {'day': '1'})
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url, {'day': '2'})
+        self.assertTrue(context.captured_queries)
+
+    def test_logged_in_users_bypass_cache(self):
+        CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        url = reverse('venue-list')
+        self.client.get(url)
+        self.client.login(username='carol', password='Ilovespaghetti')
+        response = self.client.get(url)
+        self.assertIn('user', response.context)
+
+    def test_saving_event_occurrence_invalidates_public_schedule(self):
+        url = reverse('event-occurrence-list')
+        self.client.get(url)
+        EventOccurrence.objects.create(event=self.event, date=self.tomorrow)
+        response = self.client.get(url)
+        self.assertContains(response, 'The Meatballery')
+
+    def test_saving_venue_invalidates_venue_list(self):
+        url = reverse('venue-list')
+        self.client.get(url)
+        self.venue.name = 'Pet Shop'
+        self.venue.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Pet Shop')
+
+    def test_saving_host_profile_invalidates_host_list(self):
+        url = reverse('host-profile-list')
+        user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti', first_name='Carol')
+        self.client.get(url)
+        host_profile = HostProfile.objects.get_or_create(user=user)[0]
+        host_profile.bio = 'Loves spaghetti trivia.'
+        host_profile.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Loves spaghetti trivia.')
+
+    def test_updating_event_statuses_invalidates_public_schedule(self):
+        day = Day.objects.create(day=self.tomorrow.weekday())
+        time = Time.objects.create(time=datetime.time(20,0))
+        event = Event.objects.create(
+            venue=Venue.objects.create(name='Pet Shop'), day=day, time=time,
+            start_date=self.tomorrow, status='S')
+        Event.objects.filter(pk=event.pk).update(status='T')
+        url = reverse('event-occurrence-list')
+        self.assertNotContains(self.client.get(url), 'Pet Shop')
+        update_event_statuses()
+        self.assertContains(self.client.get(url), 'Pet Shop')
+
+    def test_rolled_back_write_keeps_cached_pages(self):
+        version = get_public_page_version()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.venue.name = 'Pet Shop'
+                self.venue.save()
+                self.assertEqual(get_public_page_version(), version)
+                raise ValueError
+        self.assertEqual(get_public_page_version(), version)
+
+class SharedCacheCheckTests(SimpleTestCase):
+    @override_settings(REQUIRE_SHARED_CACHE=True, CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_an_error_when_shared_cache_required(self):
+        errors = check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['triviacompany.E001'])
+
+    @override_settings(REQUIRE_SHARED_CACHE=False, CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_allowed_in_development(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(REQUIRE_SHARED_CACHE=True, CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cache'}})
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_shared_cache(None), [])
@@ -0,0 +1,59 @@
+import datetime
+
+from django.test import TestCase
+
+from accounting.models import Reimbursement, edited
+from accounts.models import CustomUser
+
+class FieldTrackerMixinTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='carol', password='Ilovespaghetti')
+        Reimbursement.objects.create(
+            user=cls.user, amount='2.00', category='GS',
+            purchase_date=datetime.date(2019, 8, 5))
+
+    def test_loaded_instance_reports_changed_fields_without_queries(self):
+        reimbursement = Reimbursement.objects.get()
+        reimbursement.purchase_date = datetime.date(2019, 8, 6)
+        reimbursement.description = 'Pencils'
+        with self.assertNumQueries(0):
+            dirty_fields = reimbursement.get_dirty_fields()
+        self.assertEqual(dirty_fields, ['purchase_date', 'description'])
+
+    def test_values_equal_to_the_loaded_ones_are_not_dirty(self):
+        reimbursement = Reimbursement.objects.get()
+        reimbursement.amount = '2.00'
+        reimbursement.user = self.user
+        reimbursement.purchase_date = datetime.date(2019, 8, 5)
+        self.assertEqual(reimbursement.get_dirty_fields(), [])
+
+    def test_saving_resets_the_loaded_values(self):
+        reimbursement = Reimbursement.objects.get()
+        reimbursement.category = 'E'
+        reimbursement.save()
+        self.assertEqual(reimbursement.get_dirty_fields(), [])
+
+    def test_instance_built_by_hand_has_nothing_to_compare(self):
+        reimbursement = Reimbursement(pk=Reimbursement.objects.get().pk)
+        self.assertIsNone(reimbursement.get_dirty_fields())
+
+    def test_deferred_fields_are_not_tracked(self):
+        reimbursement = Reimbursement.objects.only('pk', 'amount').get()
+        reimbursement.amount = '3.00'
+        self.assertEqual(reimbursement.get_dirty_fields(), ['amount'])
+
+    def test_edited_uses_loaded_values_without_refetching(self):
+        reimbursement = Reimbursement.objects.get()
+        reimbursement.category = 'E'
+        with self.assertNumQueries(0):
+            self.assertTrue(edited(reimbursement, ['category']))
+            self.assertFalse(edited(reimbursement, ['amount']))
+
+    def test_edited_refetches_an_instance_built_by_hand(self):
+        reimbursement = Reimbursement(
+            pk=Reimbursement.objects.get().pk, user=self.user,
+            category='GS', amount='2.00')
+        with self.assertNumQueries(1):
+            self.assertTrue(edited(reimbursement, ['purchase_date']))
@@ -0,0 +1,42 @@
+from django.core.exceptions import ValidationError
+
+# Remembers the values a row was loaded (or last saved) with, so a save()
+# override can tell which fields changed without reading the row again.
+class FieldTrackerMixin:
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_fields()
+        return instance
+
+    def get_tracked_value(self, field):
+        value = getattr(self, field.attname)
+        try:
+            # Compares '2.00' and Decimal('2.00') or a file and its name as
+            # the database would.
+            return field.get_prep_value(value)
+        except (TypeError, ValueError, ValidationError):
+            return value
+
+    def snapshot_fields(self):
+        deferred = self.get_deferred_fields()
+        self.loaded_values = {
+            field.attname: self.get_tracked_value(field)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred}
+
+    def get_dirty_fields(self):
+        # None when there is nothing to compare against, i.e. the instance
+        # was built by hand rather than loaded.
+        loaded_values = getattr(self, 'loaded_values', None)
+        if loaded_values is None:
+            return None
+        return [field.name for field in self._meta.concrete_fields
+                if field.attname in loaded_values
+                and loaded_values[field.attname]
+                    != self.get_tracked_value(field)]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.snapshot_fields()